@@ -0,0 +1,467 @@
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import weakref
+
+from . import lazy
+
+numpy = lazy.module('numpy')
+pandas = lazy.module('pandas')
+
+ATH_PERIOD = 260
+SMA_PERIOD = 100
+
+
+def shift_rows(values):
+    shifted = numpy.empty_like(values, dtype='float64')
+    shifted[:1] = numpy.nan
+    shifted[1:] = values[:-1]
+    return shifted
+
+
+def nan_counts(values):
+    counts = numpy.zeros((values.shape[0] + 1,) + values.shape[1:], dtype='int32')
+    numpy.cumsum(numpy.isnan(values), axis=0, dtype='int32', out=counts[1:])
+    return counts
+
+
+def nan_windows(counts, window):
+    # True where the trailing window ending on that row holds at least one NaN,
+    # which is where pandas' rolling(window) (min_periods=window) yields NaN.
+    has_nan = numpy.ones(counts[1:].shape, dtype=bool)
+    has_nan[window - 1:] = (counts[window:] - counts[:-window]) > 0
+    return has_nan
+
+
+def _rolling_reduce(values, window, ufunc, has_nan):
+    # Sparse-table reduction along the date axis: log2(window) passes over the
+    # whole matrix instead of one pandas rolling object per column.
+    rows = values.shape[0]
+    out = numpy.full(values.shape, numpy.nan)
+    if rows < window:
+        return out
+    table = values
+    span = 1
+    while span * 2 <= window:
+        table = ufunc(table[:-span], table[span:])
+        span *= 2
+    out[window - 1:] = ufunc(table[:rows - window + 1], table[window - span:])
+    if has_nan is None:
+        has_nan = nan_windows(nan_counts(values), window)
+    out[has_nan] = numpy.nan
+    return out
+
+
+def rolling_max(values, window, has_nan=None):
+    return _rolling_reduce(values, window, numpy.fmax, has_nan)
+
+
+def rolling_min(values, window, has_nan=None):
+    return _rolling_reduce(values, window, numpy.fmin, has_nan)
+
+
+def rolling_mean(values, window, has_nan=None):
+    rows = values.shape[0]
+    out = numpy.full(values.shape, numpy.nan)
+    if rows < window:
+        return out
+    sums = numpy.zeros((rows + 1,) + values.shape[1:])
+    numpy.cumsum(numpy.nan_to_num(values), axis=0, out=sums[1:])
+    out[window - 1:] = (sums[window:] - sums[:-window]) / window
+    if has_nan is None:
+        has_nan = nan_windows(nan_counts(values), window)
+    out[has_nan] = numpy.nan
+    return out
+
+
+class RollingMean:
+    # Row-at-a-time port of pandas' roll_mean (Kahan-compensated add/remove,
+    # flat-window and sign clamps) over every symbol at once, so a running
+    # SMA resolves price == SMA ties exactly as Series.rolling().mean() does.
+    def __init__(self, width):
+        self.nobs = numpy.zeros(width, dtype='int64')
+        self.neg_ct = numpy.zeros(width, dtype='int64')
+        self.sum_x = numpy.zeros(width)
+        self.compensation_add = numpy.zeros(width)
+        self.compensation_remove = numpy.zeros(width)
+        self.same_count = numpy.zeros(width, dtype='int64')
+        self.prev_value = numpy.full(width, numpy.nan)
+
+    def add(self, values):
+        valid = ~numpy.isnan(values)
+        val = numpy.where(valid, values, 0.0)
+        y = val - self.compensation_add
+        t = self.sum_x + y
+        numpy.copyto(self.compensation_add, t - self.sum_x - y, where=valid)
+        numpy.copyto(self.sum_x, t, where=valid)
+        self.nobs += valid
+        self.neg_ct += valid & numpy.signbit(val)
+        same = val == self.prev_value
+        self.same_count[same & valid] += 1
+        self.same_count[~same & valid] = 1
+        numpy.copyto(self.prev_value, values, where=valid)
+
+    def remove(self, values):
+        valid = ~numpy.isnan(values)
+        val = numpy.where(valid, values, 0.0)
+        y = -val - self.compensation_remove
+        t = self.sum_x + y
+        numpy.copyto(self.compensation_remove, t - self.sum_x - y, where=valid)
+        numpy.copyto(self.sum_x, t, where=valid)
+        self.nobs -= valid
+        self.neg_ct -= valid & numpy.signbit(val)
+
+    def mean(self, min_periods):
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            result = self.sum_x / self.nobs
+        result = numpy.where(self.same_count >= self.nobs, self.prev_value, result)
+        result = numpy.where((self.neg_ct == 0) & (result < 0), 0.0, result)
+        result = numpy.where((self.neg_ct == self.nobs) & (result > 0), 0.0, result)
+        return numpy.where((self.nobs >= min_periods) & (self.nobs > 0), result, numpy.nan)
+
+
+def _exact_sma(prices, previous, sma, window):
+    # The prefix-sum mean is off by a few ulps from pandas' compensated
+    # rolling mean, which decides price == SMA ties (flat windows of a
+    # suspended stock, two-decimal prices averaging to a tick). Recompute
+    # only the columns holding a near tie with pandas itself.
+    scale = numpy.abs(numpy.nan_to_num(previous)).sum(axis=0)
+    bound = 4 * previous.shape[0] * numpy.finfo('float64').eps * scale / window
+    with numpy.errstate(invalid='ignore'):
+        near_tie = (numpy.abs(prices - sma) <= bound).any(axis=0)
+    if near_tie.any():
+        sma[:, near_tie] = pandas.DataFrame(previous[:, near_tie]).rolling(window).mean().to_numpy()
+    return sma
+
+
+def breadth_signals(prices, ath_period=ATH_PERIOD, sma_period=SMA_PERIOD):
+    prices = numpy.asarray(prices, dtype='float64')
+    previous = shift_rows(prices)
+    counts = nan_counts(previous)
+    ath_nan = nan_windows(counts, ath_period)
+    ath_threshold = rolling_max(previous, ath_period, ath_nan)
+    atl_threshold = rolling_min(previous, ath_period, ath_nan)
+    sma_threshold = rolling_mean(previous, sma_period, nan_windows(counts, sma_period))
+    sma_threshold = _exact_sma(prices, previous, sma_threshold, sma_period)
+    with numpy.errstate(invalid='ignore'):
+        return {'is_ath': prices >= ath_threshold,
+                'is_atl': prices <= atl_threshold,
+                'above_sma': prices >= sma_threshold,
+                'below_sma': prices < sma_threshold}
+
+
+def membership(symbols, universes=None):
+    """(names, symbols x universes matrix) of a {name: bool mask} dict, ALL
+    (every symbol) when universes is None."""
+    if universes is None:
+        universes = {'ALL': numpy.ones(len(symbols), dtype=bool)}
+    names = list(universes)
+    masks = numpy.zeros((len(symbols), len(names)), dtype='float32')
+    for column, name in enumerate(names):
+        masks[:, column] = universes[name]
+    return names, masks
+
+
+def universe_counts(signal, masks):
+    """Members of each universe where signal holds, per row: one product of
+    the rows x symbols signal with the symbols x universes masks. float32
+    counts are exact far beyond any number of listed symbols."""
+    return numpy.rint(numpy.asarray(signal, dtype='float32') @ masks).astype('int64')
+
+
+def summarize(index, number_high, number_low, number_above_sma, stock_amount):
+    summary_df = pandas.DataFrame(index=index)
+    summary_df['number_high'] = number_high
+    summary_df['number_low'] = number_low
+    summary_df['percent_high'] = round(summary_df['number_high'] / stock_amount*100,2)
+    summary_df['percent_low'] = round(summary_df['number_low'] / stock_amount*100,2)
+
+    summary_df['number_above_sma'] = number_above_sma
+    summary_df['number_below_sma'] = stock_amount-summary_df['number_above_sma']
+    summary_df['percent_above_sma'] = round(summary_df['number_above_sma'] / stock_amount*100,2)
+    summary_df['percent_below_sma'] = round(summary_df['number_below_sma'] / stock_amount*100,2)
+    return summary_df
+
+
+def stocks_above_sma(symbols, last_above_sma, prices_df, vol_df, val_df):
+    symbol_list = pandas.Index(symbols)[numpy.asarray(last_above_sma, dtype=bool)]
+    prices = prices_df[symbol_list].tail(2).to_numpy()
+    volumes = vol_df[symbol_list].tail(1).to_numpy()
+    values = val_df[symbol_list].tail(1).to_numpy()
+
+    result = pandas.DataFrame()
+    result['symbol'] = symbol_list
+    result['last'] = ["{:.2f}".format(round(p,2)) for p in prices[-1]]
+    result['change'] = ["{:.2f}".format(round(p1-p0,2)) for p0, p1 in zip(prices[0], prices[-1])]
+    result['pct_change'] = ["{:.2f}".format(round((p1-p0)/p0*100,2)) for p0, p1 in zip(prices[0], prices[-1])]
+    result['volume'] = [int(v) for v in volumes[-1]]
+    result['value'] = [int(v) for v in values[-1]]
+    return result.sort_values('value',ascending=False)
+
+
+def breadth_result(SET_df, summary_df, above_sma_result):
+    df_result = SET_df.join(summary_df)
+
+    ath_atl_result = df_result.drop(['number_above_sma','number_below_sma','percent_above_sma','percent_below_sma'],axis=1).tail(250).sort_index(ascending=False).reset_index()
+    sma_result = df_result.drop(['number_high','number_low','percent_high','percent_low'],axis=1).tail(250).sort_index(ascending=False).reset_index()
+
+    return {'ath_atl_result': ath_atl_result,
+            'sma_result': sma_result,
+            'stocks_above_sma': above_sma_result}
+
+
+def market_breadth(SET_df, prices_df, vol_df, val_df, universes=None, universe='ALL'):
+    signals = breadth_signals(prices_df.to_numpy(dtype='float64'))
+    names, masks = membership(prices_df.columns, universes)
+    column = names.index(universe)
+    summary_df = summarize(prices_df.index,
+                           universe_counts(signals['is_ath'], masks)[:, column],
+                           universe_counts(signals['is_atl'], masks)[:, column],
+                           universe_counts(signals['above_sma'], masks)[:, column],
+                           int(masks[:, column].sum()))
+    members = masks[:, column].astype(bool)
+    above_sma_result = stocks_above_sma(prices_df.columns, signals['above_sma'][-1] & members, prices_df, vol_df, val_df)
+    return breadth_result(SET_df, summary_df, above_sma_result)
+
+
+class BreadthState:
+    """Rolling breadth state carried from one EOD row to the next.
+
+    Per symbol: monotonic deques of (row, price) for the 260-day high/low, the
+    row of the last missing price, and a pandas-exact running sum for the
+    100-day SMA. Per row and universe: the counts of new highs, new lows and
+    symbols above the SMA, taken from the row's signals in one product with
+    the membership masks. Appending a row costs O(symbols): only the new rows
+    and the window before them are converted and hashed. A change to the
+    dates, symbols or universes, or to a price in the last window rows (the
+    ones the deques and the SMA still hold), triggers a full rebuild. A
+    price restated further back only changes the counts of its own row and
+    is not looked for.
+    """
+
+    VERSION = 3
+
+    def __init__(self, ath_period=ATH_PERIOD, sma_period=SMA_PERIOD):
+        self.version = self.VERSION
+        self.ath_period = ath_period
+        self.sma_period = sma_period
+        self.symbols = []
+        self.universes = []
+        self.masks = numpy.zeros((0, 0), dtype='float32')
+        self.dates = numpy.array([], dtype='datetime64[ns]')
+        self.digest = None
+        self.rows = 0
+        self.max_deques = []
+        self.min_deques = []
+        self.last_nan = numpy.array([], dtype='int64')
+        self.sma = RollingMean(0)
+        self.number_high = []
+        self.number_low = []
+        self.number_above_sma = []
+        self.last_above_sma = numpy.array([], dtype=bool)
+        self.rebuilds = 0
+
+    @property
+    def window(self):
+        """Rows an append reads back: the high/low window and the prices the
+        shifted SMA adds and drops."""
+        return max(self.ath_period, self.sma_period + 1)
+
+    def _digest(self, prices, rows):
+        """Digest of the row count and the window rows before it; prices
+        starts at row rows - len(prices)."""
+        recent = prices[max(len(prices) - self.window, 0):]
+        hasher = hashlib.sha256(str(rows).encode())
+        hasher.update(numpy.ascontiguousarray(recent, dtype='float64'))
+        return hasher.hexdigest()
+
+    def _consumed(self, dates, symbols, prices, names, masks):
+        """Whether rows [:self.rows] are still the ones this state was
+        built from, as far as an append can tell."""
+        return (self.digest is not None
+                and list(symbols) == self.symbols
+                and names == self.universes
+                and numpy.array_equal(masks, self.masks)
+                and len(dates) >= self.rows
+                and numpy.array_equal(dates[:self.rows], self.dates)
+                and self._digest(prices[max(self.rows - self.window, 0):self.rows], self.rows) == self.digest)
+
+    def update(self, dates, symbols, prices, universes=None):
+        """universes: {name: bool mask over symbols}, ALL when None."""
+        dates = numpy.asarray(dates, dtype='datetime64[ns]')
+        names, masks = membership(symbols, universes)
+        if not self._consumed(dates, symbols, prices, names, masks):
+            self.rebuild(dates, symbols, numpy.asarray(prices, dtype='float64'), universes)
+            return
+        offset = max(self.rows - self.window, 0)
+        recent = numpy.asarray(prices[offset:], dtype='float64')
+        for row in range(self.rows, len(dates)):
+            self._append(recent, row, offset)
+        self.rows = len(dates)
+        self.dates = dates.copy()
+        self.digest = self._digest(recent, self.rows)
+
+    def rebuild(self, dates, symbols, prices, universes=None):
+        rows, width = prices.shape
+        self.universes, self.masks = membership(symbols, universes)
+        signals = breadth_signals(prices, self.ath_period, self.sma_period)
+        self.number_high = universe_counts(signals['is_ath'], self.masks).tolist()
+        self.number_low = universe_counts(signals['is_atl'], self.masks).tolist()
+        self.number_above_sma = universe_counts(signals['above_sma'], self.masks).tolist()
+        self.last_above_sma = signals['above_sma'][-1] if rows else numpy.zeros(width, dtype=bool)
+
+        self.sma = RollingMean(width)
+        for row in range(rows):
+            self._step_sma(prices, row)
+
+        missing = numpy.isnan(prices)
+        self.last_nan = numpy.where(missing.any(axis=0), rows - 1 - numpy.argmax(missing[::-1], axis=0), -1)
+        self.max_deques = [collections.deque() for _ in range(width)]
+        self.min_deques = [collections.deque() for _ in range(width)]
+        for row in range(max(0, rows - self.ath_period), rows):
+            self._push(prices[row], row)
+
+        self.symbols = list(symbols)
+        self.rows = rows
+        self.dates = dates.copy()
+        self.digest = self._digest(prices, rows)
+        self.rebuilds += 1
+
+    def _step_sma(self, prices, row, offset=0):
+        # Feed the shifted series: row t of the window sees prices t-1, t-2, ...
+        # prices starts at row offset.
+        if row - self.sma_period >= 1:
+            self.sma.remove(prices[row - self.sma_period - 1 - offset])
+        if row >= 1:
+            self.sma.add(prices[row - 1 - offset])
+        return self.sma.mean(self.sma_period)
+
+    def _push(self, values, row):
+        for col, value in enumerate(values.tolist()):
+            if value != value:
+                continue
+            max_deque = self.max_deques[col]
+            while max_deque and max_deque[-1][1] <= value:
+                max_deque.pop()
+            max_deque.append((row, value))
+            min_deque = self.min_deques[col]
+            while min_deque and min_deque[-1][1] >= value:
+                min_deque.pop()
+            min_deque.append((row, value))
+
+    def _append(self, prices, row, offset=0):
+        values = prices[row - offset]
+        cutoff = row - self.ath_period
+        ath_threshold = numpy.full(len(values), numpy.nan)
+        atl_threshold = numpy.full(len(values), numpy.nan)
+        for col in range(len(values)):
+            max_deque = self.max_deques[col]
+            while max_deque and max_deque[0][0] < cutoff:
+                max_deque.popleft()
+            min_deque = self.min_deques[col]
+            while min_deque and min_deque[0][0] < cutoff:
+                min_deque.popleft()
+            if max_deque:
+                ath_threshold[col] = max_deque[0][1]
+                atl_threshold[col] = min_deque[0][1]
+        full_window = self.last_nan < cutoff
+        ath_threshold[~full_window] = numpy.nan
+        atl_threshold[~full_window] = numpy.nan
+        sma_threshold = self._step_sma(prices, row, offset)
+
+        with numpy.errstate(invalid='ignore'):
+            above_sma = values >= sma_threshold
+            self.number_high.append(universe_counts(values >= ath_threshold, self.masks).tolist())
+            self.number_low.append(universe_counts(values <= atl_threshold, self.masks).tolist())
+        self.number_above_sma.append(universe_counts(above_sma, self.masks).tolist())
+        self.last_above_sma = above_sma
+
+        self.last_nan[numpy.isnan(values)] = row
+        self._push(values, row)
+
+    def _column(self, counts, universe):
+        counts = numpy.asarray(counts, dtype='int64').reshape(-1, len(self.universes))
+        return counts[:, self.universes.index(universe)]
+
+    def summary(self, index, universe='ALL'):
+        return summarize(index,
+                         self._column(self.number_high, universe),
+                         self._column(self.number_low, universe),
+                         self._column(self.number_above_sma, universe),
+                         int(self.members(universe).sum()))
+
+    def members(self, universe='ALL'):
+        return self.masks[:, self.universes.index(universe)].astype(bool)
+
+    def verify(self, prices):
+        signals = breadth_signals(prices, self.ath_period, self.sma_period)
+        return (self.number_high == universe_counts(signals['is_ath'], self.masks).tolist()
+                and self.number_low == universe_counts(signals['is_atl'], self.masks).tolist()
+                and self.number_above_sma == universe_counts(signals['above_sma'], self.masks).tolist()
+                and numpy.array_equal(self.last_above_sma, signals['above_sma'][-1]))
+
+    def save(self, path):
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return cls()
+        # A state pickled by an older layout starts over.
+        return state if getattr(state, 'version', None) == cls.VERSION else cls()
+
+
+_states = {}
+_state_lock = threading.Lock()
+
+
+def tracked_market_breadth(path, SET_df, prices_df, vol_df, val_df, universes=None, universe='ALL'):
+    """market_breadth of one universe from the state kept at path, which
+    carries the counts of every universe in universes."""
+    with _state_lock:
+        state, seen = _states.get(path) or (BreadthState.load(path), None)
+        names, masks = membership(prices_df.columns, universes)
+        if (seen is None or seen() is not prices_df
+                or names != state.universes or not numpy.array_equal(masks, state.masks)):
+            before = (state.digest, state.rebuilds)
+            state.update(prices_df.index.to_numpy(), prices_df.columns, prices_df.to_numpy(), universes)
+            if (state.digest, state.rebuilds) != before:
+                state.save(path)
+            _states[path] = (state, weakref.ref(prices_df))
+        summary_df = state.summary(prices_df.index, universe)
+        last_above_sma = state.last_above_sma & state.members(universe)
+    above_sma_result = stocks_above_sma(prices_df.columns, last_above_sma, prices_df, vol_df, val_df)
+    return breadth_result(SET_df, summary_df, above_sma_result)
+
+
+# Universes charted against an index of their own in INDEX; the others
+# (ALL, LISTED, SET) against the SET.
+UNIVERSE_INDICES = {'MAI': 'MAI'}
+
+
+def index_ohlc(INDEX_df, universe='ALL'):
+    """OPEN/HIGH/LOW/CLOSE of universe's index in INDEX."""
+    index = UNIVERSE_INDICES.get(universe, 'SET')
+    index_df = INDEX_df[[f'{index}_OPEN', f'{index}_HIGH', f'{index}_LOW', f'{index}_CLOSE']]
+    index_df.columns = ['OPEN', 'HIGH', 'LOW', 'CLOSE']
+    return index_df
+
+
+def store_breadth(matrices, universes, universe='ALL'):
+    """tracked_market_breadth of one universe over the matrices of a
+    MatrixStore, with the state file kept next to them."""
+    prices_df = matrices.frame('STOCKS')
+    return tracked_market_breadth(os.path.join(matrices.directory, 'breadth-state.pkl'),
+                                  index_ohlc(matrices.frame('INDEX'), universe), prices_df,
+                                  matrices.frame('STOCKS_VOL'), matrices.frame('STOCKS_VAL'), universes, universe)
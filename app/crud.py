@@ -1,196 +1,216 @@
+from typing import List
+
 from sqlalchemy.orm import Session
-from sqlalchemy import func, Date, cast
-from . import models
+from sqlalchemy import and_, func, or_
+from . import models, queries, registry
+import base64
+import binascii
 import datetime
+import json
 
 def get_symbols(db: Session):
-    return db.query(models.vStockAndIndex).all()
+    return registry.symbols.all(db)
 
 def get_symbol_id(db: Session, symbol_name: str):
-    return db.query(models.vStockAndIndex).filter(models.vStockAndIndex.Name == symbol_name).first()
+    return registry.symbols.by_name(db, symbol_name)
 
 def get_symbol_name(db: Session, symbol_id: int):
-    return db.query(models.vStockAndIndex).filter(models.vStockAndIndex.ID == symbol_id).first()
+    return registry.symbols.by_id(db, symbol_id)
 
-def get_financial_by_date(db: Session, date: datetime.date):
+def get_financial_between(db: Session, start: datetime.datetime, end: datetime.datetime):
+    """vFinancial rows with start <= ImportDate < end. The bare column
+    comparison lets SQL Server seek an index on ImportDate."""
     return db.query(models.vFinancial).filter(
-            cast(models.vFinancial.ImportDate, Date) == date
-        ).all()
+            models.vFinancial.ImportDate >= start,
+            models.vFinancial.ImportDate < end
+        ).execution_options(query_name='financial_between').all()
 
-def get_prices(db: Session, symbol_name: str):
-    symbol_id_subquery = db.query(models.vStockAndIndex.ID).filter(models.vStockAndIndex.Name == symbol_name).subquery()
-    
-    results =  db.query(models.WatchOpenCloseSummary.OpenPrice,
-        models.WatchOpenCloseSummary.HighestPrice,
-        models.WatchOpenCloseSummary.LowestPrice,
-        models.WatchOpenCloseSummary.LastSalePrice,
-        models.WatchOpenCloseSummary.TotalSharesTraded,
-        models.WatchOpenCloseSummary.TotalValueTradedin1000,
-        models.WatchOpenCloseSummary.WatchOCS_Date,
-        ).filter(models.WatchOpenCloseSummary.SecurityNumber.in_(symbol_id_subquery)).all()
-    ohlc = [{'open': round(item[0], 2),
-                'high': round(item[1], 2),
-                'low': round(item[2], 2),
-                'close': round(item[3], 2),
-                'volume': round(item[4], 2),
-                'value': round(item[5], 2) * 1000,
-                'date': item[6].date()
-                }
-                for item in results]
-    out = { 'symbol': symbol_name,
-            'data': ohlc}
-    return out
-
-
-def get_ohlcvv(db: Session, symbol_name: str, length=200):
-    symbol_id_subquery = db.query(models.vStockAndIndex.ID).filter(models.vStockAndIndex.Name == symbol_name).subquery()
-    
-    results =  db.query(models.WatchOpenCloseSummary.OpenPrice,
-        models.WatchOpenCloseSummary.HighestPrice,
-        models.WatchOpenCloseSummary.LowestPrice,
-        models.WatchOpenCloseSummary.LastSalePrice,
-        models.WatchOpenCloseSummary.TotalSharesTraded,
-        models.WatchOpenCloseSummary.TotalValueTradedin1000,
-        models.WatchOpenCloseSummary.WatchOCS_Date,
-        ).filter(models.WatchOpenCloseSummary.SecurityNumber.in_(symbol_id_subquery)).order_by(models.WatchOpenCloseSummary.WatchOCS_Date.desc()).limit(length).all()
-    ohlc = [{'open': round(item[0], 2),
-                'high': round(item[1], 2),
-                'low': round(item[2], 2),
-                'close': round(item[3], 2),
-                'volume': round(item[4], 2),
-                'value': round(item[5], 2) * 1000,
-                'date': item[6].date()
-                }
-                for item in results]
-    out = { 'symbol': symbol_name,
-            'data': ohlc}
-    return out
-
-def get_prices_pct_change(db: Session, symbol_name: str):
-    symbol_id_subquery = db.query(models.vStockAndIndex.ID).filter(models.vStockAndIndex.Name == symbol_name).subquery()
-    
-    results =  db.query(models.WatchOpenCloseSummary.OpenPrice,
+def get_financial_by_date(db: Session, date: datetime.date):
+    start = datetime.datetime.combine(date, datetime.time())
+    return get_financial_between(db, start, start + datetime.timedelta(days=1))
+
+# Keyset order of the change feed: import time, then the view's primary key.
+FINANCIAL_CHANGE_KEY = ['ImportDate', 'SecurityNumber', 'Fiscal', 'Quarter', 'AccountID', 'AccountFrom']
+
+def get_financial_changes(db: Session, since: datetime.datetime, after: list = None, limit: int = 1000):
+    """Up to limit vFinancial rows imported after since, as dicts in
+    FINANCIAL_CHANGE_KEY order, continuing past the row whose key is after."""
+    columns = [getattr(models.vFinancial, name) for name in FINANCIAL_CHANGE_KEY]
+    query = db.query(models.vFinancial).filter(models.vFinancial.ImportDate > since).execution_options(query_name='financial_changes')
+    if after is not None:
+        # (a, b, c) > (x, y, z) spelled out, since SQL Server has no row
+        # value comparison.
+        query = query.filter(or_(*[and_(*[column == value for column, value in zip(columns[:i], after[:i])],
+                                         columns[i] > after[i])
+                                   for i in range(len(columns))]))
+    names = [column.name for column in models.vFinancial.__table__.columns]
+    return [{name: getattr(row, name) for name in names}
+            for row in query.order_by(*columns).limit(limit).all()]
+
+def change_token(row: dict) -> str:
+    key = [row['ImportDate'].isoformat()] + [row[name] for name in FINANCIAL_CHANGE_KEY[1:]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def parse_change_token(token: str) -> list:
+    """The key change_token encoded; ValueError unless it is a list of one
+    scalar per FINANCIAL_CHANGE_KEY column, the first an ISO timestamp."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (UnicodeDecodeError, binascii.Error, json.JSONDecodeError) as e:
+        raise ValueError(f'invalid token: {e}')
+    if not isinstance(key, list) or len(key) != len(FINANCIAL_CHANGE_KEY) or not isinstance(key[0], str) \
+            or any(isinstance(value, bool) or not isinstance(value, (str, int, float)) for value in key):
+        raise ValueError('invalid token: not a financial change key')
+    try:
+        return [datetime.datetime.fromisoformat(key[0])] + key[1:]
+    except ValueError as e:
+        raise ValueError(f'invalid token: {e}')
+
+def _round(value, digits=2):
+    return None if value is None else round(float(value), digits)
+
+def iter_prices(db: Session, symbol_id: int, after: datetime.date = None, limit: int = None, batch_size: int = 1000):
+    """(date, open, high, low, close, volume, value) rows in date order,
+    fetched from the cursor batch_size rows at a time. after is an
+    exclusive keyset cursor on WatchOCS_Date."""
+    query = db.query(models.WatchOpenCloseSummary.WatchOCS_Date,
+        models.WatchOpenCloseSummary.OpenPrice,
         models.WatchOpenCloseSummary.HighestPrice,
         models.WatchOpenCloseSummary.LowestPrice,
         models.WatchOpenCloseSummary.LastSalePrice,
         models.WatchOpenCloseSummary.TotalSharesTraded,
         models.WatchOpenCloseSummary.TotalValueTradedin1000,
-        models.WatchOpenCloseSummary.WatchOCS_Date,
-        ).filter(models.WatchOpenCloseSummary.SecurityNumber.in_(symbol_id_subquery)).order_by(models.WatchOpenCloseSummary.WatchOCS_Date.desc()).limit(2).all()
-    ohlc = [{'open': round(item[0], 2),
-                'high': round(item[1], 2),
-                'low': round(item[2], 2),
-                'close': round(item[3], 2),
-                'volume': round(item[4], 2),
-                'value': round(item[5], 2) * 1000,
-                'date': item[6].date()
-                }
-                for item in results]
-    out = { **ohlc[0],
-            'change': ohlc[0]['close']-ohlc[1]['close'],
-            'pct_change': round((ohlc[0]['close']-ohlc[1]['close'])/ohlc[1]['close']*100, 2)}
-    return out
-
+        ).filter(models.WatchOpenCloseSummary.SecurityNumber == symbol_id).execution_options(query_name='prices')
+    if after is not None:
+        query = query.filter(models.WatchOpenCloseSummary.WatchOCS_Date >= after + datetime.timedelta(days=1))
+    query = query.order_by(models.WatchOpenCloseSummary.WatchOCS_Date)
+    if limit is not None:
+        query = query.limit(limit)
+    for item in query.yield_per(batch_size):
+        value = _round(item[6])
+        yield (item[0].date(), _round(item[1]), _round(item[2]), _round(item[3]), _round(item[4]),
+               _round(item[5]), None if value is None else value * 1000)
+
+PRICES_BATCH = 1000
+
+def _date(value):
+    # Raw statements get SQLite's dates back as text.
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+def get_prices_many(db: Session, security_ids: List[int], after: datetime.date = None):
+    """{security ID: iter_prices rows} for many securities, one statement per
+    PRICES_BATCH of them. after is exclusive, as in iter_prices."""
+    output = {security_id: [] for security_id in security_ids}
+    ids = list(output)
+    for start in range(0, len(ids), PRICES_BATCH):
+        batch = ids[start:start + PRICES_BATCH]
+        if after is None:
+            result = queries.execute(db, queries.PRICES_MANY, security_ids=batch)
+        else:
+            result = queries.execute(db, queries.PRICES_MANY_SINCE, security_ids=batch,
+                                     since=after + datetime.timedelta(days=1))
+        for item in result:
+            value = _round(item[7])
+            output[item[0]].append((_date(item[1]), _round(item[2]), _round(item[3]), _round(item[4]), _round(item[5]),
+                                    _round(item[6]), None if value is None else value * 1000))
+    return output
 
 def get_fundamentalbyquote(db: Session):
-    return db.query(models.vStockFundamentalByQuote2).all()
+    return db.query(models.vStockFundamentalByQuote2).execution_options(query_name='fundamental_by_quote').all()
+
+FACTSHEET_KEYS = ['id', 'SecurityNumber', 'Fiscal', 'Quarter', 'FinanceDate']
+
+def project_factsheet(rows, features):
+    selected = FACTSHEET_KEYS + [feature for feature in features if feature not in FACTSHEET_KEYS]
+    return [{column: row[column] for column in selected if column in row} for row in rows]
 
 def get_factsheet(symbol_name: str, db: Session):
-    symbol = db.query(models.vStockAndIndex).filter(models.vStockAndIndex.Name == symbol_name.upper()).first()
+    symbol = registry.symbols.by_name(db, symbol_name)
     if symbol is None:
         return None
-    resultproxy = db.get_bind().execute(f'SELECT * FROM fnStockfundamentalByFactsheetYOY({symbol.ID})')
-    output = [{column: value for column, value in rowproxy.items()} for rowproxy in resultproxy]
-    return output
+    return queries.fetch_all(db, queries.FACTSHEET, security_id=symbol['ID'])
 
 def get_factsheet_with_feature(symbol_name: str, feature_name: str, db: Session):
-    symbol = db.query(models.vStockAndIndex).filter(models.vStockAndIndex.Name == symbol_name.upper()).first()
-    if symbol is None:
+    output = get_factsheet(symbol_name, db)
+    if output is None:
         return None
-    selected_feature = ['id', 'SecurityNumber', 'Fiscal', 'Quarter', 'FinanceDate', feature_name]
-    resultproxy = db.get_bind().execute(f'SELECT * FROM fnStockfundamentalByFactsheetYOY({symbol.ID})')
-    output = [{column: value for column, value in rowproxy.items() if column in selected_feature} for rowproxy in resultproxy]
+    return project_factsheet(output, [feature_name])
+
+def get_factsheets(security_ids: List[int], db: Session):
+    """fnStockfundamentalByFactsheetYOY rows for many securities in one
+    round trip, keyed by security ID."""
+    output = {security_id: [] for security_id in security_ids}
+    if not output:
+        return output
+    security_ids = ',' + ','.join(str(int(security_id)) for security_id in output) + ','
+    for row in queries.fetch_all(db, queries.FACTSHEETS, security_ids=security_ids):
+        output[row.pop('factsheet_security_id')].append(row)
     return output
 
+def get_financial_watermarks(db: Session):
+    """Latest fiscal period (Fiscal * 10 + Quarter) and ImportDate in
+    vFinancial per security."""
+    results = db.query(models.vFinancial.SecurityNumber,
+        func.max(models.vFinancial.Fiscal * 10 + models.vFinancial.Quarter),
+        func.max(models.vFinancial.ImportDate),
+        ).group_by(models.vFinancial.SecurityNumber).execution_options(query_name='financial_watermarks').all()
+    return {item[0]: (item[1], item[2]) for item in results}
+
+def get_latest_trading_date(db: Session, security_number: int = 1024):
+    """Latest WatchOCS_Date of one security, the SET index by default. Every
+    security gets its row of a trading day in the same end-of-day load."""
+    return db.query(func.max(models.WatchOpenCloseSummary.WatchOCS_Date)).filter(
+        models.WatchOpenCloseSummary.SecurityNumber == security_number).execution_options(query_name='latest_trading_date').scalar()
 
 def get_industries(db:Session):
-    return db.query(models.IndustryNo).all()
+    return db.query(models.IndustryNo).execution_options(query_name='industries').all()
 
 def get_sectors(db:Session):
-    return db.query(models.SectorNo).all()
+    return db.query(models.SectorNo).execution_options(query_name='sectors').all()
 
 def get_symbol_from_sector(sector_number: int, db:Session):
-    resultproxy =  db.get_bind().execute(f"""SELECT * FROM DBMarketWatchMaster.dbo.d_Compsec
-JOIN DBMarketWatchMaster.dbo.SectorNo  ON (DBMarketWatchMaster.dbo.d_Compsec.SectorNo = DBMarketWatchMaster.dbo.SectorNo.SectorNumber)
-WHERE DBMarketWatchMaster.dbo.d_Compsec.SectorNo = {sector_number} AND DBMarketWatchMaster.dbo.d_Compsec.ListingStatus = 'L'""")
-    output = [{column: value for column, value in rowproxy.items()} for rowproxy in resultproxy]
-    return output
+    return queries.fetch_all(db, queries.SYMBOLS_IN_SECTOR, sector_number=sector_number)
 
 def get_features(db: Session):
-    resultproxy = db.get_bind().execute("""SELECT DISTINCT  AccountCode, AccountNameEN FROM DBMarketWatchMaster.dbo.d_Account """)
-    output = [{column: value for column, value in rowproxy.items()} for rowproxy in resultproxy]
-    return output
-
-
-def get_finance_by_sector(sector_id: int, feature_id: int, db: Session):
-    resultproxy = db.get_bind().execute(f"""SELECT * FROM DBMarketWatchMaster.dbo.d_Finance as finance
-    WHERE finance.SecurityID IN (
-	SELECT SecurityID FROM DBMarketWatchMaster.dbo.d_Compsec
-	JOIN DBMarketWatchMaster.dbo.SectorNo  ON (DBMarketWatchMaster.dbo.d_Compsec.SectorNo = DBMarketWatchMaster.dbo.SectorNo.SectorNumber)
-	WHERE DBMarketWatchMaster.dbo.d_Compsec.SectorNo = '{sector_id}' AND DBMarketWatchMaster.dbo.d_Compsec.ListingStatus = 'L'
-	)
-	AND finance.Fiscal = '2020' 
-	AND finance.Quarter = '3'
-	AND finance.AccountID = '{feature_id}'
-	AND finance.FinancialStatementType = 'U'""")
-    output = [{column: value for column, value in rowproxy.items()} for rowproxy in resultproxy]
-    return output
+    return queries.fetch_all(db, queries.ACCOUNTS)
+
+
+def get_finance_by_sector(sector_id: int, feature_id: int, db: Session, fiscal: int = 2020, quarter: int = 3):
+    return queries.fetch_all(db, queries.FINANCE_BY_SECTOR, sector_id=sector_id, fiscal=fiscal, quarter=quarter, feature_id=feature_id)
+
+def get_finance_panel(group: str, group_id: int, account_ids: List[int], first_period: int, last_period: int, db: Session):
+    """(SecurityID, Fiscal, Quarter, AccountID, value) rows of listed
+    securities in a sector or industry. Periods are Fiscal * 10 + Quarter."""
+    columns = models.reflected('d_Finance').columns
+    if queries.FINANCE_VALUE not in columns:
+        raise RuntimeError(f'd_Finance has no column {queries.FINANCE_VALUE!r}; set YONG_FINANCE_VALUE_COLUMN '
+                           f'to the one holding the figures, among {", ".join(column.name for column in columns)}')
+    query = queries.FINANCE_PANEL_BY_SECTOR if group == 'sector' else queries.FINANCE_PANEL_BY_INDUSTRY
+    # Bare Fiscal/Quarter bounds, so SQL Server can seek on them.
+    first_fiscal, first_quarter = divmod(first_period, 10)
+    last_fiscal, last_quarter = divmod(last_period, 10)
+    return queries.fetch_all(db, query, group_id=group_id,
+                             account_ids=','.join(str(int(account_id)) for account_id in account_ids),
+                             first_fiscal=first_fiscal, first_quarter=first_quarter,
+                             last_fiscal=last_fiscal, last_quarter=last_quarter)
+
+def get_finance_watermark(db: Session):
+    row = queries.execute(db, queries.FINANCE_WATERMARK).first()
+    return (row['period'], row['row_count'])
 
 def get_businessinfo(symbol_name: str, db: Session):
-    resultproxy = db.get_bind().execute(f"""SELECT * FROM DBMarketWatchMaster.dbo.d_Business 
-	WHERE SecuritySymbol = '{symbol_name}'""")
-    output = [{column: value for column, value in rowproxy.items()} for rowproxy in resultproxy]
-    return output
+    return queries.fetch_all(db, queries.BUSINESS_INFO, symbol_name=symbol_name)
 
-def get_set_trade_summary(start: str, end: str, db: Session):
-    query_string = f"""SELECT TOP 250 WatchOCS_Date AS date, 
-                        ROUND(OpenPrice,2) AS SETopen,
-                        ROUND(HighestPrice,2) AS SEThigh,
-                        ROUND(LowestPrice,2) AS SETlow, 
-                        ROUND(LastSalePrice,2) AS SETclose,
-                        FundValBuy,FundValSell,
-                        ForeignValBuy,ForeignValSell,
-                        TradingValBuy,TradingValSell,
-                        CustomerValBuy,CustomerValSell,
-                        FundValBuy-FundValSell AS FundValNet,
-                        ForeignValBuy-ForeignValSell AS ForeignValNet, 
-                        TradingValBuy-TradingValSell AS TradingValNet, 
-                        CustomerValBuy-CustomerValSell AS CustomerValNet
-                        FROM DBMarketWatchMaster.dbo.WatchOpenCloseSummary LEFT JOIN DBMarketWatchMaster.dbo.d_CustomerHistory ON WatchOCS_Date = SeqDate 
-                        WHERE DBMarketWatchMaster.dbo.WatchOpenCloseSummary.SecurityNumber = 1024 AND DBMarketWatchMaster.dbo.d_CustomerHistory.SecurityNumber = 1024
-                        AND WatchOCS_Date >= '{start}' AND WatchOCS_Date <= '{end}'
-                        ORDER BY WatchOCS_Date DESC"""
-    resultproxy = db.get_bind().execute(query_string)
-    output = [{column: value for column, value in rowproxy.items()} for rowproxy in resultproxy]
-    return output
+def get_trade_flows(security_number: int, db: Session, after: datetime.date = None):
+    if after is None:
+        return queries.fetch_all(db, queries.TRADE_FLOWS, security_number=security_number)
+    return queries.fetch_all(db, queries.TRADE_FLOWS_AFTER, security_number=security_number, after=after)
 
 
-def get_tfex_trade_summary(start: str, end: str, db: Session):
-    query_string = f"""SELECT TOP 250 WatchOCS_Date AS date, 
-                        ROUND(OpenPrice,2) AS SETopen,
-                        ROUND(HighestPrice,2) AS SEThigh,
-                        ROUND(LowestPrice,2) AS SETlow, 
-                        ROUND(LastSalePrice,2) AS SETclose,
-                        FundValBuy,FundValSell,
-                        ForeignValBuy,ForeignValSell,
-                        CustomerValBuy,CustomerValSell,
-                        FundValBuy-FundValSell AS FundValNet,
-                        ForeignValBuy-ForeignValSell AS ForeignValNet,
-                        CustomerValBuy-CustomerValSell AS CustomerValNet
-                        FROM DBMarketWatchMaster.dbo.WatchOpenCloseSummary LEFT JOIN DBMarketWatchMaster.dbo.d_CustomerHistory ON WatchOCS_Date = SeqDate 
-                        WHERE DBMarketWatchMaster.dbo.WatchOpenCloseSummary.SecurityNumber = 1062 AND DBMarketWatchMaster.dbo.d_CustomerHistory.SecurityNumber = 1024
-                        AND WatchOCS_Date >= '{start}' AND WatchOCS_Date <= '{end}'
-                        ORDER BY WatchOCS_Date DESC"""
-    resultproxy = db.get_bind().execute(query_string)
-    output = [{column: value for column, value in rowproxy.items()} for rowproxy in resultproxy]
-    return output
\ No newline at end of file
+def get_trade_flows_watermark(security_number: int, db: Session):
+    row = queries.execute(db, queries.TRADE_FLOWS_WATERMARK, security_number=security_number).first()
+    return {'row_count': row['row_count'], 'latest': row['latest']}
@@ -0,0 +1,86 @@
+import collections
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from . import crud
+
+
+def parse_features(features: str = None):
+    return None if not features else [feature for feature in features.split(',') if feature]
+
+
+def unknown_features(rows, features):
+    if not features or not rows:
+        return []
+    return [feature for feature in features if feature not in rows[0]]
+
+
+class FactsheetCache:
+    """fnStockfundamentalByFactsheetYOY rows per security, kept until
+    vFinancial moves on for that security.
+
+    Every check_interval seconds the latest fiscal period and ImportDate of
+    each security are read from vFinancial in one grouped query, and only
+    the securities whose watermark changed are dropped. At most maxsize
+    securities are kept, least recently used first out.
+    """
+
+    def __init__(self, maxsize: int = 4096, check_interval: float = 300):
+        self.maxsize = maxsize
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._rows = collections.OrderedDict()
+        self._watermarks = {}
+        self._checked = float('-inf')
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _check(self, db: Session):
+        if time.monotonic() - self._checked < self.check_interval:
+            return
+        watermarks = crud.get_financial_watermarks(db)
+        with self._lock:
+            for security_id in [security_id for security_id in self._rows
+                                if watermarks.get(security_id) != self._watermarks.get(security_id)]:
+                del self._rows[security_id]
+            self._watermarks = watermarks
+            self._generation += 1
+            self._checked = time.monotonic()
+
+    def get_many(self, db: Session, security_ids):
+        self._check(db)
+        result = {}
+        with self._lock:
+            generation = self._generation
+            for security_id in security_ids:
+                if security_id in self._rows:
+                    self._rows.move_to_end(security_id)
+                    result[security_id] = self._rows[security_id]
+        missing = [security_id for security_id in dict.fromkeys(security_ids) if security_id not in result]
+        self.hits += len(result)
+        self.misses += len(missing)
+        if missing:
+            fetched = crud.get_factsheets(missing, db)
+            with self._lock:
+                # Rows read across a watermark change may predate it.
+                if generation == self._generation:
+                    self._rows.update(fetched)
+                while len(self._rows) > self.maxsize:
+                    self._rows.popitem(last=False)
+            result.update(fetched)
+        return result
+
+    def get(self, db: Session, security_id: int):
+        return self.get_many(db, [security_id])[security_id]
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._generation += 1
+            self._checked = float('-inf')
+
+
+cache = FactsheetCache()
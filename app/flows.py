@@ -0,0 +1,157 @@
+import datetime
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from . import crud, lazy
+
+numpy = lazy.module('numpy')
+pandas = lazy.module('pandas')
+
+PRICE_COLUMNS = ['SETopen', 'SEThigh', 'SETlow', 'SETclose']
+INVESTORS = ['Fund', 'Foreign', 'Trading', 'Customer']
+FLOW_COLUMNS = [f'{investor}Val{side}' for investor in INVESTORS for side in ('Buy', 'Sell')] + \
+               [f'{investor}ValNet' for investor in INVESTORS]
+# WatchOpenCloseSummary security and the investor types reported for it.
+MARKETS = {'SET': (1024, INVESTORS),
+           'TFEX': (1062, ['Fund', 'Foreign', 'Customer'])}
+
+
+def net_columns(market: str):
+    """<investor>ValNet of each investor type reported for market."""
+    return [f'{investor}ValNet' for investor in MARKETS[market][1]]
+
+
+def period_start(period: str, today: datetime.date = None):
+    today = today or datetime.date.today()
+    if period == 'MTD':
+        return today.replace(day=1)
+    if period == 'QTD':
+        return datetime.date(today.year, 3 * ((today.month - 1) // 3) + 1, 1)
+    if period == 'YTD':
+        return today.replace(day=1, month=1)
+    return None
+
+
+def _day(value):
+    return None if value is None else numpy.datetime64(pandas.Timestamp(value).date(), 'D')
+
+
+class FlowLedger:
+    """Investor-type trade values for one index, held as prefix sums.
+
+    Row i of prefix is the total of every flow column before day i, so the
+    total over any date range is prefix[hi] - prefix[lo] whatever its length.
+    The joined row count and latest date are polled every check_interval
+    seconds; days that land after the last one are appended, anything else
+    (a restated or back-filled day) reloads the whole history.
+    """
+
+    def __init__(self, security_number: int, investors=INVESTORS, check_interval: float = 60):
+        self.security_number = security_number
+        self.row_columns = PRICE_COLUMNS + [f'{investor}Val{side}' for investor in investors for side in ('Buy', 'Sell')] + \
+                           [f'{investor}ValNet' for investor in investors]
+        self.total_columns = [f'{investor}Val{side}' for investor in investors for side in ('Buy', 'Sell', 'Net')]
+        self.check_interval = check_interval
+        self._data = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+
+    def _ensure(self, db: Session):
+        if time.monotonic() - self._checked < self.check_interval:
+            return self._data
+        with self._lock:
+            if time.monotonic() - self._checked >= self.check_interval:
+                try:
+                    self._update(db)
+                except Exception:
+                    # Keep serving the last good history if the database hiccups.
+                    if self._data is None:
+                        raise
+                self._checked = time.monotonic()
+        return self._data
+
+    def _update(self, db: Session):
+        watermark = crud.get_trade_flows_watermark(self.security_number, db)
+        watermark = (watermark['row_count'], _day(watermark['latest']))
+        if self._data is not None and self._data['watermark'] == watermark:
+            return
+        if self._data is not None and len(self._data['dates']):
+            last = self._data['dates'][-1].item()
+            rows = crud.get_trade_flows(self.security_number, db, after=last)
+            if len(self._data['dates']) + len(rows) == watermark[0]:
+                self._data = self._build(rows, watermark, self._data)
+                return
+        self._data = self._build(crud.get_trade_flows(self.security_number, db), watermark)
+
+    @staticmethod
+    def _build(rows, watermark, previous=None):
+        df = pandas.DataFrame(rows, columns=['date'] + PRICE_COLUMNS + FLOW_COLUMNS)
+        dates = pandas.to_datetime(df['date']).to_numpy(dtype='datetime64[D]')
+        prices = df[PRICE_COLUMNS].to_numpy(dtype='float64')
+        values = df[FLOW_COLUMNS].to_numpy(dtype='float64')
+        sums = numpy.nancumsum(values, axis=0)
+        if previous is None:
+            prefix = numpy.vstack([numpy.zeros((1, len(FLOW_COLUMNS))), sums])
+        else:
+            prefix = numpy.vstack([previous['prefix'], previous['prefix'][-1] + sums])
+            dates = numpy.concatenate([previous['dates'], dates])
+            prices = numpy.vstack([previous['prices'], prices])
+            values = numpy.vstack([previous['values'], values])
+        return {'watermark': watermark, 'dates': dates, 'prices': prices,
+                'values': values, 'prefix': prefix}
+
+    @staticmethod
+    def _bounds(data, start: str = None, end: str = None):
+        lo = 0 if start is None else int(numpy.searchsorted(data['dates'], _day(start), 'left'))
+        hi = len(data['dates']) if end is None else int(numpy.searchsorted(data['dates'], _day(end), 'right'))
+        return lo, max(lo, hi)
+
+    def frame(self, db: Session, start: str = None, end: str = None, columns=None, running=()) -> 'pandas.DataFrame':
+        """Rows in [start, end] with running totals from start for the
+        flow columns in running, as <column>Sum."""
+        data = self._ensure(db)
+        lo, hi = self._bounds(data, start, end)
+        df = pandas.DataFrame(numpy.hstack([data['prices'][lo:hi], data['values'][lo:hi]]),
+                              index=pandas.DatetimeIndex(data['dates'][lo:hi], name='date'),
+                              columns=PRICE_COLUMNS + FLOW_COLUMNS)
+        for column in running:
+            j = FLOW_COLUMNS.index(column)
+            total = data['prefix'][lo + 1:hi + 1, j] - data['prefix'][lo, j]
+            df[f'{column}Sum'] = numpy.where(numpy.isnan(data['values'][lo:hi, j]), numpy.nan, total).round(2)
+        columns = self.row_columns if columns is None else columns
+        return df[columns + [f'{column}Sum' for column in running]]
+
+    def totals(self, db: Session, start: str = None, end: str = None, period: str = None, columns=None):
+        """One row of <column>Sum over the MTD/QTD/YTD part of [start, end],
+        or over its last day for any other period."""
+        data = self._ensure(db)
+        lo, hi = self._bounds(data, start, end)
+        since = period_start(period)
+        if since is None:
+            lo = max(lo, hi - 1)
+        else:
+            lo = max(lo, int(numpy.searchsorted(data['dates'], _day(since), 'left')))
+        if lo >= hi:
+            return None
+        result = {'date': str(data['dates'][hi - 1])}
+        for column in self.total_columns if columns is None else columns:
+            j = FLOW_COLUMNS.index(column)
+            if numpy.isnan(data['values'][hi - 1, j]):
+                result[f'{column}Sum'] = None
+            else:
+                result[f'{column}Sum'] = round(float(data['prefix'][hi, j] - data['prefix'][lo, j]), 2)
+        return result
+
+
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_ledger(market: str) -> FlowLedger:
+    with _ledgers_lock:
+        if market not in _ledgers:
+            security_number, investors = MARKETS[market]
+            _ledgers[market] = FlowLedger(security_number, investors)
+        return _ledgers[market]
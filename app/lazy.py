@@ -0,0 +1,21 @@
+import importlib
+import types
+
+
+class _Module(types.ModuleType):
+    def __getattr__(self, attribute):
+        # importlib's per-module lock makes concurrent first uses wait for
+        # one import instead of seeing a half-initialized module.
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(vars(module))
+        return getattr(module, attribute)
+
+
+def module(name: str):
+    """name as a module that is only imported on first attribute access.
+
+    pandas, numpy, bs4 and requests take most of a worker's import time
+    while only some endpoints use them, so the modules behind those
+    endpoints bind them through here instead of a plain import.
+    """
+    return _Module(name)
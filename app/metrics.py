@@ -0,0 +1,166 @@
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+from starlette.routing import Match
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names, values):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                    for name, value in zip(names, values))
+
+
+class Histogram:
+    """A Prometheus histogram: per label set, one count per bucket plus sum
+    and count. observe() is a bisect and a few additions under a lock."""
+
+    def __init__(self, name: str, help: str, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *values):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    @contextlib.contextmanager
+    def time(self, *values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *values)
+
+    def timed(self, *values):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(*values):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self):
+        with self._lock:
+            series = [(values, list(counts), total) for values, (counts, total) in self._series.items()]
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for values, counts, total in sorted(series):
+            labels = _labels(self.labels, values)
+            prefix = labels + ',' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            suffix = '{%s}' % labels if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {total}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+REQUESTS = Histogram('yong_request_duration_seconds', 'HTTP request time by route template, until the last body byte.',
+                     ('method', 'route', 'status'))
+QUERIES = Histogram('yong_db_query_duration_seconds', 'Statement execution time by query_name (Query name or crud function).',
+                    ('query',))
+POOL_CHECKOUT = Histogram('yong_db_pool_checkout_seconds', 'Time to get a connection from the SQLAlchemy pool.')
+UPSTREAM = Histogram('yong_upstream_duration_seconds', 'marketdata.set.or.th and blob storage calls by source and stage.',
+                     ('source', 'stage'))
+PIPELINE = Histogram('yong_pipeline_task_seconds', 'End-of-day pipeline task time, in its worker process.',
+                     ('task',), buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+
+_caches = {}
+
+
+def register_cache(name: str, cache):
+    """cache exposes hits and misses counters."""
+    _caches[name] = cache
+
+
+def instrument_pool(engine):
+    """Times every pool checkout of engine, including waits for a free
+    connection and connects of new ones."""
+    pool = engine.pool
+    connect = pool.connect
+
+    @functools.wraps(connect)
+    def timed_connect(*args, **kwargs):
+        with POOL_CHECKOUT.time():
+            return connect(*args, **kwargs)
+
+    pool.connect = timed_connect
+    return engine
+
+
+class TimedRoutes:
+    """ASGI middleware observing REQUESTS. The route label is the matched
+    route's path template, so /prices/PTT and /prices/AOT share a series.
+    Requests answered before routing (response cache hits) are matched
+    against the routes afterwards."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def route(self, scope):
+        if self._routes is None:
+            self._routes = {route.endpoint: route.path for route in scope['app'].routes if hasattr(route, 'endpoint')}
+        route = self._routes.get(scope.get('endpoint'))
+        if route is None:
+            for candidate in scope['app'].routes:
+                if candidate.matches(scope)[0] == Match.FULL:
+                    return candidate.path
+            return 'unmatched'
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def capture(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            REQUESTS.observe(time.perf_counter() - started, scope['method'], self.route(scope), status)
+
+
+def _gauge(name: str, help: str, samples, type_: str = 'gauge'):
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} {type_}']
+    lines.extend(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}' for labels, value in samples)
+    return lines
+
+
+def render(engine=None) -> str:
+    lines = []
+    for histogram in (REQUESTS, QUERIES, POOL_CHECKOUT, UPSTREAM, PIPELINE):
+        lines.extend(histogram.render())
+    caches = sorted(_caches.items())
+    lines.extend(_gauge('yong_cache_hits_total', 'Lookups served from an in-process cache.',
+                        [(_labels(('cache',), (name,)), cache.hits) for name, cache in caches], 'counter'))
+    lines.extend(_gauge('yong_cache_misses_total', 'Lookups an in-process cache had to compute.',
+                        [(_labels(('cache',), (name,)), cache.misses) for name, cache in caches], 'counter'))
+    lines.extend(_gauge('yong_cache_hit_ratio', 'hits / (hits + misses) since start.',
+                        [(_labels(('cache',), (name,)), cache.hits / (cache.hits + cache.misses))
+                         for name, cache in caches if cache.hits + cache.misses]))
+    if engine is not None and hasattr(engine.pool, 'checkedout'):
+        lines.extend(_gauge('yong_db_pool_checked_out', 'Connections currently checked out of the pool.',
+                            [('', engine.pool.checkedout())]))
+    return '\n'.join(lines) + '\n'
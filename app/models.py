@@ -1,47 +1,127 @@
-from sqlalchemy import Table
+import logging
+import os
+import pickle
+import tempfile
+
+import sqlalchemy
+from sqlalchemy import MetaData, Table
+from sqlalchemy.orm import Session
+
+from . import queries
 from .database import Base, engine
 
+logger = logging.getLogger(__name__)
+
+TABLES = ('vStockFundamentalByQuote2', 'vFinancial', 'vStockAndIndex', 'WatchOpenCloseSummary',
+          'IndustryNo', 'SectorNo', 'd_Compsec', 'd_Finance')
+SNAPSHOT = os.environ.get('YONG_METADATA_SNAPSHOT', 'metadata-snapshot.pkl')
+
+
+def schema_version(connectable=engine):
+    """Column count and checksum of TABLES on SQL Server, SQLite's
+    schema_version counter elsewhere. Changes whenever a reflected column
+    does."""
+    with Session(connectable) as db:
+        if db.get_bind().dialect.name == 'mssql':
+            row = queries.execute(db, queries.SCHEMA_VERSION, tables=f",{','.join(TABLES)},").first()
+            return tuple(row)
+        return db.execute(sqlalchemy.text('PRAGMA schema_version')).scalar()
+
+
+def _snapshot_key(connectable=engine):
+    return (sqlalchemy.__version__, connectable.url.render_as_string(hide_password=True), TABLES)
+
+
+def _read_snapshot(path: str = SNAPSHOT):
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning('ignoring unreadable metadata snapshot %s', path, exc_info=True)
+        return None
+    return snapshot if snapshot.get('key') == _snapshot_key() else None
+
+
+def save_snapshot(path: str = SNAPSHOT, connectable=engine):
+    """Reflect TABLES and write them with the schema version they were read
+    at. The file is swapped in atomically, so concurrent workers never load
+    a partial one."""
+    version = schema_version(connectable)
+    metadata = MetaData()
+    metadata.reflect(connectable, only=list(TABLES), views=True)
+    snapshot = {'key': _snapshot_key(connectable), 'version': version, 'metadata': metadata}
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as f:
+        pickle.dump(snapshot, f)
+    os.replace(f.name, path)
+    return snapshot
+
+
+def verify_snapshot(path: str = SNAPSHOT):
+    """Compare the loaded snapshot with the live schema version and rewrite
+    it if they differ. Meant to run after startup: the mapped classes of this
+    worker keep their columns, the next worker to start gets the new ones."""
+    try:
+        version = schema_version()
+    except Exception:
+        logger.warning('could not read the schema version to verify %s', path, exc_info=True)
+        return False
+    if version == _snapshot['version']:
+        return False
+    logger.warning('database schema changed since metadata snapshot %s was taken, rewriting it; '
+                   'restart workers to map the new columns', path)
+    save_snapshot(path)
+    return True
+
+
+# A worker starts from the snapshot without touching the database; only the
+# first one, or the first after the snapshot is removed, reflects.
+_snapshot = _read_snapshot() or save_snapshot()
+# Tables the reflected ones refer to come along, as they did with autoload.
+for _table in _snapshot['metadata'].sorted_tables:
+    _table.to_metadata(Base.metadata)
+
+
+def reflected(name: str) -> Table:
+    return Base.metadata.tables[name]
+
+
 class vStockFundamentalByQuote2(Base):
-    table = Table('vStockFundamentalByQuote2', Base.metadata,
-                    autoload=True, autoload_with=engine)
+    table = reflected('vStockFundamentalByQuote2')
     __table__ = table
     __mapper_args__ = {
         'primary_key':[table.c.SecurityNumber, table.c.Fiscal, table.c.Quarter]
     }
 
 class vFinancial(Base):
-    table = Table('vFinancial', Base.metadata,
-                    autoload=True, autoload_with=engine)
+    table = reflected('vFinancial')
     __table__ = table
     __mapper_args__ = {
         'primary_key':[table.c.SecurityNumber, table.c.Fiscal, table.c.Quarter, table.c.AccountID, table.c.AccountFrom, table.c.ImportDate]
     }
 
 class vStockAndIndex(Base):
-    table = Table('vStockAndIndex', Base.metadata,
-                    autoload=True, autoload_with=engine)
+    table = reflected('vStockAndIndex')
     __table__ = table
     __mapper_args__ = {
         'primary_key':[table.c.ID]
     }
 
 class WatchOpenCloseSummary(Base):
-    table = Table('WatchOpenCloseSummary', Base.metadata,
-                    autoload=True, autoload_with=engine)
+    table = reflected('WatchOpenCloseSummary')
     __table__ = table
 
 
 class IndustryNo(Base):
-    table = Table('IndustryNo', Base.metadata,
-                    autoload=True, autoload_with=engine)
+    table = reflected('IndustryNo')
     __table__ = table
 
 class SectorNo(Base):
-    table = Table('SectorNo', Base.metadata,
-                    autoload=True, autoload_with=engine)
+    table = reflected('SectorNo')
     __table__ = table
 
 class d_Compsec(Base):
-    table = Table('d_Compsec', Base.metadata,
-                    autoload=True, autoload_with=engine)
-    __table__ = table
\ No newline at end of file
+    table = reflected('d_Compsec')
+    __table__ = table
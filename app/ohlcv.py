@@ -0,0 +1,296 @@
+import collections
+import datetime
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from . import crud, lazy, registry
+
+numpy = lazy.module('numpy')
+
+COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'value')
+# Below 2**16 a float32 is within 0.004 of any 2-decimal price, so rounding
+# it to 2 decimals gives the price back. A series with a larger price keeps
+# its OHLC as float64.
+FLOAT32_PRICE_LIMIT = 2 ** 16
+BATCH = 500
+# Bars this many days back from a series' last date are read again on each
+# new trading date, to pick up restated rows.
+RESTATE_DAYS = 30
+
+
+def _floats(values):
+    """values as Python floats, None for NaN. float32 prices are rounded
+    back to their 2 decimals; float64 volumes and values are kept exactly
+    as crud.iter_prices made them."""
+    if values.dtype != numpy.float64:
+        values = numpy.round(values.astype('float64'), 2)
+    return [None if value != value else value for value in values.tolist()]
+
+
+class Series:
+    """The daily bars of one security, oldest first, as parallel arrays:
+    int32 days since 1970-01-01, OHLC as float32 (float64 above
+    FLOAT32_PRICE_LIMIT), volume and value as float64, NaN for a missing
+    value. That is 36 bytes a bar against about 460 for a dict per bar.
+
+    The arrays carry spare capacity so daily appends only copy when it runs
+    out; the bars are [:size]. Readers take size first and then slice, so an
+    append (which fills beyond size before moving it) never shows them a
+    partial bar.
+    """
+
+    __slots__ = ('dates', 'open', 'high', 'low', 'close', 'volume', 'value', 'size', '__weakref__')
+
+    def __init__(self, capacity: int = 0, price_dtype: str = 'float32'):
+        self.dates = numpy.zeros(capacity, dtype='int32')
+        for column in COLUMNS[:4]:
+            setattr(self, column, numpy.full(capacity, numpy.nan, dtype=price_dtype))
+        self.volume = numpy.full(capacity, numpy.nan)
+        self.value = numpy.full(capacity, numpy.nan)
+        self.size = 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, column).nbytes for column in ('dates',) + COLUMNS)
+
+    def last_date(self):
+        return self.dates[self.size - 1].astype('datetime64[D]').item() if self.size else None
+
+    def append(self, rows):
+        """Adds crud.iter_prices rows dated after last_date(), in date order."""
+        if not rows:
+            return
+        dates = numpy.array([row[0] for row in rows], dtype='datetime64[D]').astype('int32')
+        values = numpy.array([row[1:] for row in rows], dtype='float64')
+        size = self.size
+        prices = values[:, :4]
+        price_dtype = self.open.dtype
+        if price_dtype == numpy.float32 and numpy.nanmax(numpy.abs(prices), initial=0) >= FLOAT32_PRICE_LIMIT:
+            price_dtype = numpy.dtype('float64')
+        if size + len(rows) > len(self.dates) or price_dtype != self.open.dtype:
+            capacity = max(size + len(rows), len(self.dates) + len(self.dates) // 8 + 16)
+            self.dates = numpy.concatenate([self.dates[:size], numpy.zeros(capacity - size, dtype='int32')])
+            for column in COLUMNS:
+                current = getattr(self, column)[:size]
+                if column in COLUMNS[:4] and current.dtype != price_dtype:
+                    current = numpy.round(current.astype(price_dtype), 2)
+                setattr(self, column, numpy.concatenate([current, numpy.full(capacity - size, numpy.nan, dtype=current.dtype)]))
+        self.dates[size:size + len(rows)] = dates
+        for j, column in enumerate(COLUMNS):
+            getattr(self, column)[size:size + len(rows)] = values[:, j]
+        self.size = size + len(rows)
+
+    def refreshed(self, rows, since: datetime.date):
+        """This series with its bars after since replaced by rows, the
+        iter_prices rows after since. When the bars it holds after since
+        are unchanged the rest is appended in place; otherwise the result is
+        a new Series, so readers of this one never see bars change."""
+        start, stop = self.after(since)
+        resident = list(self.rows(start, stop))
+        if rows[:len(resident)] == resident:
+            self.append(rows[len(resident):])
+            return self
+        series = Series()
+        series.append(list(self.rows(0, start)) + rows)
+        return series
+
+    def tail(self, length: int):
+        """(start, stop) of the last length bars."""
+        size = self.size
+        return max(size - max(length, 0), 0), size
+
+    def after(self, after=None, limit: int = None):
+        """(start, stop) of the bars dated after after, at most limit."""
+        size = self.size
+        start = 0
+        if after is not None:
+            day = numpy.datetime64(after, 'D').astype('int32')
+            start = int(numpy.searchsorted(self.dates[:size], day, side='right'))
+        return start, size if limit is None else min(size, start + limit)
+
+    def columns(self, start: int, stop: int):
+        """{'date': [datetime.date], <column>: [float or None]} over
+        [start, stop)."""
+        columns = {'date': self.dates[start:stop].astype('datetime64[D]').tolist()}
+        for column in COLUMNS:
+            columns[column] = _floats(getattr(self, column)[start:stop])
+        return columns
+
+    def rows(self, start: int, stop: int):
+        """crud.iter_prices rows over [start, stop), converted BATCH bars at
+        a time."""
+        for lo in range(start, stop, BATCH):
+            columns = self.columns(lo, min(lo + BATCH, stop))
+            yield from zip(columns['date'], *[columns[column] for column in COLUMNS])
+
+
+class SeriesStore:
+    """Series per security, loaded on first use and brought up to date
+    whenever the SET index gets a new WatchOCS_Date (checked every
+    check_interval seconds). get_many reads all the securities it lacks in
+    one statement, as the per-request queries of /ohlcvv/batch and
+    /relative/ did. At most maxbytes of arrays are held, least recently
+    used first out.
+
+    An update reads the last RESTATE_DAYS of each series again along with
+    the new rows and replaces the series if any of those bars changed. A
+    series is reloaded in full once it is max_age seconds old, which bounds
+    how long an older restatement goes unseen.
+
+    The SET and mai lists with their indices, about 950 securities at some
+    3,100 bars each (3M bars), take 102 MiB as Series against 1.3 GiB as
+    dicts per bar (benchmarks.ohlcv), so the default maxbytes holds the
+    whole universe in each worker.
+    """
+
+    def __init__(self, maxbytes: int = 256 << 20, check_interval: float = 60, max_age: float = 86400):
+        self.maxbytes = maxbytes
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._watermark = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+
+    def _check(self, db: Session):
+        if time.monotonic() - self._checked < self.check_interval:
+            return
+        watermark = crud.get_latest_trading_date(db)
+        with self._lock:
+            self._watermark = watermark
+            self._checked = time.monotonic()
+
+    def get(self, db: Session, security_id: int) -> Series:
+        return self.get_many(db, [security_id])[security_id]
+
+    def get_many(self, db: Session, security_ids):
+        """{security ID: Series}. The securities missing or behind the
+        watermark are read together, one crud.get_prices_many for those to
+        load in full and one per distinct last date for the recent rows of
+        the rest, so a suspended security does not widen the read of every
+        other one."""
+        self._check(db)
+        now = time.monotonic()
+        result, cold, stale = {}, [], {}
+        with self._lock:
+            watermark = self._watermark
+            for security_id in dict.fromkeys(security_ids):
+                entry = self._entries.get(security_id)
+                if entry is not None and entry[1] == watermark and now - entry[2] < self.max_age:
+                    self._entries.move_to_end(security_id)
+                    self.hits += 1
+                    result[security_id] = entry[0]
+                    continue
+                self.misses += 1
+                if entry is None or entry[0].size == 0 or now - entry[2] >= self.max_age:
+                    cold.append(security_id)
+                else:
+                    stale[security_id] = entry
+        rows = crud.get_prices_many(db, cold) if cold else {}
+        behind = collections.defaultdict(list)
+        for security_id, entry in stale.items():
+            behind[entry[0].last_date()].append(security_id)
+        recent = {}
+        for last_date, ids in behind.items():
+            recent.update(crud.get_prices_many(db, ids, after=last_date - datetime.timedelta(days=RESTATE_DAYS)))
+
+        with self._lock:
+            for security_id, security_rows in rows.items():
+                series = Series()
+                series.append(security_rows)
+                self._store(security_id, series, watermark, now)
+                result[security_id] = series
+            for security_id, entry in stale.items():
+                current = self._entries.get(security_id)
+                # Possibly brought up to date, reloaded or evicted by another
+                # request meanwhile.
+                if current is not None and current[1] == watermark:
+                    result[security_id] = current[0]
+                    continue
+                series, _, loaded, _ = current or entry
+                since = series.last_date() - datetime.timedelta(days=RESTATE_DAYS)
+                series = series.refreshed([row for row in recent[security_id] if row[0] > since], since)
+                self._store(security_id, series, watermark, loaded)
+                result[security_id] = series
+            while self.size > self.maxbytes and len(self._entries) > 1:
+                self.size -= self._entries.popitem(last=False)[1][3]
+        return {security_id: result[security_id] for security_id in dict.fromkeys(security_ids)}
+
+    def _store(self, security_id: int, series: Series, watermark, loaded: float):
+        current = self._entries.get(security_id)
+        if current is not None:
+            self.size -= current[3]
+        # nbytes as stored, since an in-place append grows the arrays.
+        self._entries[security_id] = (series, watermark, loaded, series.nbytes)
+        self._entries.move_to_end(security_id)
+        self.size += series.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self._checked = float('-inf')
+
+
+store = SeriesStore()
+
+
+def iter_prices(db: Session, security_id: int, after=None, limit: int = None):
+    """crud.iter_prices from the store."""
+    series = store.get(db, security_id)
+    return series.rows(*series.after(after, limit))
+
+
+def get_ohlcvv(db: Session, symbol_name: str, length: int = 200):
+    """The last length bars of symbol_name, latest first, None for an
+    unknown symbol."""
+    symbol = registry.symbols.by_name(db, symbol_name)
+    if symbol is None:
+        return None
+    series = store.get(db, symbol['ID'])
+    columns = series.columns(*series.tail(length))
+    data = [dict(zip(COLUMNS + ('date',), row))
+            for row in zip(*[columns[column] for column in COLUMNS], columns['date'])]
+    data.reverse()
+    return {'symbol': symbol['Name'], 'data': data}
+
+
+def get_ohlcvv_many(db: Session, symbols, length: int = 200):
+    """{name: {'date': [...], <column>: [...]}} of the last length bars of
+    every known symbol, latest first."""
+    names = {}
+    for symbol_name in symbols:
+        symbol = registry.symbols.by_name(db, symbol_name)
+        if symbol is not None:
+            names.setdefault(symbol['ID'], symbol['Name'])
+    out = {}
+    for security_id, series in store.get_many(db, list(names)).items():
+        start, stop = series.tail(length)
+        if start == stop:
+            continue
+        columns = series.columns(start, stop)
+        out[names[security_id]] = {name: columns[name][::-1] for name in ('date',) + COLUMNS}
+    return out
+
+
+def get_prices_pct_change(db: Session, symbol_name: str):
+    """The latest bar of symbol_name with its change from the one before,
+    None for an unknown symbol or one with fewer than two bars."""
+    symbol = registry.symbols.by_name(db, symbol_name)
+    if symbol is None:
+        return None
+    series = store.get(db, symbol['ID'])
+    start, stop = series.tail(2)
+    if stop - start < 2:
+        return None
+    columns = series.columns(start, stop)
+    latest = {column: columns[column][1] for column in COLUMNS + ('date',)}
+    close, previous = columns['close'][1], columns['close'][0]
+    if close is None or not previous:
+        return {**latest, 'change': None, 'pct_change': None}
+    return {**latest, 'change': close - previous, 'pct_change': round((close - previous) / previous * 100, 2)}
@@ -0,0 +1,130 @@
+import collections
+import re
+import threading
+import time
+import warnings
+
+from sqlalchemy.orm import Session
+
+from . import crud, lazy, registry
+
+numpy = lazy.module('numpy')
+
+def parse_period(period: str, last: bool = False) -> int:
+    """'2020Q3' -> 20203. A bare fiscal year covers Q1..Q4 of that year."""
+    match = re.fullmatch(r'(\d{4})(?:Q([1-4]))?', period.strip().upper())
+    if match is None:
+        raise ValueError(f'invalid period {period!r}, expected YYYY or YYYYQn')
+    quarter = match.group(2) or ('4' if last else '1')
+    return int(match.group(1)) * 10 + int(quarter)
+
+
+def format_period(period: int) -> str:
+    return f'{period // 10}Q{period % 10}'
+
+
+def rank(values: 'numpy.ndarray'):
+    """Ascending average ranks along axis 0 (ties share the mean of their
+    positions) and rank / count percentiles, NaN left unranked. Matches
+    pandas' rank(method='average') and rank(pct=True) column by column."""
+    if values.size == 0:
+        return numpy.full(values.shape, numpy.nan), numpy.full(values.shape, numpy.nan)
+    n = values.shape[0]
+    flat = values.reshape(n, -1)
+    order = numpy.argsort(flat, axis=0, kind='stable')
+    ordered = numpy.take_along_axis(flat, order, axis=0)
+    valid = ~numpy.isnan(ordered)
+    starts = numpy.ones_like(ordered, dtype=bool)
+    starts[1:] = ordered[1:] != ordered[:-1]
+    # Number the runs of equal values uniquely across columns.
+    groups = numpy.cumsum(starts.T.ravel()).reshape(flat.shape[1], n).T - 1
+    positions = numpy.broadcast_to(numpy.arange(1, n + 1, dtype='float64')[:, None], flat.shape)
+    mean_position = numpy.bincount(groups.ravel(), weights=positions.ravel()) / numpy.bincount(groups.ravel())
+    ranked = numpy.where(valid, mean_position[groups], numpy.nan)
+    ranks = numpy.empty_like(ranked)
+    numpy.put_along_axis(ranks, order, ranked, axis=0)
+    counts = (~numpy.isnan(flat)).sum(axis=0)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        percentiles = ranks / counts
+    return ranks.reshape(values.shape), percentiles.reshape(values.shape)
+
+
+def build_panel(rows, account_ids):
+    """symbol x period x account matrix from long-form rows, NaN where a
+    security did not report an account for a period."""
+    if not rows:
+        return numpy.array([], dtype='int64'), numpy.array([], dtype='int64'), numpy.empty((0, 0, len(account_ids)))
+    securities = numpy.fromiter((row['SecurityID'] for row in rows), dtype='int64', count=len(rows))
+    periods = numpy.fromiter((row['Fiscal'] * 10 + row['Quarter'] for row in rows), dtype='int64', count=len(rows))
+    accounts = numpy.fromiter((row['AccountID'] for row in rows), dtype='int64', count=len(rows))
+    values = numpy.fromiter((numpy.nan if row['value'] is None else row['value'] for row in rows),
+                            dtype='float64', count=len(rows))
+    security_ids, security_index = numpy.unique(securities, return_inverse=True)
+    period_ids, period_index = numpy.unique(periods, return_inverse=True)
+    account_ids = numpy.asarray(account_ids, dtype='int64')
+    account_order = numpy.argsort(account_ids)
+    account_index = account_order[numpy.searchsorted(account_ids, accounts, sorter=account_order)]
+    panel = numpy.full((len(security_ids), len(period_ids), len(account_ids)), numpy.nan)
+    panel[security_index, period_index, account_index] = values
+    return security_ids, period_ids, panel
+
+
+class PanelCache:
+    """Panels keyed by request, kept until d_Finance gains a new quarter or
+    rows (checked every check_interval seconds)."""
+
+    def __init__(self, maxsize: int = 256, check_interval: float = 300):
+        self.maxsize = maxsize
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._panels = collections.OrderedDict()
+        self._watermark = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+
+    def _check(self, db: Session):
+        if time.monotonic() - self._checked < self.check_interval:
+            return
+        watermark = crud.get_finance_watermark(db)
+        with self._lock:
+            if watermark != self._watermark:
+                self._panels.clear()
+                self._watermark = watermark
+            self._checked = time.monotonic()
+
+    def get(self, db: Session, group: str, group_id: int, account_ids, first_period: int, last_period: int):
+        self._check(db)
+        key = (group, group_id, tuple(account_ids), first_period, last_period)
+        with self._lock:
+            if key in self._panels:
+                self._panels.move_to_end(key)
+                self.hits += 1
+                return self._panels[key]
+            self.misses += 1
+        rows = crud.get_finance_panel(group, group_id, account_ids, first_period, last_period, db)
+        security_ids, period_ids, panel = build_panel(rows, account_ids)
+        ranks, percentiles = rank(panel)
+        with warnings.catch_warnings():
+            # Periods where no security reported an account have no median.
+            warnings.simplefilter('ignore', RuntimeWarning)
+            medians = numpy.nanmedian(panel, axis=0) if len(security_ids) else numpy.full(panel.shape[1:], numpy.nan)
+        names = []
+        for security_id in security_ids.tolist():
+            symbol = registry.symbols.by_id(db, security_id)
+            names.append(symbol['Name'] if symbol else str(security_id))
+        result = {'symbols': names,
+                  'periods': [format_period(period) for period in period_ids.tolist()],
+                  'accounts': list(account_ids),
+                  'values': panel.tolist(),
+                  'rank': ranks.tolist(),
+                  'percentile': percentiles.tolist(),
+                  'median': medians.tolist()}
+        with self._lock:
+            self._panels[key] = result
+            while len(self._panels) > self.maxsize:
+                self._panels.popitem(last=False)
+        return result
+
+
+cache = PanelCache()
@@ -0,0 +1,394 @@
+import asyncio
+import concurrent.futures
+import datetime
+import fcntl
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import breadth, crud, flows, metrics, ohlcv, registry, responses, screen, store, strength
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Periods of /relative/ snapshotted for both views; others are computed on
+# request.
+RELATIVE_PERIODS = (20, 60, 100, 250)
+TRADESUM_START = '2015-01-01'
+TRADESUM_PERIODS = ('RECENT', 'MTD', 'QTD', 'YTD')
+
+
+def latest_trading_date():
+    db = SessionLocal()
+    try:
+        return crud.get_latest_trading_date(db)
+    finally:
+        db.close()
+
+
+def tradesum_name(route: str, period: str, today: datetime.date = None) -> str:
+    """Snapshot name of /<route>/recent/<period>, keyed by the day the period
+    starts so an MTD/QTD/YTD snapshot stops matching once the period rolls
+    over."""
+    since = flows.period_start(period, today)
+    return f'{route}/recent/{period}/{since or "last"}'
+
+
+class Task:
+    """One analytic: function(db) -> {snapshot name: body}, run once
+    every task in requires has succeeded."""
+
+    def __init__(self, name: str, function, requires=()):
+        self.name = name
+        self.function = function
+        self.requires = tuple(requires)
+
+
+def refresh_matrices(db: Session):
+    matrices = store.get_store()
+    for name in store.MATRICES:
+        matrices.refresh(name)
+    return {}
+
+
+def market_breadth(db: Session):
+    matrices = store.get_store()
+    universes = registry.universes.masks(db, matrices.frame('STOCKS').columns)
+    return {f'marketbreadth/{universe}': responses.encode(breadth.store_breadth(matrices, universes, universe))
+            for universe in universes}
+
+
+def screen_table(db: Session):
+    matrices = store.get_store()
+    table = screen.indicators(*[matrices.frame(name) for name in screen.Screener.MATRICES])
+    return {'screen/table': pickle.dumps(table, protocol=pickle.HIGHEST_PROTOCOL)}
+
+
+def relative(db: Session):
+    payloads = {}
+    for market_group in strength.GROUPS:
+        for period in RELATIVE_PERIODS:
+            for view in ('series', 'ranks'):
+                result = strength.cache.get(db, market_group, period, view)
+                if result is not None:
+                    payloads[f'relative/{market_group}/{view}/{period}'] = responses.encode(result)
+    return payloads
+
+
+def tradesum(market: str, route: str, db: Session):
+    ledger = flows.get_ledger(market)
+    df = ledger.frame(db, TRADESUM_START, None, running=flows.net_columns(market)).reset_index()
+    payloads = {f'{route}/': responses.encode(df)}
+    for period in TRADESUM_PERIODS:
+        result = ledger.totals(db, TRADESUM_START, None, period)
+        payloads[tradesum_name(route, period)] = responses.encode([] if result is None else [result])
+    return payloads
+
+
+# /tradesum_tfex/ is left out: it joins the intraday crawl, so it is never
+# final at the close.
+TASKS = (Task('matrices', refresh_matrices),
+         Task('marketbreadth', market_breadth, requires=('matrices',)),
+         Task('screen', screen_table, requires=('matrices',)),
+         Task('relative', relative),
+         Task('tradesum_set', functools.partial(tradesum, 'SET', 'tradesum_set')),
+         Task('tradesum_tfex_db', functools.partial(tradesum, 'TFEX', 'tradesum_tfex_db')))
+
+
+def _write(directory: str, name: str, body: bytes):
+    path = os.path.join(directory, *name.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.snap', 'wb') as f:
+        f.write(body)
+
+
+def _recheck():
+    """Makes the in-process caches the tasks read compare their watermarks
+    again on next use. A pool thread shares them with the requests, and one
+    that checked less than check_interval ago would otherwise hand the
+    previous trading date's results to a run for the new one."""
+    strength.cache._checked = float('-inf')
+    ohlcv.store._checked = float('-inf')
+    for ledger in list(flows._ledgers.values()):
+        ledger._checked = float('-inf')
+
+
+def _call(function, directory: str):
+    """Runs in a pool worker: function's snapshots written under directory,
+    returned as (names, seconds)."""
+    started = time.perf_counter()
+    _recheck()
+    db = SessionLocal()
+    try:
+        payloads = function(db)
+    finally:
+        db.close()
+    for name, body in payloads.items():
+        _write(directory, name, body)
+    return sorted(payloads), time.perf_counter() - started
+
+
+class SnapshotStore:
+    """Versioned analytics snapshots on local disk.
+
+    A run writes every snapshot into a fresh version directory and then
+    swaps CURRENT to it atomically, so readers see one run or the next and
+    never a mix. The previous version is kept for readers still on it.
+    Snapshots are only served while the version's trading date is the
+    latest one (read every check_interval seconds); until a run for a new
+    date has finished, endpoints compute on request as before.
+    """
+
+    def __init__(self, directory: str, watermark, check_interval: float = 30):
+        self.directory = directory
+        self.watermark = watermark
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._current = None
+        self._date = None
+        self._loaded = {}
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def manifest(self):
+        """The manifest of the CURRENT version, None before the first run."""
+        try:
+            with open(os.path.join(self.directory, 'CURRENT')) as f:
+                version = json.load(f)['version']
+            with open(os.path.join(self.directory, version, 'manifest.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _check(self):
+        if time.monotonic() - self._checked < self.check_interval:
+            return
+        self._checked = time.monotonic()
+        try:
+            date = str(self.watermark())
+        except Exception:
+            logger.warning('could not read the snapshot watermark', exc_info=True)
+            return
+        manifest = self.manifest()
+        with self._lock:
+            current = manifest if manifest is not None and manifest['watermark']['date'] == date else None
+            if (current and current['version']) != (self._current and self._current['version']):
+                self._loaded.clear()
+            self._current = current
+
+    def _path(self, name: str):
+        current = self._current
+        return None if current is None else os.path.join(self.directory, current['version'], *name.split('/')) + '.snap'
+
+    def read(self, name: str):
+        """The body of snapshot name, None if there is none for the latest
+        trading date."""
+        self._check()
+        path = self._path(name)
+        try:
+            if path is not None:
+                with open(path, 'rb') as f:
+                    body = f.read()
+                self.hits += 1
+                return body
+        except FileNotFoundError:
+            pass
+        self.misses += 1
+        return None
+
+    def load(self, name: str):
+        """read(name) unpickled, kept in memory until the version changes."""
+        self._check()
+        with self._lock:
+            key = self._path(name)
+            if key in self._loaded:
+                self.hits += 1
+                return self._loaded[key]
+        body = self.read(name)
+        value = None if body is None else pickle.loads(body)
+        with self._lock:
+            if value is not None and key == self._path(name):
+                self._loaded[key] = value
+        return value
+
+    def begin(self, date: str) -> str:
+        version = f'{date[:10]}-{uuid.uuid4().hex[:8]}'
+        os.makedirs(os.path.join(self.directory, version))
+        return version
+
+    def publish(self, version: str, manifest: dict):
+        with open(os.path.join(self.directory, version, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=1)
+        previous = self.manifest()
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': version}, f)
+        os.replace(tmp, os.path.join(self.directory, 'CURRENT'))
+        self._checked = float('-inf')
+
+        keep = {version, previous['version'] if previous else None}
+        for entry in os.listdir(self.directory):
+            if entry not in keep and os.path.isdir(os.path.join(self.directory, entry)):
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+    def discard(self, version: str):
+        shutil.rmtree(os.path.join(self.directory, version), ignore_errors=True)
+
+
+class Pipeline:
+    """Runs TASKS once per new watermark (the latest WatchOCS_Date and the
+    version of every matrix CSV) and publishes their snapshots as one
+    version.
+
+    Tasks run in a pool of workers spawned processes (a single thread if
+    workers is 0), each as soon as what it requires has succeeded; the
+    dependents of a failed task are skipped. An flock on the snapshot
+    directory makes sure only one gunicorn worker runs the pipeline at a
+    time. A run with failures is retried on the next check.
+    """
+
+    def __init__(self, snapshots: SnapshotStore, tasks=TASKS, workers: int = 2):
+        self.snapshots = snapshots
+        self.tasks = tasks
+        self.workers = workers
+        names = {task.name for task in tasks}
+        for task in tasks:
+            for required in task.requires:
+                if required not in names:
+                    raise ValueError(f'task {task.name!r} requires unknown task {required!r}')
+
+    def watermark(self, db: Session):
+        source = store.get_store().source
+        return {'date': str(crud.get_latest_trading_date(db)),
+                'matrices': {name: source.version(f'{name}.csv') for name in store.MATRICES}}
+
+    def _flock(self):
+        lock = open(os.path.join(self.snapshots.directory, 'pipeline.lock'), 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def is_running(self) -> bool:
+        lock = self._flock()
+        if lock is None:
+            return True
+        lock.close()
+        return False
+
+    def run(self, force: bool = False, reason: str = 'manual'):
+        """Runs every task unless the current version already covers the
+        watermark without failures (force runs regardless). Returns the new
+        manifest, or None if nothing ran or another run holds the lock."""
+        lock = self._flock()
+        if lock is None:
+            return None
+        with lock:
+            db = SessionLocal()
+            try:
+                watermark = self.watermark(db)
+            finally:
+                db.close()
+            current = self.snapshots.manifest()
+            if not force and current is not None and current['watermark'] == watermark and not current['failed']:
+                return None
+            return self._run(watermark, reason)
+
+    def _executor(self):
+        if self.workers <= 0:
+            return concurrent.futures.ThreadPoolExecutor(1)
+        # spawn, not fork: a forked worker would inherit the caches of this
+        # (multi-threaded) process, and any lock another thread held at the
+        # fork would stay held in it forever.
+        return concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _run(self, watermark: dict, reason: str):
+        started = time.perf_counter()
+        started_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        version = self.snapshots.begin(watermark['date'])
+        directory = os.path.join(self.snapshots.directory, version)
+        logger.info('pipeline %s started (%s) for %s', version, reason, watermark['date'])
+        results = {}
+        pending = {task.name: task for task in self.tasks}
+        running = {}
+        try:
+            with self._executor() as pool:
+                while pending or running:
+                    for name, task in list(pending.items()):
+                        failed = [required for required in task.requires
+                                  if required in results and results[required]['status'] != 'ok']
+                        if failed:
+                            del pending[name]
+                            results[name] = {'status': 'skipped', 'error': f'{failed[0]} did not succeed'}
+                            logger.warning('pipeline task %s skipped: %s did not succeed', name, failed[0])
+                        elif all(required in results for required in task.requires):
+                            del pending[name]
+                            running[pool.submit(_call, task.function, directory)] = name
+                    if not running:
+                        # Only reachable with a dependency cycle.
+                        for name in pending:
+                            results[name] = {'status': 'skipped', 'error': 'dependency cycle'}
+                        break
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        try:
+                            names, seconds = future.result()
+                        except Exception as e:
+                            results[name] = {'status': 'failed', 'error': f'{e!r}'}
+                            logger.error('pipeline task %s failed', name, exc_info=e)
+                            continue
+                        metrics.PIPELINE.observe(seconds, name)
+                        results[name] = {'status': 'ok', 'seconds': round(seconds, 3), 'snapshots': len(names)}
+                        logger.info('pipeline task %s: %d snapshots in %.2fs', name, len(names), seconds)
+        except BaseException:
+            self.snapshots.discard(version)
+            raise
+
+        seconds = time.perf_counter() - started
+        failed = sorted(name for name, result in results.items() if result['status'] != 'ok')
+        manifest = {'version': version, 'watermark': watermark, 'reason': reason, 'started': started_at,
+                    'seconds': round(seconds, 3), 'failed': failed,
+                    'tasks': {task.name: results[task.name] for task in self.tasks}}
+        self.snapshots.publish(version, manifest)
+        logger.info('pipeline %s published in %.2fs%s', version, seconds,
+                    f', {len(failed)} tasks did not succeed: {", ".join(failed)}' if failed else '')
+        return manifest
+
+    def status(self) -> dict:
+        return {'running': self.is_running(), 'current': self.snapshots.manifest()}
+
+
+async def run(pipeline: Pipeline, interval: float = 300):
+    while True:
+        try:
+            await run_in_threadpool(pipeline.run, False, 'new data')
+        except Exception as e:
+            logger.warning('pipeline check failed: %r', e)
+        await asyncio.sleep(interval)
+
+
+_pipeline = None
+
+
+def get_pipeline() -> Pipeline:
+    global _pipeline
+    if _pipeline is None:
+        snapshots = SnapshotStore(os.environ.get('YONG_SNAPSHOT_DIR', 'analytics-snapshots'), latest_trading_date)
+        _pipeline = Pipeline(snapshots, workers=int(os.environ.get('YONG_PIPELINE_WORKERS', 2)))
+    return _pipeline
@@ -0,0 +1,222 @@
+import logging
+import os
+import re
+import time
+
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.engine import Engine
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = os.environ.get('YONG_DB_SCHEMA', 'DBMarketWatchMaster.dbo')
+SLOW_QUERY_SECONDS = float(os.environ.get('YONG_SLOW_QUERY_SECONDS', 1))
+
+
+class Query:
+    """One raw SQL statement with :name parameters, built once per dialect.
+
+    pymssql interpolates parameters into the statement text on the client,
+    which would still give SQL Server a different text per value. For that
+    driver the statement is sent as sp_executesql with a constant body and
+    typed parameters, so a single plan is cached and reused. Other drivers
+    get the text() as is. Each body starts with a /* yong:<name> */ comment
+    so the plan can be found in sys.dm_exec_cached_plans.
+
+    Parameters named in expanding take a list and render as IN (...) at
+    execution. The text of such a statement varies with the list length, so
+    it is always sent as is.
+    """
+
+    def __init__(self, name: str, sql: str, expanding=(), **types):
+        self.name = name
+        self.sql = f'/* yong:{name} */ {sql}'
+        self.expanding = tuple(expanding)
+        self.types = types
+        self._statements = {}
+
+    def statement(self, dialect):
+        key = (dialect.name, dialect.driver)
+        statement = self._statements.get(key)
+        if statement is None:
+            if key == ('mssql', 'pymssql') and self.types and not self.expanding:
+                body = re.sub(r'(?<![:\w]):(\w+)', r'@\1', self.sql).replace("'", "''")
+                declarations = ', '.join(f'@{name} {type_}' for name, type_ in self.types.items())
+                arguments = ', '.join(f'@{name} = :{name}' for name in self.types)
+                statement = text(f"EXEC sp_executesql N'{body}', N'{declarations}', {arguments}")
+            else:
+                statement = text(self.sql)
+                if self.expanding:
+                    statement = statement.bindparams(*[bindparam(name, expanding=True) for name in self.expanding])
+            statement = statement.execution_options(query_name=self.name)
+            self._statements[key] = statement
+        return statement
+
+
+def execute(db, query: Query, **params):
+    return db.get_bind().execute(query.statement(db.get_bind().dialect), params)
+
+
+def fetch_all(db, query: Query, **params):
+    return [{column: value for column, value in rowproxy.items()} for rowproxy in execute(db, query, **params)]
+
+
+SYMBOLS_IN_SECTOR = Query('symbols_in_sector', f"""SELECT * FROM {SCHEMA}.d_Compsec
+JOIN {SCHEMA}.SectorNo  ON ({SCHEMA}.d_Compsec.SectorNo = {SCHEMA}.SectorNo.SectorNumber)
+WHERE {SCHEMA}.d_Compsec.SectorNo = :sector_number AND {SCHEMA}.d_Compsec.ListingStatus = 'L'""",
+    sector_number='int')
+
+LISTED_SECURITIES = Query('listed_securities', f"""SELECT SecurityID FROM {SCHEMA}.d_Compsec WHERE ListingStatus = 'L'""")
+
+# Only run when the reflected d_Compsec has a Market column (see
+# registry.UniverseRegistry).
+LISTED_MARKETS = Query('listed_markets', f"""SELECT SecurityID, Market FROM {SCHEMA}.d_Compsec
+    WHERE ListingStatus = 'L'""")
+
+_PRICES_MANY = f"""SELECT SecurityNumber, WatchOCS_Date, OpenPrice, HighestPrice, LowestPrice, LastSalePrice,
+                        TotalSharesTraded, TotalValueTradedin1000
+                        FROM {SCHEMA}.WatchOpenCloseSummary
+                        WHERE SecurityNumber IN :security_ids"""
+
+PRICES_MANY = Query('prices_many', f"""{_PRICES_MANY}
+                        ORDER BY SecurityNumber, WatchOCS_Date""",
+    expanding=('security_ids',))
+
+PRICES_MANY_SINCE = Query('prices_many_since', f"""{_PRICES_MANY}
+                        AND WatchOCS_Date >= :since
+                        ORDER BY SecurityNumber, WatchOCS_Date""",
+    expanding=('security_ids',), since='date')
+
+ACCOUNTS = Query('accounts', f"""SELECT DISTINCT  AccountCode, AccountNameEN FROM {SCHEMA}.d_Account """)
+
+FINANCE_BY_SECTOR = Query('finance_by_sector', f"""SELECT * FROM {SCHEMA}.d_Finance as finance
+    WHERE finance.SecurityID IN (
+	SELECT SecurityID FROM {SCHEMA}.d_Compsec
+	JOIN {SCHEMA}.SectorNo  ON ({SCHEMA}.d_Compsec.SectorNo = {SCHEMA}.SectorNo.SectorNumber)
+	WHERE {SCHEMA}.d_Compsec.SectorNo = :sector_id AND {SCHEMA}.d_Compsec.ListingStatus = 'L'
+	)
+	AND finance.Fiscal = :fiscal
+	AND finance.Quarter = :quarter
+	AND finance.AccountID = :feature_id
+	AND finance.FinancialStatementType = 'U'""",
+    sector_id='int', fiscal='int', quarter='int', feature_id='int')
+
+# d_Finance column holding the reported figure of an account. Nothing in the
+# baseline names it (/finance_by_sector selects *), so it could not be checked
+# against the production schema from here; crud.get_finance_panel compares
+# it with the reflected table and says which columns there are if it is
+# wrong.
+FINANCE_VALUE = os.environ.get('YONG_FINANCE_VALUE_COLUMN', 'Amount')
+
+_FINANCE_PANEL = f"""SELECT finance.SecurityID, finance.Fiscal, finance.Quarter, finance.AccountID, finance.{FINANCE_VALUE} AS value
+    FROM {SCHEMA}.d_Finance AS finance
+    JOIN {SCHEMA}.d_Compsec ON ({SCHEMA}.d_Compsec.SecurityID = finance.SecurityID)
+    JOIN {SCHEMA}.SectorNo  ON ({SCHEMA}.d_Compsec.SectorNo = {SCHEMA}.SectorNo.SectorNumber)
+    WHERE {SCHEMA}.d_Compsec.ListingStatus = 'L'
+	AND finance.FinancialStatementType = 'U'
+	AND finance.Fiscal BETWEEN :first_fiscal AND :last_fiscal
+	AND (finance.Fiscal > :first_fiscal OR finance.Quarter >= :first_quarter)
+	AND (finance.Fiscal < :last_fiscal OR finance.Quarter <= :last_quarter)
+	AND finance.AccountID IN (SELECT CAST(value AS int) FROM STRING_SPLIT(:account_ids, ','))"""
+
+FINANCE_PANEL_BY_SECTOR = Query('finance_panel_by_sector', f"""{_FINANCE_PANEL}
+	AND {SCHEMA}.d_Compsec.SectorNo = :group_id""",
+    first_fiscal='int', first_quarter='int', last_fiscal='int', last_quarter='int', account_ids='nvarchar(max)',
+    group_id='int')
+
+FINANCE_PANEL_BY_INDUSTRY = Query('finance_panel_by_industry', f"""{_FINANCE_PANEL}
+	AND {SCHEMA}.SectorNo.IndustryNumber = :group_id""",
+    first_fiscal='int', first_quarter='int', last_fiscal='int', last_quarter='int', account_ids='nvarchar(max)',
+    group_id='int')
+
+FINANCE_WATERMARK = Query('finance_watermark', f"""SELECT MAX(Fiscal * 10 + Quarter) AS period, COUNT(*) AS row_count
+    FROM {SCHEMA}.d_Finance WHERE FinancialStatementType = 'U'""")
+
+BUSINESS_INFO = Query('business_info', f"""SELECT * FROM {SCHEMA}.d_Business
+	WHERE SecuritySymbol = :symbol_name""",
+    symbol_name='nvarchar(32)')
+
+FACTSHEET = Query('factsheet', """SELECT * FROM fnStockfundamentalByFactsheetYOY(:security_id)""",
+    security_id='int')
+
+# The IDs travel as one ',1,2,3,' string so the statement text does not
+# depend on how many securities are asked for.
+FACTSHEETS = Query('factsheets', """SELECT s.ID AS factsheet_security_id, f.*
+                        FROM vStockAndIndex AS s CROSS APPLY fnStockfundamentalByFactsheetYOY(s.ID) AS f
+                        WHERE CHARINDEX(',' + CAST(s.ID AS varchar(12)) + ',', :security_ids) > 0""",
+    security_ids='nvarchar(max)')
+
+_TRADE_FLOWS = f"""SELECT WatchOCS_Date AS date,
+                        ROUND(OpenPrice,2) AS SETopen,
+                        ROUND(HighestPrice,2) AS SEThigh,
+                        ROUND(LowestPrice,2) AS SETlow,
+                        ROUND(LastSalePrice,2) AS SETclose,
+                        FundValBuy,FundValSell,
+                        ForeignValBuy,ForeignValSell,
+                        TradingValBuy,TradingValSell,
+                        CustomerValBuy,CustomerValSell,
+                        FundValBuy-FundValSell AS FundValNet,
+                        ForeignValBuy-ForeignValSell AS ForeignValNet,
+                        TradingValBuy-TradingValSell AS TradingValNet,
+                        CustomerValBuy-CustomerValSell AS CustomerValNet
+                        FROM {SCHEMA}.WatchOpenCloseSummary LEFT JOIN {SCHEMA}.d_CustomerHistory ON WatchOCS_Date = SeqDate
+                        WHERE {SCHEMA}.WatchOpenCloseSummary.SecurityNumber = :security_number AND {SCHEMA}.d_CustomerHistory.SecurityNumber = 1024"""
+
+TRADE_FLOWS = Query('trade_flows', f"""{_TRADE_FLOWS}
+                        ORDER BY WatchOCS_Date""",
+    security_number='int')
+
+TRADE_FLOWS_AFTER = Query('trade_flows_after', f"""{_TRADE_FLOWS}
+                        AND WatchOCS_Date > :after
+                        ORDER BY WatchOCS_Date""",
+    security_number='int', after='date')
+
+TRADE_FLOWS_WATERMARK = Query('trade_flows_watermark', f"""SELECT COUNT(*) AS row_count, MAX(WatchOCS_Date) AS latest
+                        FROM {SCHEMA}.WatchOpenCloseSummary LEFT JOIN {SCHEMA}.d_CustomerHistory ON WatchOCS_Date = SeqDate
+                        WHERE {SCHEMA}.WatchOpenCloseSummary.SecurityNumber = :security_number AND {SCHEMA}.d_CustomerHistory.SecurityNumber = 1024""",
+    security_number='int')
+
+# The table names travel as one ',a,b,' string, like FACTSHEETS' IDs.
+SCHEMA_VERSION = Query('schema_version', """SELECT COUNT(*) AS column_count,
+                        CHECKSUM_AGG(CHECKSUM(TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, DATA_TYPE, IS_NULLABLE,
+                                              CHARACTER_MAXIMUM_LENGTH, NUMERIC_PRECISION, NUMERIC_SCALE)) AS checksum
+                        FROM INFORMATION_SCHEMA.COLUMNS
+                        WHERE CHARINDEX(',' + TABLE_NAME + ',', :tables) > 0""",
+    tables='nvarchar(max)')
+
+PLAN_USAGE = Query('plan_usage', """SELECT SUBSTRING(t.text, CHARINDEX('/* yong:', t.text) + 8,
+                            CHARINDEX(' */', t.text, CHARINDEX('/* yong:', t.text)) - CHARINDEX('/* yong:', t.text) - 8) AS query,
+                        p.objtype, p.usecounts
+                        FROM sys.dm_exec_cached_plans AS p CROSS APPLY sys.dm_exec_sql_text(p.plan_handle) AS t
+                        WHERE t.text LIKE '%/* yong:%' AND t.text NOT LIKE '%/* yong:plan_usage */%'""")
+
+
+def plan_usage(db):
+    """{query name: {'plans': cached plans, 'uses': their total use count}}
+    for the statements above. A reused statement keeps one plan whose uses
+    grow; one compiled per call grows plans instead."""
+    usage = {}
+    for row in fetch_all(db, PLAN_USAGE):
+        entry = usage.setdefault(row['query'], {'plans': 0, 'uses': 0})
+        entry['plans'] += 1
+        entry['uses'] += row['usecounts']
+    return usage
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    name = context.execution_options.get('query_name', 'other')
+    metrics.QUERIES.observe(seconds, name)
+    if seconds >= SLOW_QUERY_SECONDS:
+        logger.warning('slow query %s: %.3f s', name, seconds)
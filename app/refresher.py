@@ -0,0 +1,183 @@
+import asyncio
+import datetime
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+BANGKOK = datetime.timezone(datetime.timedelta(hours=7))
+SESSIONS = ((datetime.time(9, 55), datetime.time(12, 35)),
+            (datetime.time(14, 25), datetime.time(17, 0)))
+HOLIDAYS = {datetime.date.fromisoformat(d) for d in os.environ.get('SET_HOLIDAYS', '').split(',') if d}
+
+
+def is_trading_day(day: datetime.date) -> bool:
+    return day.weekday() < 5 and day not in HOLIDAYS
+
+
+def is_trading(now: datetime.datetime = None) -> bool:
+    now = (now or datetime.datetime.now(BANGKOK)).astimezone(BANGKOK)
+    if not is_trading_day(now.date()):
+        return False
+    return any(start <= now.time() <= end for start, end in SESSIONS)
+
+
+def has_closed(now: datetime.datetime = None) -> bool:
+    now = (now or datetime.datetime.now(BANGKOK)).astimezone(BANGKOK)
+    return is_trading_day(now.date()) and now.time() > SESSIONS[-1][1]
+
+
+class Refresher:
+    """Keeps the last good result of one upstream source.
+
+    A background task refetches every trading_ttl seconds while the market is
+    open and every closed_ttl seconds otherwise. Readers never wait on the
+    upstream once a value exists: a stale value is returned immediately and a
+    refresh is kicked off, and a failed fetch keeps the previous value.
+
+    With a path, the gunicorn workers share one fetch: the worker holding
+    the flock on path.lock (the first to ask, until it exits) fetches and
+    writes the result to path, and the others read it from there instead of
+    the upstream. A worker that finds no shared result waits up to wait
+    seconds for the leader's first one before fetching for itself.
+    """
+
+    def __init__(self, name: str, fetch, trading_ttl: float = 30, closed_ttl: float = 900, path: str = None,
+                 wait: float = 15):
+        self.name = name
+        self.fetch = fetch
+        self.trading_ttl = trading_ttl
+        self.closed_ttl = closed_ttl
+        self.path = path
+        self.wait = wait
+        self.value = None
+        self.fetched_at = None
+        self.error = None
+        # Wall-clock, so ages read from path compare across workers.
+        self._updated = None
+        self._leader = None
+        self._task = None
+        self._inflight = None
+
+    def ttl(self) -> float:
+        return self.trading_ttl if is_trading() else self.closed_ttl
+
+    def age(self):
+        return None if self._updated is None else max(time.time() - self._updated, 0)
+
+    def is_stale(self) -> bool:
+        return self._updated is None or self.age() >= self.ttl()
+
+    def is_leader(self) -> bool:
+        """Whether this worker fetches from the upstream: always without a
+        path, otherwise while it holds the flock on path.lock."""
+        if self.path is None or self._leader is not None:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        lock = open(f'{self.path}.lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        self._leader = lock
+        return True
+
+    def _read(self) -> bool:
+        """Takes the leader's result from path; False if there is none yet."""
+        try:
+            with open(self.path) as f:
+                shared = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        self.error = shared['error']
+        if shared['updated'] is not None and (self._updated is None or shared['updated'] > self._updated):
+            self.value = shared['value']
+            self.fetched_at = datetime.datetime.fromisoformat(shared['fetched_at'])
+            self._updated = shared['updated']
+        return True
+
+    def _write(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'value': self.value, 'error': self.error, 'updated': self._updated,
+                       'fetched_at': self.fetched_at and self.fetched_at.isoformat()}, f)
+        os.replace(tmp, self.path)
+
+    async def refresh(self):
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+            self._inflight.add_done_callback(self._clear_inflight)
+        await asyncio.shield(self._inflight)
+
+    def _clear_inflight(self, task):
+        self._inflight = None
+
+    async def _refresh(self):
+        leader = self.is_leader()
+        if self.path is not None:
+            # A new leader starts from its predecessor's result, so a failed
+            # first fetch does not overwrite it with nothing.
+            found = self._read()
+            # A follower waits out the leader's first fetch.
+            deadline = time.monotonic() + self.wait
+            while not leader and not found and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+                found = self._read()
+                leader = self.is_leader()
+            if found and not leader:
+                return
+        try:
+            value = await self.fetch()
+        except Exception as e:
+            self.error = f'{e}'
+            logger.warning('refresh of %s failed: %r', self.name, e)
+        else:
+            self.value = value
+            self.error = None
+            self.fetched_at = datetime.datetime.now(BANGKOK)
+            self._updated = time.time()
+        if leader and self.path is not None:
+            self._write()
+
+    async def get(self):
+        if self.value is None:
+            await self.refresh()
+        elif self.is_stale() and self._inflight is None:
+            asyncio.ensure_future(self.refresh())
+        return self.value
+
+    def peek(self):
+        return self.value
+
+    def headers(self) -> dict:
+        if self._updated is None:
+            return {}
+        return {'Age': str(int(self.age())),
+                'X-Data-Fetched-At': self.fetched_at.isoformat(timespec='seconds')}
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.ttl() if self.error is None else min(self.ttl(), 15))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._leader is not None:
+            self._leader.close()
+            self._leader = None
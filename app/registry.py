@@ -0,0 +1,132 @@
+import logging
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from . import lazy, models, queries
+
+logger = logging.getLogger(__name__)
+
+numpy = lazy.module('numpy')
+
+
+class SymbolRegistry:
+    """vStockAndIndex held in memory, with name <-> ID lookups.
+
+    Names resolve case-insensitively (an exact match wins if two names only
+    differ by case). The table is reloaded when it is older than ttl seconds
+    or on an explicit refresh().
+    """
+
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self.loaded_at = None
+        self._rows = []
+        self._by_id = {}
+        self._by_name = {}
+        self._by_upper_name = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session):
+        columns = [column.name for column in models.vStockAndIndex.__table__.columns]
+        rows = [{column: getattr(symbol, column) for column in columns}
+                for symbol in db.query(models.vStockAndIndex).execution_options(query_name='symbols').all()]
+        by_upper_name = {}
+        for row in rows:
+            by_upper_name.setdefault(str(row['Name']).upper(), row)
+        with self._lock:
+            self._rows = rows
+            self._by_id = {row['ID']: row for row in rows}
+            self._by_name = {row['Name']: row for row in rows}
+            self._by_upper_name = by_upper_name
+            self.loaded_at = time.monotonic()
+
+    def ensure(self, db: Session):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at >= self.ttl:
+            self.refresh(db)
+
+    def all(self, db: Session):
+        self.ensure(db)
+        return self._rows
+
+    def by_name(self, db: Session, symbol_name: str):
+        self.ensure(db)
+        return self._by_name.get(symbol_name) or self._by_upper_name.get(symbol_name.upper())
+
+    def by_id(self, db: Session, symbol_id: int):
+        self.ensure(db)
+        return self._by_id.get(symbol_id)
+
+    def id_of(self, db: Session, symbol_name: str):
+        symbol = self.by_name(db, symbol_name)
+        return None if symbol is None else symbol['ID']
+
+
+symbols = SymbolRegistry()
+
+
+class UniverseRegistry:
+    """Universe name -> member symbols, reloaded when older than ttl seconds.
+
+    LISTED is every d_Compsec security with ListingStatus 'L', and each of
+    MARKETS the listed securities whose d_Compsec Market it is. The Market
+    column is only read if the reflected d_Compsec has it; without it
+    LISTED is the only universe besides ALL. Index universes such as SET100
+    and SET50 wait for a source of their constituents.
+    """
+
+    MARKETS = ('SET', 'MAI')
+
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self.loaded_at = None
+        self._members = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session):
+        markets = self.MARKETS if 'Market' in models.d_Compsec.__table__.columns else ()
+        if not markets:
+            logger.warning('d_Compsec has no Market column, so there are no %s universes', '/'.join(self.MARKETS))
+        members = {name: set() for name in ('LISTED',) + markets}
+        query = queries.LISTED_MARKETS if markets else queries.LISTED_SECURITIES
+        for row in queries.fetch_all(db, query):
+            symbol = symbols.by_id(db, row['SecurityID'])
+            if symbol is None:
+                continue
+            members['LISTED'].add(symbol['Name'])
+            market = str(row.get('Market') or '').strip().upper()
+            if market in markets:
+                members[market].add(symbol['Name'])
+        with self._lock:
+            self._members = {name: frozenset(group) for name, group in members.items()}
+            self.loaded_at = time.monotonic()
+
+    def ensure(self, db: Session):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at >= self.ttl:
+            self.refresh(db)
+
+    def names(self, db: Session):
+        self.ensure(db)
+        return ['ALL', *self._members]
+
+    def members(self, db: Session, name: str):
+        """The symbols of universe name, None for ALL (no restriction)."""
+        self.ensure(db)
+        name = name.upper()
+        if name == 'ALL':
+            return None
+        if name not in self._members:
+            raise ValueError(f'unknown universe {name!r}, expected one of {", ".join(self.names(db))}')
+        return self._members[name]
+
+    def masks(self, db: Session, columns):
+        """{universe: bool mask over columns} for every universe, ALL first."""
+        self.ensure(db)
+        masks = {'ALL': numpy.ones(len(columns), dtype=bool)}
+        for name, members in self._members.items():
+            masks[name] = numpy.fromiter((column in members for column in columns), dtype=bool, count=len(columns))
+        return masks
+
+
+universes = UniverseRegistry()
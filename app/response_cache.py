@@ -0,0 +1,228 @@
+import collections
+import datetime
+import email.utils
+import hashlib
+import logging
+import threading
+import time
+import urllib.parse
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+from . import refresher
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Response bodies of end-of-day routes, kept until the next trading date
+    lands.
+
+    Entries are keyed by path and normalized query string and tagged with
+    the watermark (the latest WatchOCS_Date) they were computed under. The
+    watermark is read every check_interval seconds and a new one drops every
+    entry. Entries older than max_age are recomputed regardless, for routes
+    whose inputs land a little after the database rows. At most maxbytes of
+    bodies are kept, least recently used first out; a body larger than
+    max_entry_bytes is never stored.
+    """
+
+    def __init__(self, watermark, maxbytes: int = 128 << 20, max_entry_bytes: int = 8 << 20,
+                 check_interval: float = 30, max_age: float = 600):
+        self.watermark = watermark
+        self.maxbytes = maxbytes
+        self.max_entry_bytes = max_entry_bytes
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.size = 0
+        self.tag = None
+        self._entries = collections.OrderedDict()
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+
+    async def check(self):
+        if time.monotonic() - self._checked < self.check_interval:
+            return
+        # Claimed before the await, so concurrent requests do not all poll.
+        self._checked = time.monotonic()
+        try:
+            tag = await run_in_threadpool(self.watermark)
+        except Exception:
+            logger.warning('could not read the response cache watermark', exc_info=True)
+            return
+        with self._lock:
+            if tag != self.tag:
+                self._entries.clear()
+                self.size = 0
+                self.tag = tag
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry['stored'] >= self.max_age:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, tag, headers, body: bytes):
+        """Stores body unless the watermark moved on while it was computed.
+        Returns the entry either way, for its ETag and Last-Modified."""
+        entry = {'headers': headers, 'body': body, 'stored': time.monotonic(),
+                 'etag': '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest(),
+                 'last_modified': last_modified(tag)}
+        if len(body) > self.max_entry_bytes:
+            return entry
+        with self._lock:
+            if tag != self.tag:
+                return entry
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.size += len(body)
+            while self.size > self.maxbytes:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def _remove(self, key):
+        self.size -= len(self._entries.pop(key)['body'])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self._checked = float('-inf')
+
+
+def last_modified(tag) -> str:
+    """HTTP date of the trading date tag (the watermark), at its start in
+    Bangkok; the current time if tag is not a date."""
+    try:
+        day = datetime.date.fromisoformat(str(tag)[:10])
+    except ValueError:
+        return email.utils.formatdate(usegmt=True)
+    start = datetime.datetime.combine(day, datetime.time(), refresher.BANGKOK)
+    return email.utils.format_datetime(start.astimezone(datetime.timezone.utc), usegmt=True)
+
+
+def stream_validators(tag, key):
+    """Validators of a streamed response, whose body is never held to hash:
+    the ETag (weak, sent with W/) is of the watermark and the key."""
+    return {'etag': '"%s"' % hashlib.blake2b(repr((str(tag), key)).encode(), digest_size=16).hexdigest(),
+            'last_modified': last_modified(tag)}
+
+
+def cache_key(scope):
+    query = urllib.parse.parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+    return scope['path'], urllib.parse.urlencode(sorted(query))
+
+
+def _etags(headers: Headers):
+    return [tag.strip() for tag in headers.get('if-none-match', '').split(',') if tag.strip()]
+
+
+def is_fresh(entry, headers: Headers) -> bool:
+    if 'if-none-match' in headers:
+        tags = [tag[2:] if tag.startswith('W/') else tag for tag in _etags(headers)]
+        return '*' in tags or entry['etag'] in tags
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            return email.utils.parsedate_to_datetime(if_modified_since) >= \
+                email.utils.parsedate_to_datetime(entry['last_modified'])
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _validators(entry, weak: bool = False):
+    etag = ('W/' if weak else '') + entry['etag']
+    return [(b'etag', etag.encode()), (b'last-modified', entry['last_modified'].encode())]
+
+
+class CachedResponses:
+    """ASGI middleware answering GETs under prefixes from a ResponseCache.
+
+    A hit is sent from memory, or as 304 when the request's If-None-Match
+    (or If-Modified-Since) still matches. On a miss the endpoint runs and its
+    body is held until complete so the ETag can go in the headers; a body
+    that grows past max_entry_bytes is passed through as it streams instead
+    and is not stored. Only bodies the endpoint built in full (those sent
+    with a content-length) are held at all: a StreamingResponse, such as
+    /prices/{symbol}, goes straight through so its first bytes are not
+    delayed until its last. It gets the weak stream_validators, and a
+    request that still matches them is answered 304 without running the
+    endpoint.
+    """
+
+    def __init__(self, app, cache: ResponseCache, prefixes):
+        self.app = app
+        self.cache = cache
+        self.prefixes = tuple(prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'GET' or not scope['path'].startswith(self.prefixes):
+            return await self.app(scope, receive, send)
+        await self.cache.check()
+        key = cache_key(scope)
+        headers = Headers(scope=scope)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return await self._send_entry(entry, headers, send)
+
+        tag = self.cache.tag
+        streamed = None if tag is None else stream_validators(tag, key)
+        if streamed is not None and 'W/' + streamed['etag'] in _etags(headers):
+            self.cache.not_modified += 1
+            await send({'type': 'http.response.start', 'status': 304, 'headers': _validators(streamed, weak=True)})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        start = None
+        chunks = []
+        size = 0
+        streaming = False
+
+        async def capture(message):
+            nonlocal start, size, streaming
+            if streaming:
+                return await send(message)
+            if message['type'] == 'http.response.start':
+                start = message
+                if start['status'] != 200 or 'content-length' not in Headers(raw=start['headers']):
+                    streaming = True
+                    if start['status'] == 200 and streamed is not None:
+                        start = {**start, 'headers': list(start['headers']) + _validators(streamed, weak=True)}
+                    await send(start)
+                return
+            chunks.append(message.get('body', b''))
+            size += len(chunks[-1])
+            if size > self.cache.max_entry_bytes:
+                streaming = True
+                await send(start)
+                await send({'type': 'http.response.body', 'body': b''.join(chunks), 'more_body': message.get('more_body', False)})
+                return
+            if not message.get('more_body', False):
+                stored = [(name, value) for name, value in start['headers'] if name.lower() != b'content-length']
+                entry = self.cache.put(key, tag, stored, b''.join(chunks))
+                await self._send_entry(entry, headers, send, status=start['status'])
+
+        await self.app(scope, receive, capture)
+
+    async def _send_entry(self, entry, headers: Headers, send, status: int = 200):
+        if is_fresh(entry, headers):
+            self.cache.not_modified += 1
+            await send({'type': 'http.response.start', 'status': 304, 'headers': _validators(entry)})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        body = entry['body']
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': entry['headers'] + _validators(entry) + [(b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,116 @@
+import csv
+import io
+import itertools
+import json
+import math
+
+from starlette.responses import Response
+
+from . import lazy
+
+numpy = lazy.module('numpy')
+pandas = lazy.module('pandas')
+
+PRICE_FIELDS = ['date', 'open', 'high', 'low', 'close', 'volume', 'value']
+
+
+def batched(rows, size: int = 500):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _next_cursor(last, count: int, limit: int = None):
+    return last.isoformat() if limit is not None and count == limit and last is not None else None
+
+
+def price_records(symbol: str, rows, limit: int = None):
+    """{"symbol", "data": [{field: value}], "next"} encoded one batch of
+    rows at a time. next is the after= cursor of the following page, or null
+    once the history is exhausted."""
+    head = '{"symbol":%s,"data":[' % json.dumps(symbol)
+    count, last = 0, None
+    for batch in batched(rows):
+        encoded = ','.join(json.dumps(dict(zip(PRICE_FIELDS, (row[0].isoformat(),) + row[1:])))
+                           for row in batch)
+        yield head + encoded if count == 0 else ',' + encoded
+        count += len(batch)
+        last = batch[-1][0]
+    yield (head if count == 0 else '') + '],"next":%s}' % json.dumps(_next_cursor(last, count, limit))
+
+
+def price_columns(symbol: str, rows, limit: int = None):
+    """{"symbol", <field>: [values], "next"}. Each field is one flat list,
+    so the page is held as seven lists rather than a dict per row."""
+    columns = {field: [] for field in PRICE_FIELDS}
+    appends = [columns[field].append for field in PRICE_FIELDS]
+    last = None
+    for row in rows:
+        appends[0](row[0].isoformat())
+        for append, value in zip(appends[1:], row[1:]):
+            append(value)
+        last = row[0]
+    yield json.dumps({'symbol': symbol, **columns, 'next': _next_cursor(last, len(columns['date']), limit)})
+
+
+def price_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(PRICE_FIELDS)
+    for batch in batched(rows):
+        writer.writerows((row[0].isoformat(),) + row[1:] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _iso_dates(df: 'pandas.DataFrame') -> 'pandas.DataFrame':
+    dates = {}
+    for column, dtype in df.dtypes.items():
+        if pandas.api.types.is_datetime64_any_dtype(dtype):
+            values = df[column].to_numpy(dtype='datetime64[ns]')
+            midnight = (values.astype('int64') % 86_400_000_000_000 == 0) | numpy.isnat(values)
+            strings = numpy.datetime_as_string(values, unit='D' if midnight.all() else 's').astype(object)
+            strings[numpy.isnat(values)] = None
+            dates[column] = strings
+    return df.assign(**dates) if dates else df
+
+
+def _plain(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def encode(value, orient: str = 'records') -> bytes:
+    """JSON bytes for a DataFrame, or a dict/list with DataFrames inside.
+
+    Frames go through pandas' C encoder once. Datetime columns become
+    YYYY-MM-DD (or YYYY-MM-DDTHH:MM:SS if any value has a time), and NaN or
+    NaT become null.
+    """
+    if isinstance(value, pandas.DataFrame):
+        return _iso_dates(value).to_json(orient=orient).encode()
+    if isinstance(value, dict):
+        return b'{' + b','.join(json.dumps(str(key)).encode() + b':' + encode(item, orient)
+                                for key, item in value.items()) + b'}'
+    if isinstance(value, (list, tuple)) and any(isinstance(item, pandas.DataFrame) for item in value):
+        return b'[' + b','.join(encode(item, orient) for item in value) + b']'
+    return json.dumps(_plain(value), separators=(',', ':'), ensure_ascii=False).encode()
+
+
+class FrameResponse(Response):
+    """Serves encode(content) as is, skipping jsonable_encoder."""
+    media_type = 'application/json'
+
+    def render(self, content) -> bytes:
+        return content if isinstance(content, bytes) else encode(content)
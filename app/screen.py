@@ -0,0 +1,212 @@
+import operator
+import threading
+import weakref
+
+from . import breadth, lazy
+
+numpy = lazy.module('numpy')
+
+SMA_PERIODS = (20, 50, 200)
+RSI_PERIOD = 14
+RSI_WARMUP = 250
+HIGH_LOW_PERIOD = breadth.ATH_PERIOD
+SURGE_PERIOD = 20
+RS_PERIOD = 63
+RS_BENCHMARK = 'SET_CLOSE'
+CROSS_DAYS = 5
+
+FIELDS = ('last', 'change', 'pct_change', 'volume', 'value',
+          *[f'sma_{period}' for period in SMA_PERIODS],
+          'sma_cross', 'rsi', 'high_52w', 'low_52w', 'from_high', 'from_low', 'volume_surge', 'rs', 'rs_rating')
+OPERATORS = {'lt': operator.lt, 'le': operator.le, 'gt': operator.gt, 'ge': operator.ge}
+# Query parameters of /screen that are not <field>_<op> filters.
+PARAMETERS = ('market', 'above_sma', 'below_sma', 'cross', 'sort', 'order', 'limit')
+
+
+def rsi(prices, period=RSI_PERIOD):
+    """Wilder's RSI on the last row, seeded with each symbol's first change.
+    A missing price (a suspended day) leaves that symbol's averages as they
+    were; symbols with fewer than period changes get NaN."""
+    changes = numpy.diff(prices, axis=0)
+    average_gain = numpy.full(prices.shape[1], numpy.nan)
+    average_loss = numpy.full(prices.shape[1], numpy.nan)
+    seen = numpy.zeros(prices.shape[1], dtype='int64')
+    for change in changes:
+        valid = ~numpy.isnan(change)
+        gain = numpy.where(valid, numpy.maximum(change, 0), numpy.nan)
+        loss = numpy.where(valid, numpy.maximum(-change, 0), numpy.nan)
+        first = valid & (seen == 0)
+        later = valid & (seen > 0)
+        average_gain[first] = gain[first]
+        average_loss[first] = loss[first]
+        average_gain[later] = (average_gain[later] * (period - 1) + gain[later]) / period
+        average_loss[later] = (average_loss[later] * (period - 1) + loss[later]) / period
+        seen += valid
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        result = 100 - 100 / (1 + average_gain / average_loss)
+    return numpy.where(seen >= period, result, numpy.nan)
+
+
+def rating(values):
+    """1-99 from the share of symbols at or below each value, NaN unrated."""
+    result = numpy.full(values.shape, numpy.nan)
+    valid = ~numpy.isnan(values)
+    ordered = numpy.sort(values[valid])
+    result[valid] = numpy.ceil(numpy.searchsorted(ordered, values[valid], side='right') / len(ordered) * 99)
+    return result
+
+
+def sma_cross(fast, slow):
+    """1 where fast crossed above slow within the rows given, -1 where it
+    crossed below, 0 otherwise. The latest cross wins."""
+    with numpy.errstate(invalid='ignore'):
+        above = fast > slow
+        below = fast < slow
+    result = numpy.zeros(fast.shape[1])
+    for row in range(1, len(fast)):
+        result[below[row - 1] & above[row]] = 1
+        result[above[row - 1] & below[row]] = -1
+    return result
+
+
+def indicators(prices_df, vol_df, val_df, index_df):
+    """Every FIELDS column for every symbol on the last row of the matrices."""
+    symbols = list(prices_df.columns)
+    prices = prices_df.to_numpy(dtype='float64')
+    volumes = vol_df.reindex(index=prices_df.index, columns=symbols).to_numpy(dtype='float64')
+    values = val_df.reindex(index=prices_df.index, columns=symbols).to_numpy(dtype='float64')
+    nan = numpy.full(len(symbols), numpy.nan)
+    last = prices[-1] if len(prices) else nan
+    previous = prices[-2] if len(prices) > 1 else nan
+    columns = {'last': last,
+               'change': last - previous,
+               'volume': volumes[-1] if len(volumes) else nan,
+               'value': values[-1] if len(values) else nan}
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        columns['pct_change'] = (last / previous - 1) * 100
+
+        # Today and the CROSS_DAYS rows before, for the crossover check.
+        tail = prices[-(max(SMA_PERIODS) + CROSS_DAYS):]
+        smas = {period: breadth.rolling_mean(tail, period)[-(CROSS_DAYS + 1):] for period in SMA_PERIODS}
+        for period, sma in smas.items():
+            columns[f'sma_{period}'] = sma[-1] if len(sma) else nan
+        columns['sma_cross'] = sma_cross(smas[50], smas[200])
+        columns['rsi'] = rsi(prices[-RSI_WARMUP:])
+
+        year = prices[-HIGH_LOW_PERIOD:]
+        columns['high_52w'] = numpy.fmax.reduce(year, axis=0) if len(year) else nan
+        columns['low_52w'] = numpy.fmin.reduce(year, axis=0) if len(year) else nan
+        columns['from_high'] = (last / columns['high_52w'] - 1) * 100
+        columns['from_low'] = (last / columns['low_52w'] - 1) * 100
+
+        surge = volumes[-(SURGE_PERIOD + 1):-1]
+        average = surge.mean(axis=0) if len(surge) == SURGE_PERIOD else nan
+        columns['volume_surge'] = columns['volume'] / average
+
+        # Return over RS_PERIOD rows relative to the SET index, and its
+        # percentile among all symbols as a 1-99 rating.
+        benchmark = index_df[RS_BENCHMARK].reindex(prices_df.index).to_numpy(dtype='float64')
+        if len(prices) > RS_PERIOD:
+            columns['rs'] = ((last / prices[-RS_PERIOD - 1]) / (benchmark[-1] / benchmark[-RS_PERIOD - 1]) - 1) * 100
+        else:
+            columns['rs'] = nan
+        columns['rs_rating'] = rating(columns['rs'])
+
+    date = prices_df.index[-1].date().isoformat() if len(prices_df.index) else None
+    return {'date': date,
+            'symbols': numpy.array(symbols, dtype=object),
+            'columns': {field: numpy.round(columns[field], 2) for field in FIELDS}}
+
+
+def parse_filters(params):
+    """[(field, op, value)] from <field>_<lt|le|gt|ge>=<number> query pairs,
+    skipping PARAMETERS."""
+    filters = []
+    for key, value in params:
+        if key in PARAMETERS:
+            continue
+        field, _, op = key.rpartition('_')
+        if op not in OPERATORS or field not in FIELDS:
+            raise ValueError(f'unknown filter {key!r}, expected <field>_<lt|le|gt|ge> with field one of {", ".join(FIELDS)}')
+        try:
+            filters.append((field, op, float(value)))
+        except ValueError:
+            raise ValueError(f'{key} must be a number') from None
+    return filters
+
+
+def select(table, members=None, filters=(), above_sma: int = None, below_sma: int = None,
+           cross: str = None, sort: str = 'value', order: str = 'desc', limit: int = None):
+    """Rows of table passing every condition, sorted, as {"date", "count",
+    "rows"}. members limits the rows to a set of symbols. count is the
+    number of matches before limit. NaN never passes a condition and always
+    sorts last."""
+    symbols, columns = table['symbols'], table['columns']
+    if members is None:
+        mask = numpy.ones(len(symbols), dtype=bool)
+    else:
+        mask = numpy.fromiter((symbol in members for symbol in symbols), dtype=bool, count=len(symbols))
+    with numpy.errstate(invalid='ignore'):
+        for field, op, value in filters:
+            mask &= OPERATORS[op](columns[field], value)
+        for period, compare in ((above_sma, operator.gt), (below_sma, operator.lt)):
+            if period is None:
+                continue
+            if period not in SMA_PERIODS:
+                raise ValueError(f'sma period must be one of {", ".join(map(str, SMA_PERIODS))}')
+            mask &= compare(columns['last'], columns[f'sma_{period}'])
+    if cross is not None:
+        if cross not in ('golden', 'death'):
+            raise ValueError("cross must be golden or death")
+        mask &= columns['sma_cross'] == (1 if cross == 'golden' else -1)
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be asc or desc")
+
+    selected = numpy.flatnonzero(mask)
+    if sort == 'symbol':
+        keys = symbols[selected].astype(str)
+        ordering = numpy.argsort(keys, kind='stable')
+        if order == 'desc':
+            ordering = ordering[::-1]
+    elif sort in columns:
+        keys = columns[sort][selected]
+        ordering = numpy.argsort(-keys if order == 'desc' else keys, kind='stable')
+    else:
+        raise ValueError(f'unknown sort {sort!r}, expected symbol or one of {", ".join(FIELDS)}')
+    selected = selected[ordering][:limit]
+
+    fields = [columns[field][selected].tolist() for field in FIELDS]
+    rows = [dict(zip(('symbol',) + FIELDS, row)) for row in zip(symbols[selected].tolist(), *fields)]
+    return {'date': table['date'], 'count': int(mask.sum()), 'rows': rows}
+
+
+class Screener:
+    """The indicator table of the matrix store's current builds, recomputed
+    only when MatrixStore.frame hands out a new frame for any of them."""
+
+    MATRICES = ('STOCKS', 'STOCKS_VOL', 'STOCKS_VAL', 'INDEX')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._table = None
+        self._frames = ()
+        self._lock = threading.Lock()
+
+    def table(self, matrices):
+        frames = [matrices.frame(name) for name in self.MATRICES]
+        with self._lock:
+            if self._table is not None and all(seen() is frame for seen, frame in zip(self._frames, frames)):
+                self.hits += 1
+                return self._table
+            self.misses += 1
+            self._table = indicators(*frames)
+            self._frames = tuple(weakref.ref(frame) for frame in frames)
+            return self._table
+
+    def screen(self, matrices, **conditions):
+        return select(self.table(matrices), **conditions)
+
+
+screener = Screener()
@@ -0,0 +1,95 @@
+import os
+import shutil
+
+from . import lazy
+
+requests = lazy.module('requests')
+
+BLOB_URL = 'https://alpharesearch.blob.core.windows.net/yongcontainer'
+CONTAINER = 'yongcontainer'
+
+
+class BlobContainer:
+    def __init__(self, base_url: str = BLOB_URL, timeout: float = 30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def url(self, name: str):
+        return f'{self.base_url}/{name}'
+
+    def version(self, name: str):
+        response = self.session.head(self.url(name), timeout=self.timeout)
+        response.raise_for_status()
+        return response.headers.get('ETag') or response.headers.get('Last-Modified')
+
+    def download(self, name: str, path: str):
+        with self.session.get(self.url(name), stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+        return path
+
+
+class AzureContainer:
+    def __init__(self, connection_string: str, container: str = CONTAINER):
+        self.connection_string = connection_string
+        self.container = container
+
+    def blob(self, name: str):
+        if not self.connection_string:
+            raise RuntimeError('set AZURE_STORAGE_CONNECTION_STRING to use the blob container, '
+                               'or YONG_BLOB_WRITE_TARGET to a local directory')
+        from azure.storage.blob import BlobClient
+        return BlobClient.from_connection_string(conn_str=self.connection_string, container_name=self.container, blob_name=name)
+
+    def version(self, name: str):
+        return self.blob(name).get_blob_properties().etag
+
+    def download(self, name: str, path: str):
+        with open(path, 'wb') as f:
+            self.blob(name).download_blob().readinto(f)
+        return path
+
+    def upload(self, name: str, path: str):
+        with open(path, 'rb') as data:
+            self.blob(name).upload_blob(data, overwrite=True)
+
+
+class LocalDirectory:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def url(self, name: str):
+        return os.path.join(self.directory, name)
+
+    def version(self, name: str):
+        stat = os.stat(self.url(name))
+        return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+    def download(self, name: str, path: str):
+        shutil.copyfile(self.url(name), path)
+        return path
+
+    def upload(self, name: str, path: str):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.url(f'.{name}.upload')
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, self.url(name))
+
+
+def default_source():
+    location = os.environ.get('YONG_BLOB_SOURCE', BLOB_URL)
+    if location.startswith(('http://', 'https://')):
+        return BlobContainer(location)
+    return LocalDirectory(location)
+
+
+def writable_source():
+    location = os.environ.get('YONG_BLOB_WRITE_TARGET')
+    if location:
+        return LocalDirectory(location)
+    # Without a connection string the container fails on use, not here, so
+    # a worker still starts and serves everything else.
+    return AzureContainer(os.environ.get('AZURE_STORAGE_CONNECTION_STRING'))
@@ -0,0 +1,121 @@
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from . import lazy, metrics, storage
+
+numpy = lazy.module('numpy')
+pandas = lazy.module('pandas')
+
+MATRICES = ('INDEX', 'STOCKS', 'STOCKS_VOL', 'STOCKS_VAL')
+
+
+class MatrixStore:
+    """Wide DATE x symbol CSVs from the blob container, kept on local disk as
+    memory-mapped .npy files.
+
+    Each build lands in its own directory and CURRENT is swapped atomically,
+    so every worker maps the same pages and readers never see a half-written
+    matrix. The source is only asked for its ETag/mtime every check_interval
+    seconds and the CSV is only downloaded when that version changes.
+    """
+
+    def __init__(self, source, directory: str, check_interval: float = 300):
+        self.source = source
+        self.directory = directory
+        self.check_interval = check_interval
+        self._loaded = {}
+        self._checked = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def frame(self, name: str) -> 'pandas.DataFrame':
+        with self._lock:
+            if time.monotonic() - self._checked.get(name, float('-inf')) >= self.check_interval:
+                self.refresh(name)
+                self._checked[name] = time.monotonic()
+            current = self._current(name)
+            loaded = self._loaded.get(name)
+            if loaded is None or loaded[0] != current['build']:
+                loaded = (current['build'], self._load(name, current['build']))
+                self._loaded[name] = loaded
+            return loaded[1]
+
+    def refresh(self, name: str, force: bool = False):
+        try:
+            with metrics.UPSTREAM.time(f'{name}.csv', 'version'):
+                version = self.source.version(f'{name}.csv')
+        except Exception:
+            # Keep serving the last good build while the source is unreachable.
+            if self._current(name) is not None:
+                return False
+            raise
+        current = self._current(name)
+        if not force and current is not None and current['version'] == version:
+            return False
+        with open(os.path.join(self.directory, f'{name}.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            current = self._current(name)
+            if not force and current is not None and current['version'] == version:
+                return False
+            self._build(name, version)
+        return True
+
+    def _current(self, name: str):
+        try:
+            with open(os.path.join(self.directory, name, 'CURRENT')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _build(self, name: str, version: str):
+        root = os.path.join(self.directory, name)
+        build = uuid.uuid4().hex
+        build_dir = os.path.join(root, build)
+        os.makedirs(build_dir)
+        with metrics.UPSTREAM.time(f'{name}.csv', 'download'):
+            csv_path = self.source.download(f'{name}.csv', os.path.join(build_dir, f'{name}.csv'))
+        with metrics.UPSTREAM.time(f'{name}.csv', 'parse'):
+            df = pandas.read_csv(csv_path).set_index('DATE')
+        os.remove(csv_path)
+        numpy.save(os.path.join(build_dir, 'values.npy'), df.to_numpy(dtype='float64'))
+        numpy.save(os.path.join(build_dir, 'dates.npy'), pandas.to_datetime(df.index).to_numpy(dtype='datetime64[ns]'))
+        with open(os.path.join(build_dir, 'symbols.json'), 'w') as f:
+            json.dump(list(df.columns), f)
+
+        previous = self._current(name)
+        fd, tmp = tempfile.mkstemp(dir=root)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'build': build, 'version': version}, f)
+        os.replace(tmp, os.path.join(root, 'CURRENT'))
+
+        # Other workers may still map the previous build; drop anything older.
+        keep = {build, previous['build'] if previous else None}
+        for entry in os.listdir(root):
+            if entry not in keep and os.path.isdir(os.path.join(root, entry)):
+                shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+    def _load(self, name: str, build: str):
+        build_dir = os.path.join(self.directory, name, build)
+        values = numpy.load(os.path.join(build_dir, 'values.npy'), mmap_mode='r')
+        dates = numpy.load(os.path.join(build_dir, 'dates.npy'))
+        with open(os.path.join(build_dir, 'symbols.json')) as f:
+            symbols = json.load(f)
+        return pandas.DataFrame(values, index=pandas.DatetimeIndex(dates, name='DATE'), columns=symbols, copy=False)
+
+
+_store = None
+
+
+def get_store() -> MatrixStore:
+    global _store
+    if _store is None:
+        _store = MatrixStore(storage.default_source(),
+                             os.environ.get('YONG_STORE_DIR', 'matrix-store'),
+                             float(os.environ.get('YONG_STORE_CHECK_INTERVAL', 300)))
+    return _store
@@ -0,0 +1,147 @@
+import collections
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from . import crud, lazy, ohlcv, universe
+
+numpy = lazy.module('numpy')
+pandas = lazy.module('pandas')
+
+# market_group -> (benchmark index, group indices)
+GROUPS = {'SETIndustry': ('SET', universe.SET_INDUSTRIES),
+          'SETSector': ('SET', universe.SET_SECTORS),
+          'MAISector': ('mai', universe.MAI_SECTORS)}
+MAX_PERIOD = 520
+MOMENTUM_PERIOD = 10
+
+
+def column_name(symbol: str) -> str:
+    """'.AGRO-ms' -> 'AGRO'."""
+    return symbol.replace('-ms', '').replace('.', '')
+
+
+def align(bars, base: str, group):
+    """(dates, base OHLC, group closes) on the benchmark's dates, one row per
+    date and one closes column per group index, NaN where an index has no
+    bar on that date."""
+    base_bars = bars[base]
+    dates = numpy.array(base_bars['date'], dtype='datetime64[D]')
+    order = numpy.argsort(dates, kind='stable')
+    dates = dates[order]
+    ohlc = numpy.array([base_bars[field] for field in ('open', 'high', 'low', 'close')], dtype='float64').T[order]
+    closes = numpy.full((len(dates), len(group)), numpy.nan)
+    for column, symbol in enumerate(group):
+        symbol_bars = bars.get(symbol)
+        if not symbol_bars:
+            continue
+        symbol_dates = numpy.array(symbol_bars['date'], dtype='datetime64[D]')
+        position = numpy.minimum(numpy.searchsorted(dates, symbol_dates), max(len(dates) - 1, 0))
+        found = dates[position] == symbol_dates if len(dates) else numpy.zeros(len(symbol_dates), dtype=bool)
+        closes[position[found], column] = numpy.asarray(symbol_bars['close'], dtype='float64')[found]
+    return dates, ohlc, closes
+
+
+def relative_strength(ratios, period: int, momentum_period: int = MOMENTUM_PERIOD):
+    """rs: percent change of each group's ratio to the benchmark over the
+    last period rows. momentum: how much rs moved over the last
+    momentum_period rows. rank: 1 for the highest rs, NaN last."""
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        series = (ratios[period:] / ratios[:-period] - 1) * 100
+    nan = numpy.full(ratios.shape[1], numpy.nan)
+    rs = series[-1] if len(series) else nan
+    momentum = rs - series[-1 - momentum_period] if len(series) > momentum_period else nan
+    order = numpy.argsort(-rs, kind='stable')
+    rank = numpy.empty(len(rs))
+    rank[order] = numpy.arange(1, len(rs) + 1)
+    rank[numpy.isnan(rs)] = numpy.nan
+    return rs, momentum, rank
+
+
+class StrengthCache:
+    """Aligned closes per market group and results per (market group,
+    period, view), dropped when the SET index gets a new WatchOCS_Date
+    (checked every check_interval seconds).
+
+    The closes are fetched once per trading day with enough history for
+    every period up to MAX_PERIOD; each period is then a slice of them.
+    """
+
+    def __init__(self, maxsize: int = 256, check_interval: float = 60):
+        self.maxsize = maxsize
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._matrices = {}
+        self._results = collections.OrderedDict()
+        self._watermark = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+
+    def _check(self, db: Session):
+        if time.monotonic() - self._checked < self.check_interval:
+            return
+        watermark = crud.get_latest_trading_date(db)
+        with self._lock:
+            if watermark != self._watermark:
+                self._matrices.clear()
+                self._results.clear()
+                self._watermark = watermark
+            self._checked = time.monotonic()
+
+    def _matrix(self, db: Session, market_group: str):
+        with self._lock:
+            if market_group in self._matrices:
+                return self._matrices[market_group]
+        base, group = GROUPS[market_group]
+        bars = ohlcv.get_ohlcvv_many(db, [base, *group], MAX_PERIOD + MOMENTUM_PERIOD)
+        if base not in bars:
+            return None
+        dates, ohlc, closes = align(bars, base, group)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            ratios = closes / ohlc[:, 3:]
+        matrix = (dates, ohlc, ratios)
+        with self._lock:
+            self._matrices[market_group] = matrix
+        return matrix
+
+    def get(self, db: Session, market_group: str, period: int, view: str):
+        """The 'series' frame (benchmark OHLC and each group's ratio over
+        the last period rows) or the 'ranks' table of market_group, None if
+        the benchmark has no bars."""
+        self._check(db)
+        key = (market_group, period, view)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return self._results[key]
+            self.misses += 1
+        matrix = self._matrix(db, market_group)
+        if matrix is None:
+            return None
+        dates, ohlc, ratios = matrix
+        names = [column_name(symbol) for symbol in GROUPS[market_group][1]]
+        if view == 'series':
+            columns = {'date': pandas.to_datetime(dates[-period:])}
+            columns.update(zip(('open', 'high', 'low', 'close'), ohlc[-period:].T))
+            columns.update(zip(names, ratios[-period:].T))
+            result = pandas.DataFrame(columns)
+        else:
+            rs, momentum, rank = relative_strength(ratios, period)
+            rows = [{'group': name, 'ratio': ratio, 'rs': value, 'momentum': change,
+                     'rank': int(position) if position == position else None}
+                    for name, ratio, value, change, position
+                    in zip(names, ratios[-1].tolist() if len(ratios) else [None] * len(names),
+                           rs.tolist(), momentum.tolist(), rank.tolist())]
+            rows.sort(key=lambda row: (row['rank'] is None, row['rank'] or 0))
+            result = {'date': str(dates[-1]) if len(dates) else None, 'period': period, 'rows': rows}
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+        return result
+
+
+cache = StrengthCache()
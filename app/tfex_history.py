@@ -0,0 +1,161 @@
+import asyncio
+import csv
+import datetime
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+
+from starlette.concurrency import run_in_threadpool
+
+from . import lazy, metrics, refresher, storage
+
+pandas = lazy.module('pandas')
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['date', 'FundValNet', 'ForeignValNet', 'CustomerValNet']
+
+
+class TfexHistory:
+    """Daily TFEX investor-type nets, kept as an append-only local CSV.
+
+    Rows are appended under an exclusive flock and read back with the last
+    row per date winning, so every worker sees the same file and a restated
+    day is just one more line. Pushing the file to the blob container is a
+    separate step (sync) that only uploads when the file has changed.
+    """
+
+    def __init__(self, path: str, target, blob_name: str = 'my_csv'):
+        self.path = path
+        self.target = target
+        self.blob_name = blob_name
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def _flock(self, mode=fcntl.LOCK_EX):
+        lock = open(f'{self.path}.lock', 'w')
+        fcntl.flock(lock, mode)
+        return lock
+
+    def seed(self):
+        if os.path.exists(self.path):
+            return
+        with self._flock():
+            if os.path.exists(self.path):
+                return
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+            os.close(fd)
+            try:
+                with metrics.UPSTREAM.time(self.blob_name, 'download'):
+                    self.target.download(self.blob_name, tmp)
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.remove(tmp)
+                raise
+
+    def frame(self) -> 'pandas.DataFrame':
+        self.seed()
+        stat = os.stat(self.path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if self._cache is None or self._cache[0] != key:
+                df = pandas.read_csv(self.path, thousands=',').set_index('date')
+                df.index = pandas.to_datetime(df.index)
+                df = df.apply(pandas.to_numeric)
+                df = df[~df.index.duplicated(keep='last')].sort_index()
+                self._cache = (key, df)
+            return self._cache[1]
+
+    def with_latest(self, latest) -> 'pandas.DataFrame':
+        df = self.frame()
+        if latest is None:
+            return df
+        row = pandas.DataFrame([{key: latest[key] for key in COLUMNS}]).set_index('date')
+        row.index = pandas.to_datetime(row.index)
+        df = pandas.concat([df, row])
+        return df[~df.index.duplicated(keep='last')].sort_index()
+
+    def upsert(self, row: dict) -> bool:
+        df = self.frame()
+        date = pandas.Timestamp(row['date'])
+        if date in df.index and all(df.at[date, key] == row[key] for key in COLUMNS[1:] if key in df.columns):
+            return False
+        with self._flock():
+            with open(self.path, newline='') as f:
+                header = next(csv.reader(f))
+            with open(self.path, 'a', newline='') as f:
+                csv.writer(f).writerow([row.get(column, '') for column in header])
+        return True
+
+    def compact(self):
+        # seed() takes the same flock, so it has to run before this one is held.
+        self.seed()
+        with self._flock():
+            df = self.frame()
+            with open(self.path, newline='') as f:
+                lines = sum(1 for _ in f) - 1
+            if lines == len(df):
+                return False
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(fd, 'w', newline='') as f:
+                df.to_csv(f, date_format='%Y-%m-%d')
+            os.replace(tmp, self.path)
+            return True
+
+    def sync(self) -> bool:
+        marker = f'{self.path}.synced'
+        # Only one worker uploads; the others skip this round.
+        lock = open(f'{self.path}.sync-lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        try:
+            self.compact()
+            stat = os.stat(self.path)
+            version = f'{stat.st_mtime_ns}-{stat.st_size}'
+            try:
+                with open(marker) as f:
+                    if f.read() == version:
+                        return False
+            except FileNotFoundError:
+                pass
+            with metrics.UPSTREAM.time(self.blob_name, 'upload'):
+                self.target.upload(self.blob_name, self.path)
+            with open(marker, 'w') as f:
+                f.write(version)
+            return True
+        finally:
+            lock.close()
+
+    def record_close(self, latest, now: datetime.datetime = None) -> bool:
+        # The scraped page is intraday until the close; only the settled
+        # figure for a finished trading day is written to history.
+        now = (now or datetime.datetime.now(refresher.BANGKOK)).astimezone(refresher.BANGKOK)
+        if latest is None or not refresher.has_closed(now) or latest['date'] != now.date().isoformat():
+            return False
+        return self.upsert(latest)
+
+
+async def run(history: TfexHistory, latest, interval: float = 300):
+    while True:
+        try:
+            await run_in_threadpool(history.record_close, latest())
+            await run_in_threadpool(history.sync)
+        except Exception as e:
+            logger.warning('TFEX history sync failed: %r', e)
+        await asyncio.sleep(interval)
+
+
+_history = None
+
+
+def get_history() -> TfexHistory:
+    global _history
+    if _history is None:
+        _history = TfexHistory(os.environ.get('TFEX_HISTORY_PATH', 'tfex-trade-history.csv'),
+                               storage.writable_source())
+    return _history
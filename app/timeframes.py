@@ -0,0 +1,109 @@
+import bisect
+import collections
+import datetime
+import itertools
+import threading
+import weakref
+
+from sqlalchemy.orm import Session
+
+from . import ohlcv, registry
+
+TIMEFRAMES = ('D', 'W', 'M', 'Q')
+FIELDS = ('date', 'open', 'high', 'low', 'close', 'volume', 'value')
+
+
+def period_start(day: datetime.date, timeframe: str) -> datetime.date:
+    """Monday of day's week, or the first of its month or quarter."""
+    if timeframe == 'W':
+        return day - datetime.timedelta(days=day.weekday())
+    if timeframe == 'M':
+        return day.replace(day=1)
+    if timeframe == 'Q':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    return day
+
+
+def _sum(values):
+    values = [value for value in values if value is not None]
+    return round(sum(values), 2) if values else None
+
+
+def _bar(rows):
+    opens = [row[1] for row in rows if row[1] is not None]
+    closes = [row[4] for row in rows if row[4] is not None]
+    return (rows[0][0],
+            opens[0] if opens else None,
+            max((row[2] for row in rows if row[2] is not None), default=None),
+            min((row[3] for row in rows if row[3] is not None), default=None),
+            closes[-1] if closes else None,
+            _sum(row[5] for row in rows),
+            _sum(row[6] for row in rows))
+
+
+def aggregate(rows, timeframe: str):
+    """timeframe bars from iter_prices rows in date order, in the same
+    (date, open, high, low, close, volume, value) layout. Each bar is dated
+    by its first trading day."""
+    return [_bar(list(group)) for _, group in itertools.groupby(rows, key=lambda row: period_start(row[0], timeframe))]
+
+
+class BarCache:
+    """Completed bars per (security, timeframe), built from the security's
+    ohlcv.store Series.
+
+    Every bar before the one holding the latest daily row has closed and is
+    kept as is, along with the number of daily bars it covers. A request
+    only aggregates the daily bars after those, which are the current
+    partial bar plus any bars that closed since. The store replaces a
+    Series whose past bars were restated, and then the bars are rebuilt
+    from the new one.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def bars(self, db: Session, security_id: int, timeframe: str, length: int):
+        """The last length bars in date order, the partial one included."""
+        series = ohlcv.store.get(db, security_id)
+        key = (security_id, timeframe)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0]() is series:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = None
+                self.misses += 1
+        _, completed, through = entry or (None, [], 0)
+        rows = list(series.rows(through, series.size))
+        fresh = aggregate(rows, timeframe)
+        if len(fresh) > 1:
+            # The daily bars before the partial bar's first day are complete.
+            dates = [row[0] for row in rows]
+            through += bisect.bisect_left(dates, fresh[-1][0])
+            completed = completed + fresh[:-1]
+            with self._lock:
+                self._entries[key] = (weakref.ref(series), completed, through)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return (completed + fresh[-1:])[-length:] if length > 0 else []
+
+
+cache = BarCache()
+
+
+def get_ohlcvv(db: Session, symbol_name: str, length: int, timeframe: str):
+    """ohlcv.get_ohlcvv with length timeframe bars instead of daily ones,
+    latest first."""
+    symbol = registry.symbols.by_name(db, symbol_name)
+    if symbol is None:
+        return None
+    bars = cache.bars(db, symbol['ID'], timeframe, length)
+    return {'symbol': symbol['Name'],
+            'data': [dict(zip(FIELDS, bar)) for bar in reversed(bars)]}
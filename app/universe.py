@@ -0,0 +1,11 @@
+"""Names of the industry and sector indices: SET_INDUSTRIES, SET_SECTORS
+and MAI_SECTORS. Market membership comes from d_Compsec (app.registry).
+"""
+
+SET_INDUSTRIES = ('.AGRO', '.CONSUMP', '.FINCIAL', '.INDUS', '.PROPCON', '.RESOURC', '.SERVICE', '.TECH')
+SET_SECTORS = (
+    '.AGRI', '.FOOD', '.FASHION', '.HOME', '.PERSON', '.BANK', '.FIN', '.INSUR', '.AUTO', '.IMM', '.PAPER', '.PETRO',
+    '.PKG', '.STEEL', '.CONMAT', '.CONS', '.PROP', '.ENERG', '.MINE', '.COMM', '.HELTH', '.MEDIA', '.PROF', '.TOURISM',
+    '.TRANS', '.ETRON', '.ICT',
+)
+MAI_SECTORS = ('.AGRO-ms', '.CONSUMP-ms', '.FINCIAL-ms', '.INDUS-ms', '.PROPCON-ms', '.RESOURC-ms', '.SERVICE-ms', '.TECH-ms')
@@ -0,0 +1,92 @@
+import asyncio
+import datetime
+import os
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from . import lazy, metrics, refresher
+
+bs4 = lazy.module('bs4')
+
+MARKETDATA_URL = os.environ.get('SET_MARKETDATA_URL', 'https://marketdata.set.or.th')
+TIMEOUT = httpx.Timeout(float(os.environ.get('SET_MARKETDATA_TIMEOUT', 10)), connect=5)
+LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+
+_client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(base_url=MARKETDATA_URL, timeout=TIMEOUT, limits=LIMITS,
+                                    headers={'User-Agent': 'Mozilla/5.0'})
+    return _client
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def fetch_text(path: str, **params) -> str:
+    with metrics.UPSTREAM.time(path, 'fetch'):
+        response = await get_client().get(path, params=params)
+        response.raise_for_status()
+        return response.text
+
+
+@metrics.UPSTREAM.timed('/mkt/marketsummary.do', 'parse')
+def parse_market_summary(page: str) -> dict:
+    soup = bs4.BeautifulSoup(page, 'html.parser')
+    table_rows = soup.findAll('div', attrs={'class': 'row info'})
+    result = {}
+    for tr in table_rows:
+        td = tr.find_all('div')
+        row = [tr.text.replace(" ","").replace("*","").replace("\r","").replace("\n","") for tr in td]
+        if len(row) > 0:
+            name, value = row
+            result[name] = value
+    del result['IndexPerformance']
+    return result
+
+
+async def market_summary(market: str) -> dict:
+    page = await fetch_text('/mkt/marketsummary.do', market=market, language='en', country='US')
+    return await run_in_threadpool(parse_market_summary, page)
+
+
+async def set_mai_summary() -> dict:
+    set_info, mai_info = await asyncio.gather(market_summary('SET'), market_summary('mai'))
+    return {'set': set_info, 'mai': mai_info}
+
+
+@metrics.UPSTREAM.timed('/tfx/tfexinvestortypetrading.do', 'parse')
+def parse_tfex_investor_types(page: str) -> dict:
+    soup = bs4.BeautifulSoup(page, 'html.parser')
+    table = soup.find('tbody',)
+    table_rows = table.findAll('tr')
+    l = []
+    for tr in table_rows:
+        td = tr.find_all('td')
+        row = [tr.text.replace(" ","").replace("\r","").replace("\n","") for tr in td]
+        if len(row) > 0:
+            l.append(row)
+    row = dict(zip(["name", "i_buy", "i_sell", "i_net", "f_buy", "f_sell", "f_net", "l_buy", "l_sell", "l_net", "total"], l[1]))
+    return {'date': datetime.datetime.now(refresher.BANGKOK).strftime('%Y-%m-%d'),
+            'FundValBuy':     float(row['i_buy'].replace(',','')),
+            'FundValSell':    float(row['i_sell'].replace(',','')),
+            'FundValNet':     float(row['i_net'].replace('+','').replace(',','')),
+            'ForeignValBuy':  float(row['f_buy'].replace(',','')),
+            'ForeignValSell': float(row['f_sell'].replace(',','')),
+            'ForeignValNet':  float(row['f_net'].replace('+','').replace(',','')),
+            'CustomerValBuy': float(row['l_buy'].replace(',','')),
+            'CustomerValSell':float(row['l_sell'].replace(',','')),
+            'CustomerValNet': float(row['l_net'].replace('+','').replace(',',''))}
+
+
+async def tfex_investor_types() -> dict:
+    page = await fetch_text('/tfx/tfexinvestortypetrading.do', locale='th_TH')
+    return await run_in_threadpool(parse_tfex_investor_types, page)
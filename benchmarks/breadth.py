@@ -0,0 +1,169 @@
+"""Per-column vs vectorized vs incremental /marketbreadth/ engine.
+
+    python -m benchmarks.breadth [--symbols 800] [--days 3000] [--repeat 3]
+
+Builds synthetic STOCKS/STOCKS_VOL/STOCKS_VAL/INDEX frames, checks that all
+engines return identical payloads (including after a restated row), that
+each universe's breadth out of the one masked reduction equals a run over
+its columns alone, and prints the timings.
+"""
+import argparse
+import time
+
+import numpy
+import pandas
+
+from app import breadth, responses
+
+
+def synthetic_frames(symbols, days, seed=0):
+    rng = numpy.random.default_rng(seed)
+    index = pandas.bdate_range('2008-01-01', periods=days, name='DATE')
+    columns = [f'S{i:04d}' for i in range(symbols)]
+    steps = rng.normal(0, 0.02, size=(days, symbols))
+    prices = numpy.round(10 * numpy.exp(numpy.cumsum(steps, axis=0)), 2)
+    # Late listings and suspensions: leading NaNs and flat stretches.
+    listed = rng.integers(0, days // 2, size=symbols)
+    for col, start in enumerate(listed):
+        prices[:start, col] = numpy.nan
+    for col in rng.choice(symbols, size=symbols // 10, replace=False):
+        start = rng.integers(0, days - 150)
+        prices[start:start + 150, col] = prices[start, col]
+    volumes = rng.integers(1_000, 10_000_000, size=(days, symbols)).astype('float64')
+    values = volumes * numpy.nan_to_num(prices, nan=1.0)
+    prices_df = pandas.DataFrame(prices, index=index, columns=columns)
+    vol_df = pandas.DataFrame(volumes, index=index, columns=columns)
+    val_df = pandas.DataFrame(values, index=index, columns=columns)
+    close = 1500 * numpy.exp(numpy.cumsum(rng.normal(0, 0.01, size=days)))
+    SET_df = pandas.DataFrame({'OPEN': close, 'HIGH': close * 1.01, 'LOW': close * 0.99, 'CLOSE': close}, index=index)
+    return SET_df, prices_df, vol_df, val_df
+
+
+def legacy_market_breadth(SET_df, prices_df, vol_df, val_df):
+    def get_is_ath(series, period = 260):
+        ath_threshold = series.shift(1).rolling(period).max()
+        return (series >= ath_threshold).astype(int)
+
+    def get_is_atl(series, period = 260):
+        atl_threshold = series.shift(1).rolling(period).min()
+        return (series <= atl_threshold).astype(int)
+
+    def get_above_is_above_sma(series, period = 100):
+        sma_threshold = series.shift(1).rolling(period).mean()
+        return (series >= sma_threshold).astype(int)
+
+    def get_above_is_below_sma(series, period = 100):
+        sma_threshold = series.shift(1).rolling(period).mean()
+        return (series < sma_threshold).astype(int)
+
+    stock_amount = len(prices_df.columns)
+    is_ath_df = pandas.DataFrame(index=prices_df.index)
+    is_atl_df = pandas.DataFrame(index=prices_df.index)
+    above_sma_df = pandas.DataFrame(index=prices_df.index)
+    below_sma_df = pandas.DataFrame(index=prices_df.index)
+    for symbol in prices_df.columns:
+        is_ath_df[symbol] = get_is_ath(prices_df[symbol])
+        is_atl_df[symbol] = get_is_atl(prices_df[symbol])
+        above_sma_df[symbol] = get_above_is_above_sma(prices_df[symbol])
+        below_sma_df[symbol] = get_above_is_below_sma(prices_df[symbol])
+
+    summary_df = breadth.summarize(prices_df.index, is_ath_df.sum(axis=1), is_atl_df.sum(axis=1),
+                                   above_sma_df.sum(axis=1), stock_amount)
+
+    current_above_sma = above_sma_df.tail(1)
+    current_above_sma = current_above_sma[current_above_sma == 1].dropna(axis=1)
+    current_above_sma_result = pandas.DataFrame()
+    symbol_list = current_above_sma.columns
+    current_above_sma_result['symbol'] = symbol_list
+    prices = prices_df.tail(2).reset_index()
+    volumes = vol_df.tail(2).reset_index()
+    values = val_df.tail(2).reset_index()
+    current_above_sma_result['last'] = ["{:.2f}".format(round(prices.at[1, s],2)) for s in symbol_list]
+    current_above_sma_result['change'] = ["{:.2f}".format(round(prices.at[1, s]-prices.at[0, s],2)) for s in symbol_list]
+    current_above_sma_result['pct_change'] = ["{:.2f}".format(round((prices.at[1, s]-prices.at[0, s])/prices.at[0, s]*100,2)) for s in symbol_list]
+    current_above_sma_result['volume'] = [int(volumes.at[1, s]) for s in symbol_list]
+    current_above_sma_result['value'] = [int(values.at[1, s]) for s in symbol_list]
+    return breadth.breadth_result(SET_df, summary_df, current_above_sma_result.sort_values('value',ascending=False))
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=800)
+    parser.add_argument('--days', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    frames = synthetic_frames(args.symbols, args.days)
+    legacy_time, legacy = best_of(args.repeat, legacy_market_breadth, *frames)
+    vector_time, vector = best_of(args.repeat, breadth.market_breadth, *frames)
+
+    if responses.encode(legacy) != responses.encode(vector):
+        raise SystemExit('vectorized payload differs from the per-column engine')
+    print(f'{args.symbols} symbols x {args.days} days')
+    print(f'per-column : {legacy_time * 1000:9.1f} ms')
+    print(f'vectorized : {vector_time * 1000:9.1f} ms  ({legacy_time / vector_time:.1f}x)')
+
+    SET_df, prices_df, vol_df, val_df = frames
+    dates = prices_df.index.to_numpy()
+    prices = prices_df.to_numpy()
+    tail = 20
+    state = breadth.BreadthState()
+    start = time.perf_counter()
+    state.update(dates[:-tail], prices_df.columns, prices[:-tail])
+    rebuild_time = time.perf_counter() - start
+    append_times = []
+    for rows in range(len(dates) - tail + 1, len(dates) + 1):
+        start = time.perf_counter()
+        state.update(dates[:rows], prices_df.columns, prices[:rows])
+        append_times.append(time.perf_counter() - start)
+    if not state.verify(prices):
+        raise SystemExit('incremental state differs from a full recompute')
+    above_sma_result = breadth.stocks_above_sma(prices_df.columns, state.last_above_sma, prices_df, vol_df, val_df)
+    incremental = breadth.breadth_result(SET_df, state.summary(prices_df.index), above_sma_result)
+    if responses.encode(incremental) != responses.encode(vector):
+        raise SystemExit('incremental payload differs from the vectorized engine')
+
+    # Within the window an append reads back, which is where it looks.
+    restated = prices.copy()
+    restated[len(dates) - state.window // 2] *= 1.01
+    state.update(dates, prices_df.columns, restated)
+    if state.rebuilds != 2 or not state.verify(restated):
+        raise SystemExit('restated history did not trigger a correct rebuild')
+
+    universes = {'ALL': numpy.ones(len(prices_df.columns), dtype=bool),
+                 'EVEN': numpy.arange(len(prices_df.columns)) % 2 == 0,
+                 'FIRST50': numpy.arange(len(prices_df.columns)) < 50}
+    start = time.perf_counter()
+    state.update(dates, prices_df.columns, prices, universes)
+    universes_time = time.perf_counter() - start
+    if not state.verify(prices):
+        raise SystemExit('per-universe state differs from a full recompute')
+    for name, mask in universes.items():
+        columns = prices_df.columns[mask]
+        alone = breadth.market_breadth(SET_df, prices_df[columns], vol_df[columns], val_df[columns])
+        masked = breadth.breadth_result(SET_df, state.summary(prices_df.index, name),
+                                        breadth.stocks_above_sma(prices_df.columns, state.last_above_sma & state.members(name),
+                                                                 prices_df, vol_df, val_df))
+        if responses.encode(alone) != responses.encode(masked):
+            raise SystemExit(f'{name} breadth differs from a run over its columns alone')
+
+    print(f'rebuild    : {rebuild_time * 1000:9.1f} ms')
+    print(f'{len(universes)} universes: {universes_time * 1000:9.1f} ms')
+    start = time.perf_counter()
+    state._digest(prices[-state.window:], len(dates))
+    digest_time = time.perf_counter() - start
+    print(f'append row : {numpy.median(append_times) * 1000:9.1f} ms (median of {tail}, '
+          f'of which {digest_time * 1000:.1f} ms is the restatement digest)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""A synthetic SQLite stand-in for the production SQL Server database.
+
+app.database is not part of the repository (it carries the connection
+string), so benchmarks call install() before importing anything that
+reflects app.models. It registers an app.database module bound to a SQLite
+file with the tables the app reads, filled with random-walk data:
+
+  vStockAndIndex, WatchOpenCloseSummary  stocks S0001.. with IDs from 1, daily
+                                         bars over `days` business days
+  with market=True, also
+    the SET (1024), TFEX (1062) and mai indices and the industry and sector
+    indices /relative/ reads, with bars of their own
+    d_CustomerHistory                    investor-type values per day
+    IndustryNo, SectorNo, d_Compsec      the classification and market (SET
+                                         or mai) of every stock
+    d_Business, d_Account                one row per stock / account
+    d_Finance, vFinancial                quarterly figures of ACCOUNTS
+    vStockFundamentalByQuote2            the latest quarter per stock
+
+The raw statements in app.queries name their schema, so install() points
+YONG_DB_SCHEMA at SQLite's main unless it is already set. Statements that
+need SQL Server itself (the factsheet function, STRING_SPLIT in the finance
+panel, '+' string concatenation in the factsheet batch) do not run here.
+"""
+import datetime
+import os
+import sys
+import types
+
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, create_engine, inspect
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+SET_INDEX = 1024
+TFEX_INDEX = 1062
+FIRST_INDEX = 1100
+SET_INDUSTRIES = ['.AGRO', '.CONSUMP', '.FINCIAL', '.INDUS', '.PROPCON', '.RESOURC', '.SERVICE', '.TECH']
+SET_SECTORS = ['.AGRI', '.FOOD', '.FASHION', '.HOME', '.PERSON', '.BANK', '.FIN', '.INSUR', '.AUTO', '.IMM', '.PAPER',
+               '.PETRO', '.PKG', '.STEEL', '.CONMAT', '.CONS', '.PROP', '.ENERG', '.MINE', '.COMM', '.HELTH', '.MEDIA',
+               '.PROF', '.TOURISM', '.TRANS', '.ETRON', '.ICT']
+MAI_SECTORS = [f'{name}-ms' for name in SET_INDUSTRIES]
+ACCOUNTS = {1: 'Revenue', 2: 'NetProfit', 3: 'TotalAssets', 4: 'TotalLiabilities', 5: 'Equity',
+            6: 'OperatingCashFlow', 7: 'EPS', 8: 'DividendPerShare'}
+FLOW_INVESTORS = ('Fund', 'Foreign', 'Trading', 'Customer')
+BATCH = 50_000
+
+
+def create_tables(engine):
+    metadata = MetaData()
+    Table('vStockAndIndex', metadata, Column('ID', Integer, primary_key=True), Column('Name', String))
+    Table('WatchOpenCloseSummary', metadata,
+          Column('SecurityNumber', Integer, primary_key=True),
+          Column('WatchOCS_Date', DateTime, primary_key=True),
+          *[Column(name, Float) for name in ('OpenPrice', 'HighestPrice', 'LowestPrice', 'LastSalePrice',
+                                             'TotalSharesTraded', 'TotalValueTradedin1000')])
+    Table('d_CustomerHistory', metadata,
+          Column('SecurityNumber', Integer, primary_key=True),
+          Column('SeqDate', DateTime, primary_key=True),
+          *[Column(f'{investor}Val{side}', Float) for investor in FLOW_INVESTORS for side in ('Buy', 'Sell')])
+    Table('vStockFundamentalByQuote2', metadata,
+          Column('SecurityNumber', Integer), Column('Fiscal', Integer), Column('Quarter', Integer),
+          Column('PE', Float), Column('PBV', Float), Column('DividendYield', Float))
+    Table('d_Finance', metadata,
+          *[Column(name, Integer) for name in ('SecurityID', 'Fiscal', 'Quarter', 'AccountID')],
+          Column('FinancialStatementType', String), Column('Amount', Float), Column('ImportDate', DateTime))
+    Table('d_Account', metadata, Column('AccountID', Integer, primary_key=True),
+          Column('AccountCode', String), Column('AccountNameEN', String))
+    Table('IndustryNo', metadata, Column('IndustryNumber', Integer, primary_key=True), Column('Name', String))
+    Table('SectorNo', metadata, Column('SectorNumber', Integer, primary_key=True),
+          Column('IndustryNumber', Integer), Column('Name', String))
+    Table('d_Compsec', metadata, Column('SecurityID', Integer, primary_key=True), Column('SecuritySymbol', String),
+          Column('SectorNo', Integer), Column('Market', String), Column('ListingStatus', String))
+    Table('d_Business', metadata, Column('SecuritySymbol', String, primary_key=True),
+          Column('CompanyNameEN', String), Column('BusinessEN', String))
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("""CREATE VIEW vFinancial AS
+            SELECT SecurityID AS SecurityNumber, Fiscal, Quarter, AccountID, 1 AS AccountFrom, ImportDate, Amount
+            FROM d_Finance WHERE FinancialStatementType = 'U'""")
+    return metadata
+
+
+def trading_days(days: int, start: datetime.date = datetime.date(2008, 1, 2)):
+    import numpy
+    first = numpy.busday_offset(numpy.datetime64(start, 'D'), 0, roll='forward')
+    days = numpy.busday_offset(first, numpy.arange(days)).astype('datetime64[D]').tolist()
+    return [datetime.datetime.combine(day, datetime.time()) for day in days]
+
+
+def insert(connection, table, rows):
+    for start in range(0, len(rows), BATCH):
+        connection.execute(table.insert(), rows[start:start + BATCH])
+
+
+def bars(rng, security: int, dates, start: float, volatility: float):
+    import numpy
+    close = numpy.round(start * numpy.exp(numpy.cumsum(rng.normal(0, volatility, size=len(dates)))), 2)
+    volume = rng.integers(1_000, 10_000_000, size=len(dates))
+    return [{'SecurityNumber': security, 'WatchOCS_Date': date, 'OpenPrice': float(c), 'HighestPrice': float(c) * 1.01,
+             'LowestPrice': float(c) * 0.99, 'LastSalePrice': float(c), 'TotalSharesTraded': float(v),
+             'TotalValueTradedin1000': float(v * c / 1000)}
+            for date, c, v in zip(dates, close, volume)]
+
+
+def fill_prices(engine, metadata, symbols: int, days: int, seed: int = 0):
+    import numpy
+    rng = numpy.random.default_rng(seed)
+    dates = trading_days(days)
+    with engine.begin() as connection:
+        insert(connection, metadata.tables['vStockAndIndex'],
+               [{'ID': i, 'Name': f'S{i:04d}'} for i in range(1, symbols + 1)])
+        for i in range(1, symbols + 1):
+            insert(connection, metadata.tables['WatchOpenCloseSummary'], bars(rng, i, dates, 10, 0.02))
+
+
+def indices():
+    """(ID, Name) of the index securities, SET and TFEX at their real IDs."""
+    names = ['mai'] + SET_INDUSTRIES + SET_SECTORS + MAI_SECTORS
+    return [(SET_INDEX, 'SET'), (TFEX_INDEX, 'TFEX')] + [(FIRST_INDEX + i, name) for i, name in enumerate(names)]
+
+
+def fill_market(engine, metadata, symbols: int, days: int, seed: int = 0):
+    import numpy
+    if symbols >= SET_INDEX:
+        raise ValueError(f'stock IDs must stay below the SET index ({SET_INDEX})')
+    rng = numpy.random.default_rng(seed + 1)
+    dates = trading_days(days)
+    tables = metadata.tables
+    with engine.begin() as connection:
+        insert(connection, tables['vStockAndIndex'], [{'ID': i, 'Name': name} for i, name in indices()])
+        for i, name in indices():
+            insert(connection, tables['WatchOpenCloseSummary'], bars(rng, i, dates, 1500 if name == 'SET' else 200, 0.01))
+
+        flows = []
+        for date in dates:
+            row = {'SecurityNumber': SET_INDEX, 'SeqDate': date}
+            for investor in FLOW_INVESTORS:
+                buy, sell = rng.gamma(4, 2500, size=2)
+                row[f'{investor}ValBuy'], row[f'{investor}ValSell'] = round(float(buy), 2), round(float(sell), 2)
+            flows.append(row)
+        insert(connection, tables['d_CustomerHistory'], flows)
+
+        insert(connection, tables['IndustryNo'],
+               [{'IndustryNumber': i + 1, 'Name': name[1:]} for i, name in enumerate(SET_INDUSTRIES)])
+        sectors = [(i + 1, i % len(SET_INDUSTRIES) + 1, name[1:]) for i, name in enumerate(SET_SECTORS)]
+        insert(connection, tables['SectorNo'],
+               [{'SectorNumber': number, 'IndustryNumber': industry, 'Name': name} for number, industry, name in sectors])
+        sector_of = rng.integers(1, len(sectors) + 1, size=symbols)
+        insert(connection, tables['d_Compsec'],
+               [{'SecurityID': i, 'SecuritySymbol': f'S{i:04d}', 'SectorNo': int(sector_of[i - 1]),
+                 'Market': 'mai' if i % 5 == 0 else 'SET', 'ListingStatus': 'D' if i % 50 == 0 else 'L'}
+                for i in range(1, symbols + 1)])
+        insert(connection, tables['d_Business'],
+               [{'SecuritySymbol': f'S{i:04d}', 'CompanyNameEN': f'Synthetic {i} PCL', 'BusinessEN': 'Synthetic business'}
+                for i in range(1, symbols + 1)])
+        insert(connection, tables['d_Account'],
+               [{'AccountID': i, 'AccountCode': f'A{i:03d}', 'AccountNameEN': name} for i, name in ACCOUNTS.items()])
+
+        quarters = [(year, quarter) for year in range(dates[0].year, dates[-1].year + 1) for quarter in range(1, 5)
+                    if datetime.datetime(year, 3 * quarter, 1) <= dates[-1]]
+        finance, fundamentals = [], []
+        for i in range(1, symbols + 1):
+            scale = float(rng.lognormal(8, 1.5))
+            growth = numpy.cumprod(1 + rng.normal(0.01, 0.05, size=(len(quarters), len(ACCOUNTS))), axis=0) * scale
+            for q, (year, quarter) in enumerate(quarters):
+                imported = datetime.datetime(year, 3 * quarter, 1) + datetime.timedelta(days=75 + int(rng.integers(0, 15)))
+                for a, account in enumerate(ACCOUNTS):
+                    finance.append({'SecurityID': i, 'Fiscal': year, 'Quarter': quarter, 'AccountID': account,
+                                    'FinancialStatementType': 'U', 'Amount': round(float(growth[q, a]), 2),
+                                    'ImportDate': imported})
+            year, quarter = quarters[-1]
+            fundamentals.append({'SecurityNumber': i, 'Fiscal': year, 'Quarter': quarter,
+                                 'PE': round(float(rng.lognormal(2.7, 0.4)), 2),
+                                 'PBV': round(float(rng.lognormal(0.3, 0.5)), 2),
+                                 'DividendYield': round(float(rng.uniform(0, 8)), 2)})
+        insert(connection, tables['d_Finance'], finance)
+        insert(connection, tables['vStockFundamentalByQuote2'], fundamentals)
+        connection.exec_driver_sql('CREATE INDEX ix_finance_import ON d_Finance (ImportDate)')
+        connection.exec_driver_sql('CREATE INDEX ix_finance_period ON d_Finance (SecurityID, Fiscal, Quarter)')
+
+
+def install(path: str, symbols: int = 1, days: int = 2500, seed: int = 0, market: bool = False):
+    engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+    if not inspect(engine).has_table('WatchOpenCloseSummary'):
+        metadata = create_tables(engine)
+        fill_prices(engine, metadata, symbols, days, seed)
+        if market:
+            fill_market(engine, metadata, symbols, days, seed)
+    os.environ.setdefault('YONG_DB_SCHEMA', 'main')
+    module = types.ModuleType('app.database')
+    module.engine = engine
+    module.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    module.Base = declarative_base()
+    sys.modules['app.database'] = module
+    return module
@@ -0,0 +1,90 @@
+"""to_json -> json.loads -> jsonable_encoder -> json.dumps vs one-pass
+responses.encode for the DataFrame-backed endpoints.
+
+    python -m benchmarks.encoding [--repeat 20]
+
+Payloads are synthetic frames shaped like each endpoint's response. Reports
+the best encode time and the tracemalloc peak of one encode.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy
+import pandas
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from app import breadth, responses
+from benchmarks.breadth import synthetic_frames
+
+
+def legacy_encode(payload):
+    # Dates are stringified first, as the tradesum and breadth endpoints did.
+    def loads(df):
+        if 'date' in df:
+            df = df.assign(date=df.date.astype(str))
+        if 'DATE' in df:
+            df = df.assign(DATE=df.DATE.astype(str))
+        return json.loads(df.to_json(orient='records', date_format='ISO'))
+    if isinstance(payload, dict):
+        payload = {key: loads(value) for key, value in payload.items()}
+    else:
+        payload = loads(payload)
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def tradesum_payload(days=3000, seed=0):
+    rng = numpy.random.default_rng(seed)
+    index = pandas.bdate_range('2010-01-01', periods=days, name='date')
+    columns = ['SETopen', 'SEThigh', 'SETlow', 'SETclose'] + \
+              [f'{investor}Val{side}' for investor in ('Fund', 'Foreign', 'Trading', 'Customer') for side in ('Buy', 'Sell', 'Net')]
+    df = pandas.DataFrame(numpy.round(rng.uniform(0, 1e5, size=(days, len(columns))), 2), index=index, columns=columns)
+    for column in ('FundValNet', 'ForeignValNet', 'TradingValNet', 'CustomerValNet'):
+        df[f'{column}Sum'] = df[column].cumsum().round(2)
+    return df.reset_index()
+
+
+def relative_payload(days=100, groups=27, seed=0):
+    rng = numpy.random.default_rng(seed)
+    index = pandas.bdate_range('2020-01-01', periods=days, name='date')
+    df = pandas.DataFrame(rng.uniform(1000, 2000, size=(days, 4)), index=index, columns=['open', 'high', 'low', 'close'])
+    for group in range(groups):
+        df[f'G{group}'] = rng.uniform(0.1, 1, size=days)
+    return df.reset_index()
+
+
+def measure(function, payload, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = function(payload)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function(payload)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    payloads = {'tradesum_set': tradesum_payload(),
+                'marketbreadth': breadth.market_breadth(*synthetic_frames(800, 3000)),
+                'relative': relative_payload()}
+    print(f'{"endpoint":14} {"KiB":>7} {"legacy ms":>10} {"encode ms":>10} {"legacy peak KiB":>16} {"encode peak KiB":>16}')
+    for name, payload in payloads.items():
+        legacy_time, legacy_peak, legacy_body = measure(legacy_encode, payload, args.repeat)
+        encode_time, encode_peak, body = measure(responses.encode, payload, args.repeat)
+        if json.loads(legacy_body) != json.loads(body):
+            raise SystemExit(f'{name}: encoded payload differs')
+        print(f'{name:14} {len(body) / 1024:7.0f} {legacy_time * 1000:10.2f} {encode_time * 1000:10.2f} '
+              f'{legacy_peak / 1024:16.0f} {encode_peak / 1024:16.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Blob container fixtures derived from a benchmarks.database file.
+
+write() puts what app.store and app.tfex_history download into a local
+directory, for YONG_BLOB_SOURCE / YONG_BLOB_WRITE_TARGET to point at:
+
+  INDEX.csv                      DATE x SET/SET100/SET50/MAI OHLC
+  STOCKS.csv, STOCKS_VOL.csv,    DATE x stock close, volume and value
+  STOCKS_VAL.csv
+  my_csv                         the TFEX investor-type history
+
+The marketdata.set.or.th pages come from benchmarks.stubs.
+"""
+import os
+
+import numpy
+import pandas
+
+
+def bars(engine):
+    columns = ['name', 'DATE', 'OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOLUME', 'VALUE']
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            'SELECT s.Name, w.WatchOCS_Date, w.OpenPrice, w.HighestPrice, w.LowestPrice, w.LastSalePrice, '
+            'w.TotalSharesTraded, w.TotalValueTradedin1000 '
+            'FROM WatchOpenCloseSummary AS w JOIN vStockAndIndex AS s ON s.ID = w.SecurityNumber').fetchall()
+    df = pandas.DataFrame(rows, columns=columns)
+    df['DATE'] = pandas.to_datetime(df['DATE'])
+    return df
+
+
+def write(directory: str, engine, seed: int = 0):
+    os.makedirs(directory, exist_ok=True)
+    df = bars(engine)
+    dates = '%Y-%m-%d'
+
+    index = {}
+    for prefix, name, scale in (('SET', 'SET', 1.0), ('SET100', 'SET', 0.15), ('SET50', 'SET', 0.6), ('MAI', 'mai', 1.0)):
+        ohlc = df[df['name'] == name].set_index('DATE')[['OPEN', 'HIGH', 'LOW', 'CLOSE']] * scale
+        for column in ohlc:
+            index[f'{prefix}_{column}'] = ohlc[column].round(2)
+    pandas.DataFrame(index).rename_axis('DATE').to_csv(os.path.join(directory, 'INDEX.csv'), date_format=dates)
+
+    stocks = df[df['name'].str.match(r'S\d{4}$')]
+    for file, column in (('STOCKS.csv', 'CLOSE'), ('STOCKS_VOL.csv', 'VOLUME'), ('STOCKS_VAL.csv', 'VALUE')):
+        wide = stocks.pivot(index='DATE', columns='name', values=column)
+        wide.to_csv(os.path.join(directory, file), date_format=dates)
+
+    rng = numpy.random.default_rng(seed + 2)
+    days = sorted(df.loc[df['name'] == 'TFEX', 'DATE'])
+    history = pandas.DataFrame({'date': days,
+                                **{column: rng.normal(0, 2000, size=len(days)).round(2)
+                                   for column in ('FundValNet', 'ForeignValNet', 'CustomerValNet')}})
+    history.to_csv(os.path.join(directory, 'my_csv'), index=False, date_format=dates)
+    return directory
+
@@ -0,0 +1,234 @@
+"""Every endpoint under concurrent load against synthetic data.
+
+    python -m benchmarks.load [--symbols 900] [--years 15] [--concurrency 16] [--requests 200]
+                              [--only prices,ohlcvv] [--data .bench-data] [--url http://host:port]
+                              [--save results.json] [--baseline results.json] [--tolerance 0.25]
+                              [--response-cache] [--snapshots]
+
+The SQLite database (benchmarks.database) and blob fixtures
+(benchmarks.fixtures) are generated once per size under --data and reused.
+The app runs in this process behind httpx's ASGI transport, startup events
+included, with marketdata.set.or.th served by benchmarks.stubs; --url loads
+a server started separately instead. The response cache is off unless
+--response-cache, so repeated requests measure the endpoints themselves,
+and the end-of-day pipeline (app.pipeline) only runs, once before the
+load, with --snapshots.
+
+Reports p50/p99 latency and throughput per endpoint. --save writes them as
+JSON; --baseline compares against such a file and exits 1 if any p50 or p99
+grew by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks import database, fixtures
+from benchmarks.stubs import StubMarketData
+
+# name -> path template. {symbol} and the like are drawn per request.
+CASES = {
+    'symbols': '/symbols/',
+    'symbol_name': '/symbol/name/{symbol}',
+    'prices': '/prices/{symbol}',
+    'prices_columns': '/prices/{symbol}?format=columns',
+    'prices_recent': '/prices/recent/{symbol}',
+    'ohlcvv': '/ohlcvv/{symbol}/200',
+    'ohlcvv_weekly': '/ohlcvv/{symbol}/200?timeframe=W',
+    'ohlcvv_batch': '/ohlcvv/batch?symbols={symbols}&length=200',
+    'businessinfo': '/businessinfo/{symbol}',
+    'industry': '/industry/',
+    'sector': '/sector/',
+    'sector_symbols': '/sector/{sector}',
+    'finance_by_sector': '/finance_by_sector?sector_id={sector}&feature_id={account}&fiscal={fiscal}&quarter={quarter}',
+    'financial_changes': '/financial/changes?since={since}&limit=1000',
+    'tradesum_set': '/tradesum_set/',
+    'tradesum_set_recent': '/tradesum_set/recent/{period}',
+    'tradesum_tfex_db': '/tradesum_tfex_db/',
+    'tradesum_tfex_db_recent': '/tradesum_tfex_db/recent/{period}',
+    'tradesum_tfex': '/tradesum_tfex/',
+    'tradesum_tfex_recent': '/tradesum_tfex/recent/{period}',
+    'marketbreadth': '/marketbreadth/',
+    'relative': '/relative/{group}',
+    'relative_ranks': '/relative/{group}/ranks?period={period_rows}',
+    'screen': '/screen?rsi_lt={rsi}&above_sma=200&sort=value&limit=50',
+    'tech_screen_set': '/tech_screen_set/',
+    'setmaiinfo': '/setmaiinfo',
+    'recent_tradesum_tfex': '/recent_tradesum_tfex',
+    'metrics': '/metrics',
+}
+
+
+def prepare(directory: str, symbols: int, days: int):
+    """Database and fixtures for one size, built on first use."""
+    root = os.path.join(directory, f'{symbols}x{days}')
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, 'market.db')
+    blobs = os.path.join(root, 'blobs')
+    if not os.path.exists(os.path.join(blobs, 'my_csv')):
+        print(f'generating {symbols} symbols x {days} days in {root}', file=sys.stderr)
+        engine = database.install(path, symbols=symbols, days=days, market=True).engine
+        fixtures.write(blobs, engine)
+    return path, blobs
+
+
+class Paths:
+    def __init__(self, symbols: int, days: int, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.symbols = [f'S{i:04d}' for i in range(1, symbols + 1)]
+        dates = database.trading_days(days)
+        self.years = list(range(dates[0].year, dates[-1].year))
+        self.dates = dates
+
+    def __call__(self, template: str) -> str:
+        rng = self.rng
+        return template.format(
+            symbol=rng.choice(self.symbols),
+            symbols=','.join(rng.sample(self.symbols, min(20, len(self.symbols)))),
+            sector=rng.randint(1, len(database.SET_SECTORS)),
+            account=rng.choice(list(database.ACCOUNTS)),
+            fiscal=rng.choice(self.years), quarter=rng.randint(1, 4),
+            since=rng.choice(self.dates[-260:]).date().isoformat(),
+            period=rng.choice(['RECENT', 'MTD', 'QTD', 'YTD']),
+            group=rng.choice(['SETIndustry', 'SETSector', 'MAISector']),
+            rsi=rng.choice([30, 50, 70]), period_rows=rng.choice([20, 60, 120, 250]))
+
+
+async def load(client, template: str, paths: Paths, requests: int, concurrency: int):
+    latencies, errors = [], []
+    pending = iter(range(requests))
+
+    async def worker():
+        for _ in pending:
+            path = paths(template)
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors.append(f'{path}: {response.status_code}')
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {'p50': statistics.median(latencies), 'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            'rps': len(latencies) / elapsed, 'errors': len(errors), 'first_error': errors[0] if errors else None}
+
+
+async def run(args, cases, paths):
+    import httpx
+    results = {}
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=120) as client:
+            for name in cases:
+                results[name] = await load(client, CASES[name], paths, args.requests, args.concurrency)
+                report(name, results[name])
+        return results
+
+    import app.main
+    async with app.main.app.router.lifespan_context(app.main.app):
+        transport = httpx.ASGITransport(app=app.main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=120) as client:
+            for name in cases:
+                # One untimed request per endpoint warms its caches and lazy imports.
+                await client.get(paths(CASES[name]))
+                results[name] = await load(client, CASES[name], paths, args.requests, args.concurrency)
+                report(name, results[name])
+    return results
+
+
+def report(name, result):
+    line = f'{name:24} {result["p50"] * 1000:9.1f} {result["p99"] * 1000:9.1f} {result["rps"]:9.1f}'
+    if result['errors']:
+        line += f'  {result["errors"]} errors, e.g. {result["first_error"]}'
+    print(line, flush=True)
+
+
+def compare(results, baseline, tolerance: float):
+    regressions = []
+    print(f'\n{"endpoint":24} {"p50 x":>9} {"p99 x":>9}')
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        ratios = {key: result[key] / before[key] for key in ('p50', 'p99') if before[key]}
+        flagged = [key for key, ratio in ratios.items() if ratio > 1 + tolerance]
+        if result['errors'] and not before['errors']:
+            flagged.append('errors')
+        print(f'{name:24} {ratios.get("p50", float("nan")):9.2f} {ratios.get("p99", float("nan")):9.2f}'
+              + ('  REGRESSION' if flagged else ''))
+        regressions.extend(f'{name} {key}' for key in flagged)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=900)
+    parser.add_argument('--years', type=int, default=15)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--only')
+    parser.add_argument('--data', default='.bench-data')
+    parser.add_argument('--url')
+    parser.add_argument('--save')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--response-cache', action='store_true')
+    parser.add_argument('--snapshots', action='store_true')
+    args = parser.parse_args()
+    cases = args.only.split(',') if args.only else list(CASES)
+    unknown = [name for name in cases if name not in CASES]
+    if unknown:
+        parser.error(f'unknown endpoints: {", ".join(unknown)}')
+
+    days = args.years * 261
+    path, blobs = prepare(args.data, args.symbols, days)
+    paths = Paths(args.symbols, days)
+    with tempfile.TemporaryDirectory() as scratch, StubMarketData() as stub:
+        if not args.url:
+            os.environ.update({
+                'SET_MARKETDATA_URL': stub.url,
+                'YONG_BLOB_SOURCE': blobs,
+                'YONG_BLOB_WRITE_TARGET': scratch,
+                'YONG_STORE_DIR': os.path.join(scratch, 'matrix-store'),
+                'TFEX_HISTORY_PATH': os.path.join(scratch, 'tfex-trade-history.csv'),
+                'TFEX_SYNC_INTERVAL': '3600',
+                'YONG_METADATA_SNAPSHOT': os.path.join(scratch, 'metadata-snapshot.pkl'),
+                'YONG_SNAPSHOT_DIR': os.path.join(scratch, 'analytics-snapshots'),
+                'YONG_REFRESHER_DIR': os.path.join(scratch, 'upstream-cache'),
+                'YONG_PIPELINE_INTERVAL': '0',
+                # Spawned pipeline workers could not import the installed
+                # app.database, so the tasks run on a thread.
+                'YONG_PIPELINE_WORKERS': '0',
+            })
+            if not args.response_cache:
+                os.environ['YONG_RESPONSE_CACHE_BYTES'] = '0'
+            # The TFEX history is seeded from the write target.
+            shutil.copyfile(os.path.join(blobs, 'my_csv'), os.path.join(scratch, 'my_csv'))
+            database.install(path)
+            if args.snapshots:
+                from app import pipeline
+                manifest = pipeline.get_pipeline().run(force=True, reason='benchmark')
+                print(f'pipeline: {manifest["seconds"]:.2f}s, failed: {", ".join(manifest["failed"]) or "none"}')
+        print(f'{"endpoint":24} {"p50 ms":>9} {"p99 ms":>9} {"req/s":>9}')
+        results = asyncio.run(run(args, cases, paths))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f'\nregressed beyond {args.tolerance:.0%}: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
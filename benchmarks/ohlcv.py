@@ -0,0 +1,105 @@
+"""Memory and lookup time of app.ohlcv's resident Series.
+
+    python -m benchmarks.ohlcv [--symbols 900] [--years 12] [--sample 20] [--data .bench-data]
+
+Loads every security of a synthetic database (benchmarks.database, built
+under --data as benchmarks.load does) into ohlcv.store and reports the
+bytes per bar and in total, against the dicts per bar the endpoints used to
+build for --sample of the securities (measured with tracemalloc and scaled
+to the whole universe). Then times last-200, date-range and last-two-bar
+lookups from the store against the per-request queries they replace.
+"""
+import argparse
+import statistics
+import sys
+import time
+import tracemalloc
+
+from benchmarks import database
+from benchmarks.load import prepare
+
+
+def legacy_ohlcvv(db, models, security_id, length):
+    # The pre-store /ohlcvv/ and /prices/recent/: one query, a dict per bar.
+    results = db.query(models.WatchOpenCloseSummary.OpenPrice,
+        models.WatchOpenCloseSummary.HighestPrice,
+        models.WatchOpenCloseSummary.LowestPrice,
+        models.WatchOpenCloseSummary.LastSalePrice,
+        models.WatchOpenCloseSummary.TotalSharesTraded,
+        models.WatchOpenCloseSummary.TotalValueTradedin1000,
+        models.WatchOpenCloseSummary.WatchOCS_Date,
+        ).filter(models.WatchOpenCloseSummary.SecurityNumber == security_id).order_by(
+        models.WatchOpenCloseSummary.WatchOCS_Date.desc()).limit(length).all()
+    return [{'open': round(item[0], 2), 'high': round(item[1], 2), 'low': round(item[2], 2),
+             'close': round(item[3], 2), 'volume': round(item[4], 2), 'value': round(item[5], 2) * 1000,
+             'date': item[6].date()}
+            for item in results]
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=900)
+    parser.add_argument('--years', type=int, default=12)
+    parser.add_argument('--sample', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--data', default='.bench-data')
+    args = parser.parse_args()
+
+    path, _ = prepare(args.data, args.symbols, args.years * 261)
+    database.install(path)
+    from app import crud, models, ohlcv, registry
+    db = sys.modules['app.database'].SessionLocal()
+    ids = [symbol['ID'] for symbol in registry.symbols.all(db)]
+    ohlcv.store.maxbytes = float('inf')
+
+    started = time.perf_counter()
+    tracemalloc.start()
+    for security_id in ids:
+        ohlcv.store.get(db, security_id)
+    store_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    load = time.perf_counter() - started
+    bars = sum(ohlcv.store.get(db, security_id).size for security_id in ids)
+    arrays = ohlcv.store.size
+
+    sample = ids[:args.sample]
+    sample_bars = sum(ohlcv.store.get(db, security_id).size for security_id in sample)
+    tracemalloc.start()
+    held = [legacy_ohlcvv(db, models, security_id, 10 ** 9) for security_id in sample]
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+
+    print(f'{len(ids)} securities, {bars:,} bars, loaded in {load:.1f}s')
+    print(f'{"":24} {"bytes/bar":>10} {"total MiB":>10}')
+    print(f'{"Series arrays":24} {arrays / bars:10.1f} {arrays / 2 ** 20:10.1f}')
+    print(f'{"Series, all allocations":24} {store_bytes / bars:10.1f} {store_bytes / 2 ** 20:10.1f}')
+    print(f'{"dict per bar (scaled)":24} {dict_bytes / sample_bars:10.1f} {dict_bytes / sample_bars * bars / 2 ** 20:10.1f}')
+
+    security_id = ids[0]
+    symbol_name = registry.symbols.by_id(db, security_id)['Name']
+    series = ohlcv.store.get(db, security_id)
+    middle = series.dates[series.size // 2].astype('datetime64[D]').item()
+    cases = (('last 200', lambda: ohlcv.get_ohlcvv(db, symbol_name, 200),
+              lambda: legacy_ohlcvv(db, models, security_id, 200)),
+             ('range, 100 bars', lambda: list(ohlcv.iter_prices(db, security_id, after=middle, limit=100)),
+              lambda: list(crud.iter_prices(db, security_id, after=middle, limit=100))),
+             ('last two', lambda: ohlcv.get_prices_pct_change(db, symbol_name),
+              lambda: legacy_ohlcvv(db, models, security_id, 2)))
+    print(f'\n{"lookup":24} {"store ms":>10} {"query ms":>10}')
+    for name, from_store, from_query in cases:
+        print(f'{name:24} {timed(from_store, args.repeat):10.3f} {timed(from_query, args.repeat):10.3f}')
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
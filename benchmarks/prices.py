@@ -0,0 +1,95 @@
+"""Buffered vs streamed /prices/{symbol_name} bodies.
+
+    python -m benchmarks.prices [--days 2500,25000]
+
+Each case runs in a fresh interpreter against a synthetic SQLite history
+(benchmarks.database) and reports time to first byte, total time, body
+size and how far peak RSS rose above the post-import baseline.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+CASES = ('legacy', 'records', 'columns', 'csv')
+
+
+def legacy_prices(db, models, symbol_id):
+    # The pre-streaming endpoint: every row as a dict, then one encode.
+    results = db.query(models.WatchOpenCloseSummary.OpenPrice,
+        models.WatchOpenCloseSummary.HighestPrice,
+        models.WatchOpenCloseSummary.LowestPrice,
+        models.WatchOpenCloseSummary.LastSalePrice,
+        models.WatchOpenCloseSummary.TotalSharesTraded,
+        models.WatchOpenCloseSummary.TotalValueTradedin1000,
+        models.WatchOpenCloseSummary.WatchOCS_Date,
+        ).filter(models.WatchOpenCloseSummary.SecurityNumber == symbol_id).all()
+    ohlc = [{'open': round(item[0], 2), 'high': round(item[1], 2), 'low': round(item[2], 2),
+             'close': round(item[3], 2), 'volume': round(item[4], 2), 'value': round(item[5], 2) * 1000,
+             'date': item[6].date()}
+            for item in results]
+    return {'symbol': 'S0001', 'data': ohlc}
+
+
+def run_case(case, path):
+    from benchmarks import database
+    database.install(path)
+    from fastapi.encoders import jsonable_encoder
+    from app import crud, models, responses
+    db = sys.modules['app.database'].SessionLocal()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    first = None
+    size = 0
+    if case == 'legacy':
+        body = json.dumps(jsonable_encoder(legacy_prices(db, models, 1)))
+        first = time.perf_counter()
+        size = len(body.encode())
+    else:
+        rows = crud.iter_prices(db, 1)
+        if case == 'records':
+            chunks = responses.price_records('S0001', rows)
+        elif case == 'columns':
+            chunks = responses.price_columns('S0001', rows)
+        else:
+            chunks = responses.price_csv(rows)
+        for chunk in chunks:
+            if first is None:
+                first = time.perf_counter()
+            size += len(chunk.encode())
+    total = time.perf_counter() - start
+    db.close()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'ttfb': first - start, 'total': total, 'bytes': size, 'rss_kb': peak - baseline}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', default='2500,25000')
+    parser.add_argument('--run', choices=CASES)
+    parser.add_argument('--db')
+    args = parser.parse_args()
+    if args.run:
+        return run_case(args.run, args.db)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for days in (int(d) for d in args.days.split(',')):
+            path = os.path.join(directory, f'prices-{days}.db')
+            subprocess.run([sys.executable, '-c', f'from benchmarks import database; database.install({path!r}, days={days})'], check=True)
+            print(f'{days} days')
+            print(f'  {"case":8} {"ttfb ms":>9} {"total ms":>9} {"KiB":>8} {"peak RSS +KiB":>14}')
+            for case in CASES:
+                output = subprocess.run([sys.executable, '-m', 'benchmarks.prices', '--run', case, '--db', path],
+                                        check=True, capture_output=True, text=True).stdout
+                result = json.loads(output)
+                print(f'  {case:8} {result["ttfb"] * 1000:9.1f} {result["total"] * 1000:9.1f} '
+                      f'{result["bytes"] / 1024:8.0f} {result["rss_kb"]:14d}')
+
+
+if __name__ == '__main__':
+    main()
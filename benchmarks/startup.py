@@ -0,0 +1,90 @@
+"""Worker start-up: import time, database round trips and time to first
+request, with and without a metadata snapshot.
+
+    python -m benchmarks.startup [--repeat 3]
+
+Each run is a fresh interpreter against a synthetic SQLite database
+(benchmarks.database). 'reflect' starts without app.models' snapshot file,
+'snapshot' with the file the previous run left. Round trips are what the
+import costs against SQL Server, where each one is a network hop, and
+startup trips those the startup hooks make on the event loop before the
+worker can serve (ones they hand to a thread are not counted). The heavy
+column lists which of pandas, numpy, bs4 and requests were actually loaded
+after the first request.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+CASES = ('reflect', 'snapshot')
+HEAVY = ('pandas', 'numpy', 'bs4', 'requests')
+
+
+def run_case(path):
+    start = time.perf_counter()
+    from benchmarks import database
+    database.install(path)
+    from sqlalchemy import event
+    round_trips = []
+
+    def count(*args):
+        # On the event loop's thread, a round trip holds up everything else.
+        try:
+            asyncio.get_running_loop()
+            round_trips.append('loop')
+        except RuntimeError:
+            round_trips.append('thread')
+
+    event.listen(sys.modules['app.database'].engine, 'before_cursor_execute', count)
+    import app.main
+    imported = time.perf_counter()
+    import_round_trips = len(round_trips)
+
+    from fastapi.testclient import TestClient
+    with TestClient(app.main.app) as client:
+        startup_round_trips = round_trips[import_round_trips:].count('loop')
+        response = client.get('/symbols/')
+        first = time.perf_counter()
+        assert response.status_code == 200, response.text
+    print(json.dumps({'import': imported - start, 'first_request': first - start,
+                      'round_trips': import_round_trips, 'startup_round_trips': startup_round_trips, 'heavy': [name for name in HEAVY if name in sys.modules]}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--run', action='store_true')
+    parser.add_argument('--db')
+    args = parser.parse_args()
+    if args.run:
+        return run_case(args.db)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'startup.db')
+        snapshot = os.path.join(directory, 'metadata-snapshot.pkl')
+        subprocess.run([sys.executable, '-c', f'from benchmarks import database; database.install({path!r}, symbols=50)'], check=True)
+        # The TFEX history sync starts with the app; keep its files out of the tree.
+        env = dict(os.environ, YONG_METADATA_SNAPSHOT=snapshot,
+                   TFEX_HISTORY_PATH=os.path.join(directory, 'tfex-trade-history.csv'))
+        print(f'{"case":8} {"import ms":>10} {"first request ms":>17} {"round trips":>12} {"startup trips":>14}  '
+              f'heavy modules loaded')
+        for case in CASES:
+            results = []
+            for _ in range(args.repeat):
+                if case == 'reflect' and os.path.exists(snapshot):
+                    os.remove(snapshot)
+                output = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--run', '--db', path],
+                                        check=True, capture_output=True, text=True, env=env).stdout
+                results.append(json.loads(output.splitlines()[-1]))
+            best = min(results, key=lambda result: result['first_request'])
+            print(f'{case:8} {best["import"] * 1000:10.0f} {best["first_request"] * 1000:17.0f} '
+                  f'{best["round_trips"]:12d} {best["startup_round_trips"]:14d}  {", ".join(best["heavy"]) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Local stand-ins for marketdata.set.or.th, with an optional artificial delay."""
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MARKET_SUMMARY = {
+    'SET': [('SETIndex', '1,612.45'), ('IndexPerformance', '+0.42%'), ('Change', '+6.78'),
+            ('Volume(Shares)', '18,412,845,112'), ('Value(MB)', '71,905.37')],
+    'mai': [('maiIndex', '512.18'), ('IndexPerformance', '-0.15%'), ('Change', '-0.77'),
+            ('Volume(Shares)', '1,214,003,889'), ('Value(MB)', '2,480.12')],
+}
+
+TFEX_INVESTOR_TYPES = [
+    ('สถาบันในประเทศ', '12,031', '11,877', '+154', '20,554', '21,001', '-447', '40,112', '39,819', '+293', '72,697'),
+    ('ทั้งหมด', '52,214', '51,917', '+297', '48,776', '49,233', '-457', '80,341', '80,181', '+160', '181,331'),
+]
+
+
+def market_summary_page(market):
+    rows = ''.join(f'<div class="row info"><div>{name}</div><div>{value}</div></div>'
+                   for name, value in MARKET_SUMMARY[market])
+    return f'<html><body>{rows}</body></html>'
+
+
+def tfex_investor_type_page():
+    rows = ''.join('<tr>' + ''.join(f'<td>{cell}</td>' for cell in row) + '</tr>' for row in TFEX_INVESTOR_TYPES)
+    return f'<html><body><table><tbody><tr></tr>{rows}</tbody></table></body></html>'
+
+
+class StubMarketData:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.hits = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub.hits += 1
+                time.sleep(stub.delay)
+                url = urllib.parse.urlparse(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                if url.path == '/mkt/marketsummary.do':
+                    body = market_summary_page(query.get('market', 'SET'))
+                elif url.path == '/tfx/tfexinvestortypetrading.do':
+                    body = tfex_investor_type_page()
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 128
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,94 @@
+"""Blocking sequential vs async concurrent /setmaiinfo fetches against a
+local stub upstream with artificial delays.
+
+    python -m benchmarks.upstream [--delays 0,0.1,0.3] [--clients 16]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas
+from bs4 import BeautifulSoup
+
+from app import upstream
+from benchmarks.stubs import StubMarketData
+
+
+def legacy_setmaiinfo(base_url):
+    def info(market):
+        page = urllib.request.urlopen(f'{base_url}/mkt/marketsummary.do?market={market}&language=en&country=US')
+        soup = BeautifulSoup(page, 'html.parser')
+        table_rows = soup.findAll('div', attrs={'class': 'row info'})
+        l = []
+        for tr in table_rows:
+            td = tr.find_all('div')
+            row = [tr.text.replace(" ","").replace("*","").replace("\r","").replace("\n","") for tr in td]
+            if len(row) > 0:
+                l.append(row)
+        df = pandas.DataFrame(l, columns=['name','value'])
+        df = df.set_index('name').drop('IndexPerformance')
+        return df.to_json().replace("\\","")
+    return {'set': json.loads(info('SET'))['value'], 'mai': json.loads(info('mai'))['value']}
+
+
+def run_legacy(base_url, clients, workers):
+    # A sync handler holds one of the threadpool's workers for the whole fetch.
+    def timed(_):
+        start = time.perf_counter()
+        legacy_setmaiinfo(base_url)
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(timed, range(clients)))
+    return latencies, time.perf_counter() - start
+
+
+async def run_async(clients):
+    async def timed():
+        start = time.perf_counter()
+        await upstream.set_mai_summary()
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(timed() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    await upstream.close()
+    return latencies, elapsed
+
+
+async def fetch_once():
+    try:
+        return await upstream.set_mai_summary()
+    finally:
+        await upstream.close()
+
+
+def report(label, latencies, elapsed):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f'  {label:<8} min {latencies[0] * 1000:7.1f} ms  p50 {statistics.median(latencies) * 1000:7.1f} ms  '
+          f'p99 {p99 * 1000:7.1f} ms  wall {elapsed * 1000:7.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--delays', default='0,0.1,0.3')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    for delay in [float(d) for d in args.delays.split(',')]:
+        with StubMarketData(delay) as stub:
+            upstream.MARKETDATA_URL = stub.url
+            if legacy_setmaiinfo(stub.url) != asyncio.run(fetch_once()):
+                raise SystemExit('async fetch layer returned a different payload')
+            print(f'upstream delay {delay * 1000:.0f} ms, {args.clients} concurrent clients')
+            report('blocking', *run_legacy(stub.url, args.clients, args.workers))
+            report('async', *asyncio.run(run_async(args.clients)))
+
+
+if __name__ == '__main__':
+    main()